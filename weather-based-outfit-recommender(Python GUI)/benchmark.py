@@ -0,0 +1,437 @@
+# benchmark.py - Performance benchmark script
+"""
+Benchmarks for the weather and recommendation pipeline.
+Runs against a local stub HTTP server (stub_server.py), so no API key or internet access is needed.
+"""
+
+import sys
+import time
+from datetime import datetime
+
+SAMPLE_WEATHER = {
+    'coord': {'lon': 72.85, 'lat': 19.01},
+    'weather': [{'id': 721, 'main': 'Haze', 'description': 'haze', 'icon': '50d'}],
+    'main': {'temp': 29.99, 'feels_like': 34.18, 'temp_min': 29.94, 'temp_max': 29.99,
+             'pressure': 1009, 'humidity': 70},
+    'visibility': 3000,
+    'wind': {'speed': 4.63, 'deg': 270},
+    'clouds': {'all': 40},
+    'dt': 1700000000,
+    'sys': {'country': 'IN', 'sunrise': 1699923000, 'sunset': 1699964000},
+    'id': 1275339,
+    'name': 'Mumbai',
+    'cod': 200
+}
+
+def start_stub_server(**options):
+    """Start a stub server that answers any city with SAMPLE_WEATHER and return it."""
+    from stub_server import StubWeatherServer
+    return StubWeatherServer([SAMPLE_WEATHER], any_city=True, **options).start()
+
+def unlimited_rate_limiter():
+    """Return a token bucket that never runs dry, so benchmarks measure the client only."""
+    from rate_limiter import TokenBucket
+    return TokenBucket(calls_per_minute=10 ** 9, burst=10 ** 9)
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of a list of samples."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def format_latencies(label, samples):
+    """Format p50/p99 latencies in milliseconds."""
+    return (f"{label:.<35} p50 {percentile(samples, 50) * 1000:7.3f} ms"
+            f" | p99 {percentile(samples, 99) * 1000:7.3f} ms")
+
+def benchmark_http_session(iterations=500):
+    """Compare a bare requests.get per call with WeatherAPI's pooled keep-alive session."""
+    print("\nBenchmarking HTTP client (bare requests.get vs pooled session)...")
+
+    import requests
+    from weather_api import WeatherAPI
+
+    stub = start_stub_server()
+    base_url = stub.base_url
+    try:
+        params = {'q': 'Mumbai', 'appid': 'benchmark', 'units': 'metric'}
+
+        bare = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            requests.get(base_url, params=params, timeout=10).json()
+            bare.append(time.perf_counter() - start)
+
+        weather_api = WeatherAPI(base_url=base_url, rate_limiter=unlimited_rate_limiter())
+        pooled = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            weather_api._fetch_weather_data('Mumbai')
+            pooled.append(time.perf_counter() - start)
+        weather_api.close()
+
+        print(format_latencies("Before: requests.get per call", bare))
+        print(format_latencies("After: pooled keep-alive session", pooled))
+        return True
+    finally:
+        stub.stop()
+
+def benchmark_multi_city(city_count=40, latency=0.05):
+    """Compare fetching many cities one by one with AsyncWeatherAPI.get_weather_many."""
+    print(f"\nBenchmarking multi-city fetch ({city_count} cities, {latency * 1000:.0f} ms upstream latency)...")
+
+    import asyncio
+    from weather_api import WeatherAPI, AsyncWeatherAPI, WeatherCache
+
+    stub = start_stub_server(latency=latency)
+    base_url = stub.base_url
+    try:
+        cities = [f"City {i}" for i in range(city_count)]
+
+        # Every stub city has the same coordinates, so each run gets its own location map
+        # to keep the geo cache from serving later cities out of one cell
+        weather_api = WeatherAPI(cache=WeatherCache(), base_url=base_url, rate_limiter=unlimited_rate_limiter(),
+                                 city_locations_cache=WeatherCache(ttl=float('inf')))
+        start = time.perf_counter()
+        sequential = [weather_api.parse_weather_data(weather_api.get_weather_data(city)) for city in cities]
+        sequential_time = time.perf_counter() - start
+        weather_api.close()
+
+        async_api = AsyncWeatherAPI(WeatherAPI(cache=WeatherCache(), base_url=base_url,
+                                               rate_limiter=unlimited_rate_limiter(),
+                                               city_locations_cache=WeatherCache(ttl=float('inf'))))
+        start = time.perf_counter()
+        concurrent = asyncio.run(async_api.get_weather_many(cities))
+        concurrent_time = time.perf_counter() - start
+        async_api.close()
+        async_api.weather_api.close()
+
+        print(f"{'Sequential get_weather_data':.<35} {sequential_time * 1000:9.1f} ms ({len(sequential)} cities)")
+        print(f"{'get_weather_many':.<35} {concurrent_time * 1000:9.1f} ms "
+              f"({sum(1 for v in concurrent.values() if v)} cities, concurrency {async_api.concurrency})")
+        return True
+    finally:
+        stub.stop()
+
+def benchmark_hedging(iterations=400, slow_rate=0.03, slow_latency=0.5):
+    """Compare tail latency of upstream fetches with and without hedged requests."""
+    print(f"\nBenchmarking hedged requests ({iterations} calls, {slow_rate:.0%} answered after "
+          f"{slow_latency * 1000:.0f} ms)...")
+
+    import random
+    from weather_api import WeatherAPI, RequestHedger
+
+    stub = start_stub_server(latency=0.01, jitter=0.005, slow_rate=slow_rate, slow_latency=slow_latency)
+    try:
+        results = {}
+        for hedging in (False, True):
+            weather_api = WeatherAPI(base_url=stub.base_url, rate_limiter=unlimited_rate_limiter(),
+                                     hedger=RequestHedger(), hedging=hedging)
+            for _ in range(50):  # Fill the latency window before measuring
+                weather_api._fetch_weather_data('Mumbai')
+            warmup = weather_api.get_hedge_stats()
+            random.seed(42)  # Both runs see the same slow responses
+
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                weather_api._fetch_weather_data('Mumbai')
+                samples.append(time.perf_counter() - start)
+            stats = weather_api.get_hedge_stats()
+            stats['hedged'] -= warmup['hedged']
+            stats['hedge_wins'] -= warmup['hedge_wins']
+            results[hedging] = (samples, stats)
+            weather_api.close()
+
+        baseline, hedged = results[False][0], results[True][0]
+        stats = results[True][1]
+        print(format_latencies("Before: single attempt", baseline))
+        print(format_latencies("After: hedged at p95", hedged))
+        print(f"{'Hedge rate':.<35} {stats['hedged'] / iterations:.1%} ({stats['hedge_wins']} hedges answered "
+              f"first, delay {stats['hedge_delay_ms']} ms)")
+        print(f"{'p99 improvement':.<35} {(1 - percentile(hedged, 99) / percentile(baseline, 99)) * 100:.0f}%")
+        return True
+    finally:
+        stub.stop()
+
+def synthetic_outfits(count, seed=42):
+    """Generate a random outfit catalog shaped like outfit_dataset.csv."""
+    import random
+
+    rng = random.Random(seed)
+    categories = ['Top', 'Bottom', 'Footwear', 'Outerwear', 'Accessory']
+    conditions = ['clear', 'clouds', 'rain', 'snow', 'thunderstorm']
+    outfits = []
+    for i in range(count):
+        temp_min = rng.randint(-30, 40)
+        humidity_min = rng.choice([0, 20, 40])
+        outfits.append({
+            'clothing_type': f'Item {i}',
+            'category': rng.choice(categories),
+            'temp_min': temp_min,
+            'temp_max': temp_min + rng.randint(5, 30),
+            'humidity_min': humidity_min,
+            'humidity_max': rng.choice([60, 80, 100]),
+            'weather_conditions': rng.sample(conditions, rng.randint(1, 3)),
+            'season': rng.choice(['summer', 'winter', 'monsoon', 'all']),
+            'material': rng.choice(['cotton', 'wool', 'denim', 'leather', 'polyester']),
+            'comfort_rating': rng.randint(1, 10),
+            'description': 'Synthetic benchmark item ' * 4
+        })
+    return outfits
+
+def benchmark_outfit_query(count=100000, queries=200):
+    """Compare get_suitable_outfits' find and aggregate query modes on a synthetic catalog (needs MongoDB)."""
+    print(f"\nBenchmarking outfit query modes ({count} items, {queries} queries)...")
+
+    import random
+    import bson
+    from db_handler import DatabaseHandler
+
+    db = DatabaseHandler(outfit_index_enabled=False)
+    if not db.test_connection():
+        print("⚠ MongoDB not reachable, skipping outfit query benchmark")
+        return False
+
+    # A scratch collection, so the real catalog is left alone
+    db.outfit_collection = db.db['outfit_benchmark']
+    try:
+        db.outfit_collection.drop()
+        outfits = synthetic_outfits(count)
+        for start in range(0, count, 10000):
+            db.outfit_collection.insert_many(outfits[start:start + 10000])
+        db.ensure_indexes()
+
+        rng = random.Random(7)
+        weather = [(rng.uniform(-10, 40), rng.randint(10, 95), rng.choice(['clear', 'clouds', 'rain', 'snow']))
+                   for _ in range(queries)]
+        for mode in ('find', 'aggregate'):
+            db._query_suitable_outfits(*weather[0], mode=mode)  # Warm the plan cache
+            samples = []
+            documents = 0
+            size = 0
+            categories = 0
+            for temperature, humidity, condition in weather:
+                start = time.perf_counter()
+                results = db._query_suitable_outfits(temperature, humidity, condition, mode=mode)
+                samples.append(time.perf_counter() - start)
+                documents += len(results)
+                size += sum(len(bson.encode(result)) for result in results)
+                categories += len({result.get('category') for result in results})
+            print(format_latencies(f"{mode}", samples))
+            print(f"{'':.<35} {documents / queries:5.1f} items, {size / queries / 1024:6.1f} KiB, "
+                  f"{categories / queries:.1f} of 5 categories per query")
+        return True
+    finally:
+        db.outfit_collection.drop()
+        db.close_connection()
+
+def legacy_parse_weather_data(raw_data):
+    """Build the parsed-weather dict the way parse_weather_data did before ParsedWeather."""
+    return {
+        'city': raw_data.get('name', 'Unknown'),
+        'country': raw_data.get('sys', {}).get('country', 'Unknown'),
+        'temperature': round(raw_data.get('main', {}).get('temp', 0), 1),
+        'feels_like': round(raw_data.get('main', {}).get('feels_like', 0), 1),
+        'humidity': raw_data.get('main', {}).get('humidity', 0),
+        'pressure': raw_data.get('main', {}).get('pressure', 0),
+        'weather_main': raw_data.get('weather', [{}])[0].get('main', 'Unknown'),
+        'weather_description': raw_data.get('weather', [{}])[0].get('description', 'Unknown'),
+        'wind_speed': raw_data.get('wind', {}).get('speed', 0),
+        'wind_direction': raw_data.get('wind', {}).get('deg', 0),
+        'cloudiness': raw_data.get('clouds', {}).get('all', 0),
+        'visibility': raw_data.get('visibility', 0),
+        'sunrise': datetime.fromtimestamp(raw_data.get('sys', {}).get('sunrise', 0)).strftime('%H:%M:%S'),
+        'sunset': datetime.fromtimestamp(raw_data.get('sys', {}).get('sunset', 0)).strftime('%H:%M:%S'),
+        'fetch_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'raw_data': raw_data
+    }
+
+def benchmark_parsed_weather(count=10000):
+    """Compare memory and stored document size of the legacy parsed dict and ParsedWeather."""
+    print(f"\nBenchmarking parsed weather records ({count} records)...")
+
+    import copy
+    import tracemalloc
+    import bson
+    from weather_api import WeatherAPI
+
+    weather_api = WeatherAPI()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    # Each request parses its own freshly decoded payload
+    payloads = [copy.deepcopy(SAMPLE_WEATHER) for _ in range(count)]
+    payload_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+
+    before = tracemalloc.take_snapshot()
+    legacy = [legacy_parse_weather_data(payload) for payload in payloads]
+    legacy_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    del legacy
+
+    before = tracemalloc.take_snapshot()
+    slotted = [weather_api.parse_weather_data(payload) for payload in payloads]
+    slotted_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+
+    # The legacy dict keeps its payload alive through raw_data; ParsedWeather lets it be freed
+    legacy_doc = legacy_parse_weather_data(SAMPLE_WEATHER)
+    legacy_doc['timestamp'] = datetime.utcnow()
+    slotted_doc = slotted[0].to_bson()
+    slotted_doc['timestamp'] = datetime.utcnow()
+    legacy_size = len(bson.encode(legacy_doc))
+    slotted_size = len(bson.encode(slotted_doc))
+
+    print(f"{'Legacy dict per record':.<35} {(legacy_bytes + payload_bytes) / count:8.0f} B in memory "
+          f"(including {payload_bytes / count:.0f} B raw payload)")
+    print(f"{'ParsedWeather per record':.<35} {slotted_bytes / count:8.0f} B in memory")
+    print(f"{'Legacy weather document':.<35} {legacy_size:8d} B BSON (stored twice: weather_data + recommendations)")
+    print(f"{'ParsedWeather document':.<35} {slotted_size:8d} B BSON "
+          f"({(1 - slotted_size / legacy_size) * 100:.0f}% smaller)")
+    return True
+
+def benchmark_recommendation_storage(count=1000, catalog_size=500):
+    """Compare the stored size of embedded and normalized recommendation documents."""
+    print(f"\nBenchmarking recommendation storage ({count} recommendations, {catalog_size} catalog items)...")
+
+    import random
+    import bson
+    from config import OUTFIT_TOP_K_PER_CATEGORY
+    from db_handler import normalize_recommendation
+    from outfit_catalog import OutfitCatalogIndex, OUTFIT_FIELDS
+    from outfit_recommender import build_recommendations
+    from weather_api import WeatherAPI
+
+    catalog = synthetic_outfits(catalog_size)
+    for outfit in catalog:
+        outfit['_id'] = bson.ObjectId()
+    weather = WeatherAPI().parse_weather_data(SAMPLE_WEATHER).to_bson()
+
+    rng = random.Random(7)
+    conditions = [(rng.uniform(-10, 40), rng.randint(10, 95), rng.choice(['clear', 'clouds', 'rain', 'snow']))
+                  for _ in range(count)]
+    # 'find' mode stores whole outfit documents, 'aggregate' mode projected ones
+    for mode, index in (('find', OutfitCatalogIndex(catalog)),
+                        ('aggregate', OutfitCatalogIndex(catalog, OUTFIT_TOP_K_PER_CATEGORY, OUTFIT_FIELDS))):
+        embedded_size = normalized_size = 0
+        for temperature, humidity, condition in conditions:
+            outfits = build_recommendations(index.find_suitable(temperature, humidity, condition),
+                                            temperature, condition)
+            document = {'_id': bson.ObjectId(), 'city': 'Mumbai', 'weather': dict(weather, temperature=temperature),
+                        'recommended_outfits': outfits, 'recommendation_count': len(outfits),
+                        'timestamp': datetime.utcnow()}
+            embedded_size += len(bson.encode(document))
+            normalized_size += len(bson.encode(normalize_recommendation(document, bson.ObjectId())))
+        print(f"{f'Embedded ({mode})':.<35} {embedded_size / count:8.0f} B BSON per recommendation")
+        print(f"{f'Normalized ({mode})':.<35} {normalized_size / count:8.0f} B BSON per recommendation "
+              f"({(1 - normalized_size / embedded_size) * 100:.0f}% smaller)")
+    return True
+
+def run_recommend_path(db, catalog, requests):
+    """Time the database side of /api/recommend and a history read for each request; return the two sample lists."""
+    from outfit_recommender import build_recommendations
+    from weather_api import WeatherAPI
+
+    db.insert_outfit_data(catalog)
+    db.ensure_indexes()
+    weather = WeatherAPI().parse_weather_data(SAMPLE_WEATHER).to_bson()
+    recommend_samples = []
+    history_samples = []
+    for temperature, humidity, condition in requests:
+        start = time.perf_counter()
+        document = dict(weather, temperature=temperature, humidity=humidity)
+        weather_ref = db.insert_weather_data(document)
+        outfits = build_recommendations(db.get_suitable_outfits(temperature, humidity, condition),
+                                        temperature, condition)
+        db.insert_recommendation({'city': document['city'], 'weather': document, 'recommended_outfits': outfits,
+                                  'recommendation_count': len(outfits)}, weather_ref)
+        recommend_samples.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        db.get_recommendations_history(limit=10, summary=True)
+        history_samples.append(time.perf_counter() - start)
+    return recommend_samples, history_samples
+
+def benchmark_backends(catalog_size=2000, requests=500):
+    """Compare the MongoDB and SQLite backends on the recommend path (weather, outfits and recommendation writes)."""
+    print(f"\nBenchmarking storage backends ({catalog_size} catalog items, {requests} requests)...")
+
+    import os
+    import random
+    import tempfile
+    from db_handler import DatabaseHandler
+    from sqlite_handler import SQLiteDatabaseHandler
+
+    rng = random.Random(7)
+    weather = [(rng.uniform(-10, 40), rng.randint(10, 95), rng.choice(['clear', 'clouds', 'rain', 'snow']))
+               for _ in range(requests)]
+    # Both backends query the database on every request: no catalog index and no write-behind queue
+    options = {'outfit_index_enabled': False, 'write_behind': False}
+
+    directory = tempfile.mkdtemp()
+    db = SQLiteDatabaseHandler(path=os.path.join(directory, 'benchmark.db'), **options)
+    try:
+        recommend, history = run_recommend_path(db, synthetic_outfits(catalog_size), weather)
+        print(format_latencies("SQLite recommend", recommend))
+        print(format_latencies("SQLite history", history))
+    finally:
+        db.close_connection()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    db = DatabaseHandler(**options)
+    if not db.test_connection():
+        print("⚠ MongoDB not reachable, skipping the MongoDB side of the backend benchmark")
+        return True
+
+    # Scratch collections, so stored data is left alone
+    db.weather_collection = db.db['benchmark_weather']
+    db.outfit_collection = db.db['outfit_benchmark']
+    db.recommendations_collection = db.db['benchmark_recommendations']
+    db.daily_summary_collection = db.db['benchmark_daily_summary']
+    scratch = ('weather_collection', 'outfit_collection', 'recommendations_collection', 'daily_summary_collection')
+    try:
+        for attribute in scratch:
+            getattr(db, attribute).drop()
+        recommend, history = run_recommend_path(db, synthetic_outfits(catalog_size), weather)
+        print(format_latencies("MongoDB recommend", recommend))
+        print(format_latencies("MongoDB history", history))
+        return True
+    finally:
+        for attribute in scratch:
+            getattr(db, attribute).drop()
+        db.close_connection()
+
+def main():
+    """Run all benchmarks."""
+    print("=" * 50)
+    print("Weather-Based Outfit Recommendation System")
+    print("Benchmark Script")
+    print("=" * 50)
+    print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    benchmarks = [
+        ("HTTP Session", benchmark_http_session),
+        ("Multi-City Fetch", benchmark_multi_city),
+        ("Hedged Requests", benchmark_hedging),
+        ("Parsed Weather", benchmark_parsed_weather),
+        ("Recommendation Storage", benchmark_recommendation_storage),
+        ("Outfit Query Modes", benchmark_outfit_query),
+        ("Storage Backends", benchmark_backends)
+    ]
+
+    for name, benchmark in benchmarks:
+        try:
+            benchmark()
+        except Exception as e:
+            print(f"✗ {name} benchmark failed: {e}")
+
+    print(f"\nCompleted at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\nBenchmark interrupted by user")
+        sys.exit(1)
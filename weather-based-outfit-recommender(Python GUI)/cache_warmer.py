@@ -0,0 +1,192 @@
+# cache_warmer.py
+"""
+Background cache warming for the most requested cities.
+
+The warmer ranks cities by how often they appear in the recommendations
+collection and refreshes their cached weather shortly before it expires,
+without exceeding a per-minute API-call budget.
+
+Inside the Flask process (CACHE_WARMER_ENABLED in config.py) it keeps the
+in-memory weather cache warm. Run on its own (python cache_warmer.py) it
+cannot reach another process's memory, so it stores each refresh in the
+weather_data collection instead, keeping the circuit-breaker fallback current.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from config import (CACHE_WARMER_TOP_N, CACHE_WARMER_WINDOW_HOURS, CACHE_WARMER_LEAD_TIME,
+                    CACHE_WARMER_INTERVAL, CACHE_WARMER_RANK_INTERVAL, CACHE_WARMER_CALLS_PER_MINUTE)
+from weather_api import ERROR_RATE_LIMITED
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class CacheWarmer:
+    def __init__(self, weather_api, db, top_n=CACHE_WARMER_TOP_N, window_hours=CACHE_WARMER_WINDOW_HOURS,
+                 lead_time=CACHE_WARMER_LEAD_TIME, interval=CACHE_WARMER_INTERVAL,
+                 rank_interval=CACHE_WARMER_RANK_INTERVAL, calls_per_minute=CACHE_WARMER_CALLS_PER_MINUTE,
+                 store_weather=False):
+        """
+        Initialize the cache warmer.
+
+        Args:
+            weather_api (WeatherAPI): API handler whose cache is warmed
+            db (DatabaseHandler): Database used to rank cities
+            top_n (int): Number of most requested cities kept warm
+            window_hours (float): How far back requests are counted when ranking
+            lead_time (float): Seconds before expiry at which an entry is refreshed
+            interval (float): Seconds between warming passes
+            rank_interval (float): Seconds between re-ranking popular cities
+            calls_per_minute (int): API-call budget for refreshes
+            store_weather (bool): Also store each refresh in the weather collection
+        """
+        self.weather_api = weather_api
+        self.db = db
+        self.top_n = top_n
+        self.window_hours = window_hours
+        self.lead_time = lead_time
+        self.interval = interval
+        self.rank_interval = rank_interval
+        self.calls_per_minute = calls_per_minute
+        self.store_weather = store_weather
+
+        self._popular_cities = []
+        self._ranked_at = None
+        self._call_times = deque()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.refreshes = 0
+        self.failures = 0
+        self.budget_exhausted = 0
+        self.last_run = None
+
+    def start(self):
+        """Start warming in a daemon thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='cache-warmer', daemon=True)
+        self._thread.start()
+        logger.info(f"Cache warmer started (top {self.top_n} cities, {self.calls_per_minute} calls/min)")
+
+    def stop(self):
+        """Stop the warming thread."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+        logger.info("Cache warmer stopped")
+
+    def _run(self):
+        """Warm the cache every interval seconds until stopped."""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Cache warming pass failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def run_once(self):
+        """
+        Run a single warming pass.
+
+        Returns:
+            int: Number of cities refreshed
+        """
+        now = time.monotonic()
+        if self._ranked_at is None or now - self._ranked_at >= self.rank_interval:
+            since = datetime.utcnow() - timedelta(hours=self.window_hours)
+            self._popular_cities = self.db.get_popular_cities(limit=self.top_n, since=since)
+            self._ranked_at = now
+
+        refreshed = 0
+        for entry in self._popular_cities:
+            city = entry['city']
+            fresh_seconds = self.weather_api.get_cache_fresh_seconds(city)
+            if fresh_seconds is not None and fresh_seconds > self.lead_time:
+                continue
+            if self.weather_api.check_request(city):
+                continue  # Unknown city or API paused; nothing to gain from a call
+            if not self._take_budget():
+                with self._lock:
+                    self.budget_exhausted += 1
+                break
+
+            weather_data = self.weather_api.refresh_weather_data(city)
+            if not weather_data and self.weather_api.get_last_error() == ERROR_RATE_LIMITED:
+                # The shared bucket has no background tokens left; the rest would be refused too
+                with self._lock:
+                    self.budget_exhausted += 1
+                break
+            with self._lock:
+                if weather_data:
+                    self.refreshes += 1
+                    refreshed += 1
+                else:
+                    self.failures += 1
+
+            if weather_data and self.store_weather:
+                parsed = self.weather_api.parse_weather_data(weather_data)
+                if parsed:
+                    self.db.insert_weather_data(parsed)
+
+        self.last_run = datetime.utcnow()
+        if refreshed:
+            logger.info(f"Cache warmer refreshed {refreshed} cities")
+        return refreshed
+
+    def _take_budget(self):
+        """Reserve one API call from the per-minute budget. Returns False if the budget is spent."""
+        now = time.monotonic()
+        with self._lock:
+            while self._call_times and now - self._call_times[0] >= 60:
+                self._call_times.popleft()
+            if len(self._call_times) >= self.calls_per_minute:
+                return False
+            self._call_times.append(now)
+            return True
+
+    def get_stats(self):
+        """Get refresh rate and budget usage."""
+        now = time.monotonic()
+        with self._lock:
+            calls_last_minute = sum(1 for t in self._call_times if now - t < 60)
+            return {
+                'running': bool(self._thread and self._thread.is_alive()),
+                'tracked_cities': len(self._popular_cities),
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'refresh_rate_per_minute': calls_last_minute,
+                'budget_per_minute': self.calls_per_minute,
+                'budget_used': round(calls_last_minute / self.calls_per_minute, 3) if self.calls_per_minute else 0.0,
+                'budget_exhausted': self.budget_exhausted,
+                'last_run': self.last_run.isoformat() if self.last_run else None
+            }
+
+# Run the warmer as a separate worker process
+if __name__ == "__main__":
+    from db_handler import create_database_handler
+    from weather_api import WeatherAPI
+
+    db = create_database_handler()
+    weather_api = WeatherAPI()
+    warmer = CacheWarmer(weather_api, db, store_weather=True)
+
+    print(f"Cache warmer worker running (top {warmer.top_n} cities, "
+          f"{warmer.calls_per_minute} calls/min). Press Ctrl+C to stop.")
+    warmer.start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Cache warmer stats: {warmer.get_stats()}")
+    except KeyboardInterrupt:
+        print("\nStopping cache warmer...")
+    finally:
+        warmer.stop()
+        weather_api.close()
+        db.close_connection()
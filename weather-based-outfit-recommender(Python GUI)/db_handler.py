@@ -1,24 +1,383 @@
 # db_handler.py
 import pymongo
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, IndexModel, ReplaceOne, ASCENDING, DESCENDING
+import bson
+from bson import ObjectId
+from datetime import datetime, timedelta
 import logging
 import json
-from config import MONGO_URI, DATABASE_NAME, WEATHER_COLLECTION, OUTFIT_COLLECTION, RECOMMENDATIONS_COLLECTION
+import threading
+import atexit
+import argparse
+import base64
+from bson import json_util
+from config import (MONGO_URI, DATABASE_NAME, WEATHER_COLLECTION, OUTFIT_COLLECTION, RECOMMENDATIONS_COLLECTION,
+                    OUTFIT_INDEX_ENABLED, OUTFIT_QUERY_MODE, OUTFIT_TOP_K_PER_CATEGORY, WRITE_BEHIND_ENABLED,
+                    RECOMMENDATION_STORAGE, DAILY_SUMMARY_COLLECTION, RAW_WEATHER_COLLECTION, WEATHER_RETENTION_DAYS,
+                    RECOMMENDATION_RETENTION_DAYS, ROLLUP_LOOKBACK_DAYS, RAW_WEATHER_CAPPED_MB,
+                    COLLECTION_PAGE_SIZE, COLLECTION_PAGE_MAX, DATABASE_BACKEND)
+from outfit_catalog import OutfitCatalogIndex, outfit_rank_key, is_number, SUITABLE_OUTFITS_LIMIT, OUTFIT_FIELDS
+from write_behind import WriteBehindBuffer
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Case-insensitive matching for city names
+CITY_COLLATION = {'locale': 'en', 'strength': 2}
+
+DATABASE_BACKENDS = ('mongodb', 'sqlite')
+
+OUTFIT_QUERY_MODES = ('find', 'aggregate')
+# Oldest MongoDB server with $topN, which 'aggregate' mode needs
+TOP_N_MIN_SERVER_VERSION = (5, 2)
+# Fields the catalog index reads besides OUTFIT_FIELDS
+OUTFIT_INDEX_FIELDS = ['humidity_min', 'humidity_max', 'weather_conditions']
+
+RECOMMENDATION_STORAGE_MODES = ('embedded', 'normalized')
+# Weather fields kept in normalized recommendations, for history lists and analytics
+RECOMMENDATION_WEATHER_FIELDS = ['temperature', 'feels_like', 'humidity', 'weather_main', 'weather_description',
+                                 'stale']
+# Fields read by history lists (get_recommendations_history(summary=True))
+HISTORY_FIELDS = ['city', 'timestamp', 'recommendation_count'] + [f'weather.{field}'
+                                                                  for field in RECOMMENDATION_WEATHER_FIELDS]
+
+# Daily per-city summary fields computed by rollup_daily_summaries
+WEATHER_DAILY_FIELDS = {
+    'readings': {'$sum': 1},
+    'temp_min': {'$min': '$temperature'},
+    'temp_max': {'$max': '$temperature'},
+    'temp_avg': {'$avg': '$temperature'},
+    'humidity_avg': {'$avg': '$humidity'},
+    'conditions': {'$addToSet': '$weather_main'}
+}
+RECOMMENDATION_DAILY_FIELDS = {
+    'count': {'$sum': 1},
+    'outfit_groups': {'$sum': '$recommendation_count'},
+    'conditions': {'$addToSet': '$weather.weather_main'}
+}
+
+# Collection viewer pages (get_collection_page), by collection name. A page
+# continues after the sort key of the previous page's last document instead of
+# skipping, and every filter has an index ending in the sort key, so each page
+# is one bounded index scan however deep it is. Equality filters map to the
+# collation their index uses; range filters map to the type their bounds are
+# parsed to.
+COLLECTION_PAGES = {
+    'weather': {
+        'attribute': 'weather_collection',
+        'sort': [('timestamp', DESCENDING), ('_id', DESCENDING)],
+        'filters': {'city': CITY_COLLATION},
+        'ranges': {'timestamp': datetime.fromisoformat},
+        'exclude': ['raw_data']  # Left out unless fields are given
+    },
+    'outfit': {
+        'attribute': 'outfit_collection',
+        'sort': [('_id', ASCENDING)],
+        'filters': {'category': None, 'weather_conditions': None},
+        'ranges': {},
+        'exclude': []
+    },
+    'recommendations': {
+        'attribute': 'recommendations_collection',
+        'sort': [('timestamp', DESCENDING), ('_id', DESCENDING)],
+        'filters': {'city': CITY_COLLATION},
+        'ranges': {'timestamp': datetime.fromisoformat},
+        'exclude': []
+    }
+}
+
+def collection_page_filters(collection_name, params):
+    """
+    Build get_collection_page filters from string parameters (query string or form).
+
+    A parameter named after one of the collection's filters is an equality
+    filter; <field>_from and <field>_to bound one of its range filters.
+    Other parameters are ignored.
+
+    Args:
+        collection_name (str): Key of COLLECTION_PAGES
+        params (dict): Parameter name -> string value
+
+    Returns:
+        dict: Filters for get_collection_page
+
+    Raises:
+        ValueError: Unknown collection or a bound that cannot be parsed
+    """
+    spec = COLLECTION_PAGES.get(collection_name)
+    if spec is None:
+        raise ValueError(f"Unknown collection: {collection_name}")
+    filters = {field: params[field] for field in spec['filters'] if params.get(field)}
+    for field, parse in spec['ranges'].items():
+        low, high = params.get(f'{field}_from'), params.get(f'{field}_to')
+        try:
+            if low or high:
+                filters[field] = (parse(low) if low else None, parse(high) if high else None)
+        except ValueError:
+            raise ValueError(f"Invalid {field} bound: {low if low else high}")
+    return filters
+
+def encode_page_cursor(collection_name, document):
+    """Return the opaque cursor of the page that starts after document."""
+    key = [document.get(field) for field, _ in COLLECTION_PAGES[collection_name]['sort']]
+    payload = json_util.dumps({'collection': collection_name, 'after': key})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_page_cursor(collection_name, cursor):
+    """
+    Return the sort key stored in a page cursor.
+
+    Raises:
+        ValueError: The cursor is malformed or belongs to another collection
+    """
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        key = payload['after']
+        if payload['collection'] == collection_name and len(key) == len(COLLECTION_PAGES[collection_name]['sort']):
+            return key
+    except Exception:
+        pass
+    raise ValueError("Invalid page cursor")
+
+def keyset_filter(sort, key):
+    """
+    Build the filter matching documents that come after a sort key.
+
+    Missing and null values sort before every other value, as in MongoDB.
+
+    Args:
+        sort (list): (field, direction) pairs, ending with a unique, never null field such as _id
+        key (list): Values of the sort fields in the last document already returned
+
+    Returns:
+        dict: Filter for documents after key, in sort order
+    """
+    branches = []
+    for position, (field, direction) in enumerate(sort):
+        equal = {previous: value for (previous, _), value in zip(sort[:position], key)}
+        value = key[position]
+        if value is None:
+            later = [{field: {'$ne': None}}] if direction == ASCENDING else []
+        elif direction == ASCENDING:
+            later = [{field: {'$gt': value}}]
+        else:
+            later = [{field: {'$lt': value}}] + ([{field: None}] if position < len(sort) - 1 else [])
+        branches.extend(dict(equal, **condition) for condition in later)
+    return {'$or': branches} if branches else {'_id': {'$in': []}}
+
+def timestamp_index(retention_days=None):
+    """Index on timestamp, newest first; with retention_days also a TTL index deleting older documents."""
+    if retention_days:
+        return IndexModel([('timestamp', DESCENDING)], name='timestamp',
+                          expireAfterSeconds=int(retention_days * 24 * 3600))
+    return IndexModel([('timestamp', DESCENDING)], name='timestamp')
+
+def without_ttl(index):
+    """Return a copy of an IndexModel without its expireAfterSeconds option."""
+    options = {key: value for key, value in index.document.items() if key not in ('key', 'expireAfterSeconds')}
+    return IndexModel(list(index.document['key'].items()), **options)
+
+# Indexes for every hot query, by collection attribute. Equality fields come
+# before range fields, and each index name is fixed so ensure_indexes is idempotent.
+INDEXES = {
+    'weather_collection': [
+        # get_weather_data / get_latest_weather / get_collection_page: one city, newest first
+        IndexModel([('city', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)], name='city_timestamp_id',
+                   collation=CITY_COLLATION),
+        # get_weather_data without a city: newest first; also expires old weather (TTL)
+        timestamp_index(WEATHER_RETENTION_DAYS),
+        # get_collection_page without a city
+        IndexModel([('timestamp', DESCENDING), ('_id', DESCENDING)], name='timestamp_id')
+    ],
+    'outfit_collection': [
+        # get_suitable_outfits with a weather condition
+        IndexModel([('weather_conditions', ASCENDING), ('temp_min', ASCENDING), ('temp_max', ASCENDING),
+                    ('humidity_min', ASCENDING), ('humidity_max', ASCENDING)], name='conditions_temp_humidity'),
+        # get_suitable_outfits without a weather condition
+        IndexModel([('temp_min', ASCENDING), ('temp_max', ASCENDING),
+                    ('humidity_min', ASCENDING), ('humidity_max', ASCENDING)], name='temp_humidity'),
+        # get_collection_page filtered by category or condition
+        IndexModel([('category', ASCENDING), ('_id', ASCENDING)], name='category_id'),
+        IndexModel([('weather_conditions', ASCENDING), ('_id', ASCENDING)], name='conditions_id')
+    ],
+    'recommendations_collection': [
+        # get_recommendations_history and get_popular_cities; also expires old recommendations (TTL)
+        timestamp_index(RECOMMENDATION_RETENTION_DAYS),
+        # get_collection_page, with or without a city
+        IndexModel([('timestamp', DESCENDING), ('_id', DESCENDING)], name='timestamp_id'),
+        IndexModel([('city', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)], name='city_timestamp_id',
+                   collation=CITY_COLLATION)
+    ],
+    'daily_summary_collection': [
+        # get_daily_summaries: one city, newest day first
+        IndexModel([('city', ASCENDING), ('day', DESCENDING)], name='city_day', collation=CITY_COLLATION)
+    ]
+}
+# Indexes replaced by ones in INDEXES; ensure_indexes drops them
+RETIRED_INDEXES = {
+    'weather_collection': ['city_timestamp']  # Now city_timestamp_id
+}
+
+# Outfit catalog version, shared by every DatabaseHandler in the process. Each
+# outfit write bumps it, and catalog indexes built for an older version are rebuilt.
+_catalog_version = 0
+_catalog_version_lock = threading.Lock()
+
+def bump_catalog_version():
+    """Mark the outfit catalog as changed. Returns the new version."""
+    global _catalog_version
+    with _catalog_version_lock:
+        _catalog_version += 1
+        return _catalog_version
+
+def get_catalog_version():
+    """Return the current outfit catalog version."""
+    return _catalog_version
+
+# Write-behind queue, shared by every DatabaseHandler in the process so that a
+# flush before a read also covers documents queued through other handlers.
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+def get_write_behind_buffer():
+    """Return the process-wide write-behind buffer, creating it on first use."""
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = WriteBehindBuffer()
+            atexit.register(_write_behind.close)  # Write what is left when the process exits
+        return _write_behind
+
+def create_database_handler(backend=DATABASE_BACKEND, **options):
+    """
+    Open the storage backend selected in config.py.
+
+    Args:
+        backend (str): 'mongodb' for DatabaseHandler, 'sqlite' for SQLiteDatabaseHandler
+        **options: Passed to the handler
+
+    Returns:
+        DatabaseHandler or SQLiteDatabaseHandler: Handler with the same methods
+    """
+    if backend not in DATABASE_BACKENDS:
+        raise ValueError(f"Unsupported database backend: {backend}")
+    if backend == 'sqlite':
+        from sqlite_handler import SQLiteDatabaseHandler  # Imports this module
+        return SQLiteDatabaseHandler(**options)
+    return DatabaseHandler(**options)
+
+def suitable_outfits_pipeline(query, per_category, fields=OUTFIT_FIELDS):
+    """
+    Build the aggregation that ranks suitable outfits within each category on the server.
+
+    Items are ranked by comfort_rating (missing counts as 0), then _id, and
+    only the top per_category of each category are returned, projected to fields.
+    Needs MongoDB 5.2 or later ($topN).
+
+    Args:
+        query (dict): Filter for suitable outfits
+        per_category (int): Items kept per category
+        fields (list): Fields returned besides _id
+
+    Returns:
+        list: Aggregation pipeline
+    """
+    rank = {'_rank': -1, '_id': 1}
+    projection = {field: 1 for field in fields}
+    projection['_rank'] = {'$ifNull': ['$comfort_rating', 0]}
+    return [
+        {'$match': query},
+        {'$project': projection},
+        {'$group': {'_id': '$category', 'items': {'$topN': {'n': per_category, 'sortBy': rank, 'output': '$$ROOT'}}}},
+        {'$unwind': '$items'},
+        {'$replaceRoot': {'newRoot': '$items'}},
+        {'$sort': rank},
+        {'$unset': '_rank'}
+    ]
+
+def normalize_recommendation(document, weather_ref=None):
+    """
+    Return the normalized form of a recommendation document.
+
+    Outfit items are replaced by their _ids, and the weather by a reference to
+    the stored weather document plus RECOMMENDATION_WEATHER_FIELDS. Groups that
+    are already normalized are kept as they are.
+
+    Args:
+        document (dict): Recommendation document, embedded or normalized
+        weather_ref (ObjectId): _id of the stored weather document, if known
+
+    Returns:
+        dict: Normalized document
+    """
+    normalized = {key: value for key, value in document.items() if key not in ('weather', 'recommended_outfits')}
+    weather = document.get('weather') or {}
+    normalized['weather'] = {field: weather[field] for field in RECOMMENDATION_WEATHER_FIELDS if field in weather}
+    normalized['weather_ref'] = weather_ref if weather_ref is not None else document.get('weather_ref')
+
+    groups = []
+    for group in document.get('recommended_outfits') or []:
+        if isinstance(group, dict) and isinstance(group.get('items'), list):
+            items = group['items']
+            group = {key: value for key, value in group.items() if key != 'items'}
+            group['item_ids'] = [item['_id'] for item in items if isinstance(item, dict) and '_id' in item]
+        groups.append(group)
+    normalized['recommended_outfits'] = groups
+    return normalized
+
+def find_index_scans(plan):
+    """Return the names of the indexes used by IXSCAN stages anywhere in an explain() plan."""
+    names = []
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'IXSCAN':
+            names.append(plan.get('indexName'))
+        for value in plan.values():
+            names.extend(find_index_scans(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            names.extend(find_index_scans(value))
+    return names
+
 class DatabaseHandler:
-    def __init__(self):
-        """Initialize MongoDB connection."""
+    def __init__(self, outfit_index_enabled=OUTFIT_INDEX_ENABLED, outfit_query_mode=OUTFIT_QUERY_MODE,
+                 per_category=OUTFIT_TOP_K_PER_CATEGORY, write_behind=WRITE_BEHIND_ENABLED,
+                 recommendation_storage=RECOMMENDATION_STORAGE):
+        """
+        Initialize MongoDB connection.
+
+        Args:
+            outfit_index_enabled (bool): Answer get_suitable_outfits from an in-memory catalog index
+            outfit_query_mode (str): 'aggregate' for the top per_category items of every category,
+                'find' for the top 10 items overall
+            per_category (int): Items per category in 'aggregate' mode
+            write_behind (bool): Queue weather and recommendation inserts and write them in batches
+            recommendation_storage (str): 'normalized' to store outfit _ids and a weather reference,
+                'embedded' to store full copies of the weather and outfit documents
+        """
+        if outfit_query_mode not in OUTFIT_QUERY_MODES:
+            raise ValueError(f"Unsupported outfit query mode: {outfit_query_mode}")
+        if recommendation_storage not in RECOMMENDATION_STORAGE_MODES:
+            raise ValueError(f"Unsupported recommendation storage: {recommendation_storage}")
+        self.recommendation_storage = recommendation_storage
+        self.outfit_query_mode = outfit_query_mode
+        self._outfit_query_mode_checked = False
+        self.per_category = per_category
+        self.outfit_index_enabled = outfit_index_enabled
+        self._outfit_index = None
+        self._outfit_index_version = None
+        self._outfit_index_lock = threading.Lock()
+        self.outfit_index_hits = 0
+        self.outfit_index_fallbacks = 0
+        self.write_behind = get_write_behind_buffer() if write_behind else None
         try:
             self.client = MongoClient(MONGO_URI)
             self.db = self.client[DATABASE_NAME]
             self.weather_collection = self.db[WEATHER_COLLECTION]
             self.outfit_collection = self.db[OUTFIT_COLLECTION]
             self.recommendations_collection = self.db[RECOMMENDATIONS_COLLECTION]
+            self.daily_summary_collection = self.db[DAILY_SUMMARY_COLLECTION]
+            self.raw_weather_collection = self.db[RAW_WEATHER_COLLECTION]
             logger.info("Database connection established successfully")
         except Exception as e:
             logger.error(f"Failed to connect to database: {e}")
@@ -34,14 +393,45 @@ class DatabaseHandler:
             logger.error(f"Database connection test failed: {e}")
             return False
 
+    def _write(self, collection, document):
+        """
+        Insert a document, through the write-behind queue when enabled.
+
+        The _id is assigned here, so it can be returned before the document is written.
+
+        Returns:
+            ObjectId: ID of the document
+        """
+        if self.write_behind is None:
+            return collection.insert_one(document).inserted_id
+        document.setdefault('_id', ObjectId())
+        if not self.write_behind.put(collection, dict(document)):
+            collection.insert_one(document)
+        return document['_id']
+
+    def flush_writes(self):
+        """Write queued documents; called before reading or clearing the collections they belong to."""
+        if self.write_behind is not None:
+            self.write_behind.flush()
+
     def insert_weather_data(self, weather_data):
-        """Insert weather data into database."""
+        """Insert weather data (a dict or ParsedWeather) into database."""
         try:
+            if hasattr(weather_data, 'to_bson'):
+                weather_data = weather_data.to_bson()
             # Add timestamp
             weather_data['timestamp'] = datetime.utcnow()
-            result = self.weather_collection.insert_one(weather_data)
-            logger.info(f"Weather data inserted with ID: {result.inserted_id}")
-            return result.inserted_id
+            raw_data = weather_data.get('raw_data')
+            if RAW_WEATHER_CAPPED_MB and raw_data is not None:
+                # The raw payload goes to the capped collection, under the weather document's _id
+                weather_data = {key: value for key, value in weather_data.items() if key != 'raw_data'}
+                weather_data.setdefault('_id', ObjectId())
+                self._write(self.raw_weather_collection, {'_id': weather_data['_id'],
+                                                          'timestamp': weather_data['timestamp'],
+                                                          'raw_data': raw_data})
+            inserted_id = self._write(self.weather_collection, weather_data)
+            logger.debug(f"Weather data inserted with ID: {inserted_id}")
+            return inserted_id
         except Exception as e:
             logger.error(f"Error inserting weather data: {e}")
             return None
@@ -60,34 +450,115 @@ class DatabaseHandler:
         except Exception as e:
             logger.error(f"Error inserting outfit data: {e}")
             return None
+        finally:
+            self.bump_catalog_version()
+
+    def insert_recommendation(self, recommendation_data, weather_ref=None):
+        """
+        Insert recommendation into database.
+
+        Args:
+            recommendation_data (dict): Recommendation with full weather and outfit documents
+            weather_ref (ObjectId): _id of the stored weather document, kept in normalized storage
 
-    def insert_recommendation(self, recommendation_data):
-        """Insert recommendation into database."""
+        Returns:
+            ObjectId: ID of the recommendation, or None on error
+        """
         try:
             # Add timestamp
             recommendation_data['timestamp'] = datetime.utcnow()
-            result = self.recommendations_collection.insert_one(recommendation_data)
-            logger.info(f"Recommendation inserted with ID: {result.inserted_id}")
-            return result.inserted_id
+            document = recommendation_data
+            if self.recommendation_storage == 'normalized':
+                recommendation_data.setdefault('_id', ObjectId())
+                document = normalize_recommendation(recommendation_data, weather_ref)
+            inserted_id = self._write(self.recommendations_collection, document)
+            logger.debug(f"Recommendation inserted with ID: {inserted_id}")
+            return inserted_id
         except Exception as e:
             logger.error(f"Error inserting recommendation: {e}")
             return None
 
     def get_weather_data(self, city=None, limit=10):
-        """Retrieve weather data from database."""
+        """Retrieve weather data from database, newest first. City names are matched case-insensitively."""
         try:
-            query = {}
+            self.flush_writes()
+            cursor = self.weather_collection.find({'city': city} if city else {})
             if city:
-                query['name'] = city
-
-            cursor = self.weather_collection.find(query).sort('timestamp', -1).limit(limit)
-            return list(cursor)
+                cursor = cursor.collation(CITY_COLLATION)
+            return list(cursor.sort('timestamp', -1).limit(limit))
         except Exception as e:
             logger.error(f"Error retrieving weather data: {e}")
             return []
 
+    def get_latest_weather(self, city):
+        """
+        Get the most recently stored weather document for a city.
+
+        City names are matched case-insensitively.
+
+        Args:
+            city (str): City name
+
+        Returns:
+            dict: Weather document or None if none is stored
+        """
+        try:
+            self.flush_writes()
+            cursor = (self.weather_collection.find({'city': city})
+                      .collation(CITY_COLLATION)
+                      .sort('timestamp', -1)
+                      .limit(1))
+            documents = list(cursor)
+            return documents[0] if documents else None
+        except Exception as e:
+            logger.error(f"Error retrieving latest weather for {city}: {e}")
+            return None
+
     def get_suitable_outfits(self, temperature, humidity, weather_condition):
-        """Get suitable outfits based on weather conditions."""
+        """
+        Get suitable outfits based on weather conditions, highest comfort_rating first.
+
+        In 'aggregate' mode these are the best items of every category, with
+        only the fields the recommender uses; in 'find' mode the best 10
+        items overall. Answered from the in-memory catalog index when it is
+        enabled and can be built; otherwise MongoDB is queried. Both return
+        the same items in the same order.
+        """
+        index = self.get_outfit_index() if is_number(temperature) and is_number(humidity) else None
+        if index is not None:
+            self.outfit_index_hits += 1
+            return index.find_suitable(temperature, humidity, weather_condition)
+        self.outfit_index_fallbacks += 1
+        return self._query_suitable_outfits(temperature, humidity, weather_condition)
+
+    def check_outfit_query_mode(self):
+        """
+        Fall back to 'find' mode if 'aggregate' is configured but the server
+        is older than MongoDB 5.2, which lacks $topN.
+
+        The server version is read once; if the server cannot be reached the
+        check is repeated on the next call.
+
+        Returns:
+            str: Outfit query mode in use
+        """
+        if self.outfit_query_mode != 'aggregate' or self._outfit_query_mode_checked:
+            return self.outfit_query_mode
+        try:
+            version = tuple(self.client.server_info().get('versionArray', [])[:2])
+            self._outfit_query_mode_checked = True
+            if version < TOP_N_MIN_SERVER_VERSION:
+                logger.warning(f"MongoDB {'.'.join(map(str, version))} has no $topN; "
+                               f"using 'find' outfit query mode instead of 'aggregate'")
+                with self._outfit_index_lock:
+                    self.outfit_query_mode = 'find'
+                    self._outfit_index = None
+        except Exception as e:
+            logger.error(f"Error checking MongoDB server version: {e}")
+        return self.outfit_query_mode
+
+    def _query_suitable_outfits(self, temperature, humidity, weather_condition, mode=None):
+        """Get suitable outfits with a MongoDB query (see get_suitable_outfits)."""
         try:
             # Build query for outfit matching
             query = {
@@ -101,33 +572,596 @@ class DatabaseHandler:
             if weather_condition:
                 query['weather_conditions'] = weather_condition.lower()
 
+            if (mode or self.check_outfit_query_mode()) == 'aggregate':
+                pipeline = suitable_outfits_pipeline(query, self.per_category)
+                return list(self.outfit_collection.aggregate(pipeline))
+
             cursor = self.outfit_collection.find(query)
             outfits = list(cursor)
 
-            # Sort by comfort rating (descending)
-            outfits.sort(key=lambda x: x.get('comfort_rating', 0), reverse=True)
+            # Sort by comfort rating (descending), ties by _id
+            outfits.sort(key=outfit_rank_key)
 
-            return outfits[:10]  # Return top 10 matches
+            return outfits[:SUITABLE_OUTFITS_LIMIT]  # Return top 10 matches
         except Exception as e:
             logger.error(f"Error getting suitable outfits: {e}")
             return []
 
-    def get_recommendations_history(self, limit=10):
-        """Get recommendation history."""
+    def get_outfit_index(self):
+        """
+        Return the in-memory outfit catalog index, loading it on first use
+        and again after the catalog version changes.
+
+        Returns:
+            OutfitCatalogIndex: Catalog index, or None if it is disabled or cannot be loaded
+        """
+        if not self.outfit_index_enabled:
+            return None
+        self.check_outfit_query_mode()
+        version = get_catalog_version()
+        index = self._outfit_index
+        if index is not None and self._outfit_index_version == version:
+            return index
+        with self._outfit_index_lock:
+            if self._outfit_index is None or self._outfit_index_version != version:
+                try:
+                    # A write during the load bumps the version again, so the index is rebuilt next time
+                    if self.outfit_query_mode == 'aggregate':
+                        cursor = self.outfit_collection.find({}, OUTFIT_FIELDS + OUTFIT_INDEX_FIELDS)
+                        self._outfit_index = OutfitCatalogIndex(cursor, self.per_category, OUTFIT_FIELDS)
+                    else:
+                        self._outfit_index = OutfitCatalogIndex(self.outfit_collection.find())
+                    self._outfit_index_version = version
+                    logger.info(f"Outfit catalog index built with {len(self._outfit_index)} items (version {version})")
+                except Exception as e:
+                    logger.error(f"Error building outfit catalog index: {e}")
+                    self._outfit_index = None
+            return self._outfit_index
+
+    def bump_catalog_version(self):
+        """
+        Mark the outfit catalog as changed after writing to outfit_collection.
+
+        Every DatabaseHandler in the process rebuilds its catalog index on
+        its next get_suitable_outfits call.
+
+        Returns:
+            int: New catalog version
+        """
+        return bump_catalog_version()
+
+    def get_outfit_index_stats(self):
+        """Get outfit catalog index size and hit counters."""
+        index = self._outfit_index
+        stats = {
+            'enabled': self.outfit_index_enabled,
+            'loaded': index is not None,
+            'catalog_version': get_catalog_version(),
+            'index_version': self._outfit_index_version,
+            'hits': self.outfit_index_hits,
+            'fallbacks': self.outfit_index_fallbacks
+        }
+        if index is not None:
+            stats.update(index.get_stats())
+        return stats
+
+    def get_write_behind_stats(self):
+        """Get write-behind queue depth and flush latency counters."""
+        if self.write_behind is None:
+            return {'enabled': False}
+        return dict(self.write_behind.get_stats(), enabled=True)
+
+    def hydrate_recommendations(self, recommendations):
+        """
+        Replace the outfit _ids of normalized recommendations with the outfit documents.
+
+        All outfits are read with one $in query. Outfits since removed from the
+        catalog are left out, and embedded recommendations are left as they are.
+
+        Args:
+            recommendations (list): Recommendation documents, changed in place
+
+        Returns:
+            list: The same recommendations, with 'items' in every group
+        """
+        groups = [group for recommendation in recommendations
+                  for group in recommendation.get('recommended_outfits') or []
+                  if isinstance(group, dict) and 'item_ids' in group]
+        if not groups:
+            return recommendations
         try:
-            cursor = self.recommendations_collection.find().sort('timestamp', -1).limit(limit)
-            return list(cursor)
+            ids = list({outfit_id for group in groups for outfit_id in group['item_ids']})
+            outfits = {outfit['_id']: outfit
+                       for outfit in self.outfit_collection.find({'_id': {'$in': ids}}, OUTFIT_FIELDS)}
+        except Exception as e:
+            logger.error(f"Error loading recommended outfits: {e}")
+            outfits = {}
+        for group in groups:
+            group['items'] = [dict(outfits[outfit_id]) for outfit_id in group.pop('item_ids')
+                              if outfit_id in outfits]
+        return recommendations
+
+    def get_recommendations_history(self, limit=10, summary=False):
+        """
+        Get recommendation history, newest first.
+
+        Args:
+            limit (int): Maximum number of recommendations
+            summary (bool): Return only HISTORY_FIELDS (city, time, count and weather),
+                without the recommended outfits
+
+        Returns:
+            list: Recommendation documents
+        """
+        try:
+            self.flush_writes()
+            cursor = self.recommendations_collection.find({}, HISTORY_FIELDS if summary else None)
+            recommendations = list(cursor.sort('timestamp', -1).limit(limit))
+            return recommendations if summary else self.hydrate_recommendations(recommendations)
         except Exception as e:
             logger.error(f"Error retrieving recommendations history: {e}")
             return []
 
+    def migrate_recommendations(self, batch_size=500, dry_run=False):
+        """
+        Convert embedded recommendation documents to normalized storage.
+
+        Documents are read and rewritten in batches, with one bulk_write per
+        batch. Weather references are found by city and fetch time with one
+        $in query on the weather collection per batch; recommendations whose
+        weather was not stored keep only the weather fields.
+
+        Args:
+            batch_size (int): Documents rewritten per round trip
+            dry_run (bool): Only measure the documents, write nothing
+
+        Returns:
+            dict: Documents 'migrated', and their BSON size in bytes 'before' and 'after'
+        """
+        stats = {'migrated': 0, 'before': 0, 'after': 0}
+        try:
+            self.flush_writes()
+            batch = []
+            for document in self.recommendations_collection.find({'weather_ref': {'$exists': False}}):
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    self._migrate_recommendation_batch(batch, stats, dry_run)
+                    batch = []
+            if batch:
+                self._migrate_recommendation_batch(batch, stats, dry_run)
+            logger.info(f"{'Measured' if dry_run else 'Migrated'} {stats['migrated']} recommendations: "
+                        f"{stats['before']} -> {stats['after']} bytes")
+        except Exception as e:
+            logger.error(f"Error migrating recommendations: {e}")
+        return stats
+
+    def _migrate_recommendation_batch(self, batch, stats, dry_run):
+        """Normalize one batch of embedded recommendations (see migrate_recommendations)."""
+        keys = {}
+        for document in batch:
+            weather = document.get('weather')
+            if isinstance(weather, dict) and weather.get('fetch_time'):
+                keys[document['_id']] = (weather.get('city'), weather['fetch_time'])
+
+        weather_refs = {}
+        if keys:
+            query = {'fetch_time': {'$in': list({fetch_time for _, fetch_time in keys.values()})}}
+            for weather in self.weather_collection.find(query, ['city', 'fetch_time']):
+                weather_refs.setdefault((weather.get('city'), weather.get('fetch_time')), weather['_id'])
+
+        requests = []
+        before = after = 0
+        for document in batch:
+            normalized = normalize_recommendation(document, weather_refs.get(keys.get(document['_id'])))
+            before += len(bson.encode(document))
+            after += len(bson.encode(normalized))
+            requests.append(ReplaceOne({'_id': document['_id']}, normalized))
+        if not dry_run:
+            self.recommendations_collection.bulk_write(requests, ordered=False)
+        stats['migrated'] += len(batch)
+        stats['before'] += before
+        stats['after'] += after
+
+    def _collection_page_cursor(self, collection_name, limit=COLLECTION_PAGE_SIZE, after=None, fields=None,
+                                filters=None):
+        """Build the (unexecuted) find() for get_collection_page, asking for one document more than limit."""
+        spec = COLLECTION_PAGES.get(collection_name)
+        if spec is None:
+            raise ValueError(f"Unknown collection: {collection_name}")
+        clauses = []
+        collation = None
+        for field, value in (filters or {}).items():
+            if isinstance(value, tuple):
+                if field not in spec['ranges']:
+                    raise ValueError(f"Cannot filter {collection_name} by a range of {field}")
+                low, high = value
+                bounds = {}
+                if low is not None:
+                    bounds['$gte'] = low
+                if high is not None:
+                    bounds['$lte'] = high
+                if bounds:
+                    clauses.append({field: bounds})
+            elif field in spec['filters'] and not isinstance(value, (dict, list)):
+                clauses.append({field: value})
+                collation = collation or spec['filters'][field]
+            else:
+                raise ValueError(f"Cannot filter {collection_name} by {field}")
+        if after:
+            clauses.append(keyset_filter(spec['sort'], decode_page_cursor(collection_name, after)))
+        query = clauses[0] if len(clauses) == 1 else ({'$and': clauses} if clauses else {})
+
+        if fields:
+            if not all(isinstance(field, str) and field and not field.startswith('$') for field in fields):
+                raise ValueError(f"Invalid fields: {fields}")
+            projection = dict.fromkeys(list(fields) + [field for field, _ in spec['sort']], 1)
+        else:
+            projection = dict.fromkeys(spec['exclude'], 0) or None
+
+        cursor = getattr(self, spec['attribute']).find(query, projection)
+        if collation:
+            cursor = cursor.collation(collation)
+        return cursor.sort(spec['sort']).limit(limit + 1)
+
+    def get_collection_page(self, collection_name, limit=COLLECTION_PAGE_SIZE, after=None, fields=None, filters=None):
+        """
+        Get one page of a collection for the collection viewers.
+
+        Pages follow COLLECTION_PAGES[collection_name]['sort']: newest first for
+        weather and recommendations, by _id for outfits. The next page starts
+        after the sort key in the returned cursor, so deep pages cost the same
+        as the first.
+
+        Args:
+            collection_name (str): 'weather', 'outfit' or 'recommendations'
+            limit (int): Documents per page, at most COLLECTION_PAGE_MAX
+            after (str): 'next' cursor of the previous page, or None for the first page
+            fields (list): Fields to return (_id and the sort fields are always included),
+                or None for whole documents without the collection's 'exclude' fields
+            filters (dict): Field -> value for equality filters, field -> (low, high) for
+                inclusive range filters (either bound may be None); see collection_page_filters
+
+        Returns:
+            dict: 'data' (documents) and 'next' (cursor, None on the last page), or None on database errors
+
+        Raises:
+            ValueError: Unknown collection, filter or field, or an invalid cursor
+        """
+        limit = max(1, min(int(limit), COLLECTION_PAGE_MAX))
+        cursor = self._collection_page_cursor(collection_name, limit, after, fields, filters)
+        try:
+            self.flush_writes()
+            documents = list(cursor)
+        except Exception as e:
+            logger.error(f"Error retrieving {collection_name} page: {e}")
+            return None
+        more = len(documents) > limit
+        documents = documents[:limit]
+        return {'data': documents, 'next': encode_page_cursor(collection_name, documents[-1]) if more else None}
+
+    def insert_record(self, collection_name, record):
+        """
+        Insert a document into a collection by its viewer name ('weather', 'outfit' or 'recommendations').
+
+        Returns:
+            ObjectId: ID of the document, or None on error
+        """
+        try:
+            result = getattr(self, COLLECTION_PAGES[collection_name]['attribute']).insert_one(record)
+            if collection_name == 'outfit':
+                self.bump_catalog_version()
+            return result.inserted_id
+        except Exception as e:
+            logger.error(f"Error inserting record into {collection_name}: {e}")
+            return None
+
+    def update_record(self, collection_name, record_id, changes):
+        """
+        Set fields of a document.
+
+        Args:
+            collection_name (str): 'weather', 'outfit' or 'recommendations'
+            record_id (str): _id of the document
+            changes (dict): Top-level fields to set (_id is ignored)
+
+        Returns:
+            bool: True if the document was found and changed
+        """
+        try:
+            self.flush_writes()
+            changes = {key: value for key, value in changes.items() if key != '_id'}
+            result = getattr(self, COLLECTION_PAGES[collection_name]['attribute']).update_one(
+                {'_id': ObjectId(record_id)}, {'$set': changes})
+            if collection_name == 'outfit' and result.modified_count > 0:
+                self.bump_catalog_version()
+            return result.modified_count > 0
+        except Exception as e:
+            logger.error(f"Error updating record {record_id} in {collection_name}: {e}")
+            return False
+
+    def delete_record(self, collection_name, record_id):
+        """
+        Delete a document by _id.
+
+        Returns:
+            bool: True if a document was deleted
+        """
+        try:
+            self.flush_writes()
+            result = getattr(self, COLLECTION_PAGES[collection_name]['attribute']).delete_one(
+                {'_id': ObjectId(record_id)})
+            if collection_name == 'outfit' and result.deleted_count > 0:
+                self.bump_catalog_version()
+            return result.deleted_count > 0
+        except Exception as e:
+            logger.error(f"Error deleting record {record_id} from {collection_name}: {e}")
+            return False
+
+    def get_popular_cities(self, limit=10, since=None):
+        """
+        Get the most requested cities from the recommendation history.
+
+        Args:
+            limit (int): Maximum number of cities
+            since (datetime): Only count recommendations made after this time
+
+        Returns:
+            list: Dicts with 'city' and 'count', most requested first
+        """
+        try:
+            self.flush_writes()
+            pipeline = []
+            if since:
+                pipeline.append({'$match': {'timestamp': {'$gte': since}}})
+            pipeline.extend([
+                {'$match': {'city': {'$type': 'string'}}},
+                {'$group': {'_id': {'$toLower': '$city'}, 'city': {'$first': '$city'}, 'count': {'$sum': 1}}},
+                {'$sort': {'count': -1}},
+                {'$limit': limit}
+            ])
+            return [{'city': doc['city'], 'count': doc['count']}
+                    for doc in self.recommendations_collection.aggregate(pipeline)]
+        except Exception as e:
+            logger.error(f"Error retrieving popular cities: {e}")
+            return []
+
+    def ensure_indexes(self):
+        """
+        Create the indexes in INDEXES. Safe to call on every startup: existing
+        indexes with the same definition are left alone, the TTL of existing
+        timestamp indexes is changed to match the configured retention, and
+        indexes listed in RETIRED_INDEXES are dropped once their replacement exists.
+
+        Before a TTL index starts deleting documents, or deletes them sooner,
+        everything stored is rolled up into daily summaries. If that fails, the index is created
+        without TTL and retention is tried again on the next call. The capped
+        raw-weather collection (RAW_WEATHER_CAPPED_MB) is created here too.
+
+        Returns:
+            bool: True if every index exists
+        """
+        success = self.ensure_raw_weather_collection()
+        held = self._collections_enabling_ttl()
+        if held:
+            if self.rollup_daily_summaries(days=None):
+                held = set()
+            else:
+                logger.error(f"Not enabling TTL on {', '.join(sorted(held))} until stored detail is rolled up")
+
+        for attribute, indexes in INDEXES.items():
+            collection = getattr(self, attribute)
+            if attribute in held:
+                indexes = [without_ttl(index) for index in indexes]
+            try:
+                self._reconcile_ttl(collection, indexes)
+                names = collection.create_indexes(indexes)
+                logger.info(f"Indexes on {collection.name}: {', '.join(names)}")
+                existing = set(collection.index_information())
+                for name in RETIRED_INDEXES.get(attribute, []):
+                    if name in existing:
+                        collection.drop_index(name)
+                        logger.info(f"Dropped retired index {name} on {collection.name}")
+            except pymongo.errors.OperationFailure as e:
+                # Usually an index with the same name or keys but other options
+                logger.error(f"Could not create indexes on {collection.name}: {e}")
+                success = False
+            except Exception as e:
+                logger.error(f"Error creating indexes on {collection.name}: {e}")
+                success = False
+        return success
+
+    def _collections_enabling_ttl(self):
+        """Return the attributes of non-empty collections whose TTL is about to start or be shortened."""
+        pending = set()
+        for attribute, indexes in INDEXES.items():
+            collection = getattr(self, attribute)
+            wanted = {index.document['name']: index.document['expireAfterSeconds']
+                      for index in indexes if 'expireAfterSeconds' in index.document}
+            if not wanted:
+                continue
+            try:
+                existing = collection.index_information()
+                current = {name: existing.get(name, {}).get('expireAfterSeconds') for name in wanted}
+                if (any(current[name] is None or current[name] > seconds for name, seconds in wanted.items())
+                        and collection.estimated_document_count()):
+                    pending.add(attribute)
+            except Exception as e:
+                logger.error(f"Error checking TTL indexes on {collection.name}: {e}")
+        return pending
+
+    def _reconcile_ttl(self, collection, indexes):
+        """
+        Change the TTL of existing indexes to the one in indexes.
+
+        create_indexes refuses to change the options of an existing index, so
+        expireAfterSeconds is changed with collMod. Where collMod cannot do it
+        (turning TTL off, or servers before 5.1 adding it to a plain index),
+        the index is dropped and create_indexes builds it again.
+        """
+        existing = collection.index_information()
+        for index in indexes:
+            name = index.document['name']
+            if name not in existing:
+                continue
+            current = existing[name].get('expireAfterSeconds')
+            wanted = index.document.get('expireAfterSeconds')
+            if current == wanted:
+                continue
+            if wanted is None:
+                collection.drop_index(name)
+            else:
+                try:
+                    self.db.command('collMod', collection.name, index={'name': name, 'expireAfterSeconds': wanted})
+                except pymongo.errors.OperationFailure:
+                    collection.drop_index(name)
+            logger.info(f"Changed TTL of {collection.name}.{name} from {current} to {wanted} seconds")
+
+    def ensure_raw_weather_collection(self):
+        """
+        Create the capped collection for raw API payloads, or convert an existing plain one.
+
+        Does nothing unless RAW_WEATHER_CAPPED_MB is set. The size only applies
+        when the collection is created or converted.
+
+        Returns:
+            bool: True if the collection is ready (or not needed)
+        """
+        if not RAW_WEATHER_CAPPED_MB:
+            return True
+        size = int(RAW_WEATHER_CAPPED_MB * 1024 * 1024)
+        try:
+            if RAW_WEATHER_COLLECTION not in self.db.list_collection_names():
+                self.db.create_collection(RAW_WEATHER_COLLECTION, capped=True, size=size)
+                logger.info(f"Created capped collection {RAW_WEATHER_COLLECTION} ({RAW_WEATHER_CAPPED_MB} MB)")
+            elif not self.raw_weather_collection.options().get('capped'):
+                self.db.command('convertToCapped', RAW_WEATHER_COLLECTION, size=size)
+                logger.info(f"Converted {RAW_WEATHER_COLLECTION} to a capped collection ({RAW_WEATHER_CAPPED_MB} MB)")
+            return True
+        except Exception as e:
+            logger.error(f"Error creating capped collection {RAW_WEATHER_COLLECTION}: {e}")
+            return False
+
+    def rollup_daily_summaries(self, days=ROLLUP_LOOKBACK_DAYS):
+        """
+        Summarize weather and recommendations per city and UTC day into the daily summary collection.
+
+        Each day's summary is recomputed from the stored detail and merged in
+        with $merge (MongoDB 4.2+), so running this repeatedly is safe. A day
+        whose detail TTL has started deleting is never recomputed, so its
+        summary keeps covering everything that was stored.
+
+        Args:
+            days (int): Recompute this many days, including today; None for everything stored
+
+        Returns:
+            bool: True if both collections were rolled up
+        """
+        now = datetime.utcnow()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        success = True
+        for name, collection, retention_days, fields in (
+                ('weather', self.weather_collection, WEATHER_RETENTION_DAYS, WEATHER_DAILY_FIELDS),
+                ('recommendations', self.recommendations_collection, RECOMMENDATION_RETENTION_DAYS,
+                 RECOMMENDATION_DAILY_FIELDS)):
+            timestamp = {'$type': 'date'}
+            if days is not None:
+                since = today - timedelta(days=days - 1)
+                if retention_days:
+                    # The oldest day still stored is partly deleted already
+                    expiring = (now - timedelta(days=retention_days)).replace(hour=0, minute=0, second=0,
+                                                                             microsecond=0)
+                    since = max(since, expiring + timedelta(days=1))
+                timestamp['$gte'] = since
+            group = {'_id': {'city': {'$toLower': '$city'},
+                             'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}}},
+                     'city': {'$first': '$city'}}
+            group.update(fields)
+            pipeline = [
+                {'$match': {'city': {'$type': 'string'}, 'timestamp': timestamp}},
+                {'$group': group},
+                {'$project': {'city': 1, 'day': '$_id.day', name: {field: f'${field}' for field in fields}}},
+                {'$merge': {'into': self.daily_summary_collection.name, 'whenMatched': 'merge',
+                            'whenNotMatched': 'insert'}}
+            ]
+            try:
+                self.flush_writes()
+                collection.aggregate(pipeline)
+            except Exception as e:
+                logger.error(f"Error rolling up {name}: {e}")
+                success = False
+        return success
+
+    def get_daily_summaries(self, city=None, limit=30):
+        """
+        Get daily per-city summaries, newest day first. City names are matched case-insensitively.
+
+        Returns:
+            list: Dicts with 'city', 'day' ('YYYY-MM-DD'), and 'weather' and/or 'recommendations' totals
+        """
+        try:
+            self.flush_writes()
+            cursor = self.daily_summary_collection.find({'city': city} if city else {})
+            if city:
+                cursor = cursor.collation(CITY_COLLATION)
+            return list(cursor.sort('day', -1).limit(limit))
+        except Exception as e:
+            logger.error(f"Error retrieving daily summaries: {e}")
+            return []
+
+    def verify_indexes(self):
+        """
+        Check with explain() that every hot query is answered from an index.
+
+        Returns:
+            dict: Query name -> name of the index its winning plan uses, or None for a collection scan
+        """
+        queries = {
+            'get_suitable_outfits': self.outfit_collection.find({
+                'temp_min': {'$lte': 20}, 'temp_max': {'$gte': 20},
+                'humidity_min': {'$lte': 50}, 'humidity_max': {'$gte': 50},
+                'weather_conditions': 'clear'
+            }),
+            'get_suitable_outfits_any_condition': self.outfit_collection.find({
+                'temp_min': {'$lte': 20}, 'temp_max': {'$gte': 20},
+                'humidity_min': {'$lte': 50}, 'humidity_max': {'$gte': 50}
+            }),
+            'get_weather_data': self.weather_collection.find({'city': 'London'})
+                .collation(CITY_COLLATION).sort('timestamp', -1).limit(10),
+            'get_weather_data_all': self.weather_collection.find().sort('timestamp', -1).limit(10),
+            'get_recommendations_history': self.recommendations_collection.find().sort('timestamp', -1).limit(10),
+            'get_popular_cities': self.recommendations_collection.find({'timestamp': {'$gte': datetime(2000, 1, 1)}})
+        }
+        # Deep collection viewer pages, continuing after a document from 2000
+        last = {'timestamp': datetime(2000, 1, 1), '_id': ObjectId()}
+        for name, collection_name, filters in [('get_collection_page_weather', 'weather', None),
+                                               ('get_collection_page_weather_city', 'weather', {'city': 'London'}),
+                                               ('get_collection_page_outfit_category', 'outfit', {'category': 'Top'}),
+                                               ('get_collection_page_recommendations', 'recommendations', None)]:
+            after = encode_page_cursor(collection_name, last)
+            queries[name] = self._collection_page_cursor(collection_name, after=after, filters=filters)
+
+        results = {}
+        for name, cursor in queries.items():
+            try:
+                plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+                scans = find_index_scans(plan)
+                results[name] = scans[0] if scans else None
+                if not scans:
+                    logger.warning(f"Query {name} does not use an index")
+            except Exception as e:
+                logger.error(f"Error explaining query {name}: {e}")
+                results[name] = None
+        return results
+
     def clear_collection(self, collection_name):
         """Clear a specific collection."""
         try:
+            self.flush_writes()
             if collection_name == "weather":
                 result = self.weather_collection.delete_many({})
             elif collection_name == "outfit":
                 result = self.outfit_collection.delete_many({})
+                self.bump_catalog_version()
             elif collection_name == "recommendations":
                 result = self.recommendations_collection.delete_many({})
             else:
@@ -143,6 +1177,7 @@ class DatabaseHandler:
     def get_collection_stats(self):
         """Get statistics about all collections."""
         try:
+            self.flush_writes()
             stats = {
                 'weather_count': self.weather_collection.count_documents({}),
                 'outfit_count': self.outfit_collection.count_documents({}),
@@ -153,9 +1188,13 @@ class DatabaseHandler:
             logger.error(f"Error getting collection stats: {e}")
             return {}
 
+    def release_connection(self):
+        """Nothing to release per thread: MongoClient shares one connection pool between threads."""
+
     def close_connection(self):
-        """Close database connection."""
+        """Write queued documents and close database connection."""
         try:
+            self.flush_writes()  # Queued documents may belong to this client
             self.client.close()
             logger.info("Database connection closed")
         except Exception as e:
@@ -163,7 +1202,14 @@ class DatabaseHandler:
 
 # Test the database handler
 if __name__ == "__main__":
-    db = DatabaseHandler()
+    parser = argparse.ArgumentParser(description="Check the database connection and indexes.")
+    parser.add_argument('--migrate-recommendations', action='store_true',
+                        help="Convert embedded recommendation documents to normalized storage")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="With --migrate-recommendations, only report the size change")
+    args = parser.parse_args()
+
+    db = create_database_handler()
 
     # Test connection
     if db.test_connection():
@@ -172,6 +1218,17 @@ if __name__ == "__main__":
         # Get stats
         stats = db.get_collection_stats()
         print(f"Collection statistics: {stats}")
+
+        # Check that hot queries use indexes
+        db.ensure_indexes()
+        for query, index in db.verify_indexes().items():
+            print(f"{'✓' if index else '✗'} {query}: {index or 'collection scan'}")
+
+        if args.migrate_recommendations:
+            result = db.migrate_recommendations(dry_run=args.dry_run)
+            saved = (1 - result['after'] / result['before']) * 100 if result['before'] else 0
+            print(f"{'Would migrate' if args.dry_run else 'Migrated'} {result['migrated']} recommendations: "
+                  f"{result['before']} -> {result['after']} bytes ({saved:.0f}% smaller)")
     else:
         print("✗ Database connection failed")
 
@@ -4,7 +4,7 @@ Weather-Based Outfit Recommendation System
 Main application entry point
 
 This system provides outfit recommendations based on current weather conditions.
-It fetches weather data from OpenWeatherMap API, stores data in MongoDB,
+It fetches weather data from OpenWeatherMap API, stores data in MongoDB (or SQLite),
 and provides recommendations through a Tkinter GUI.
 """
 
@@ -52,10 +52,10 @@ def check_dependencies():
 def setup_database():
     """Initialize database with outfit dataset."""
     try:
-        from db_handler import DatabaseHandler
+        from db_handler import create_database_handler
         import pandas as pd
 
-        db = DatabaseHandler()
+        db = create_database_handler()
 
         # Check if outfit dataset exists in database
         stats = db.get_collection_stats()
@@ -114,6 +114,12 @@ def setup_database():
                 db.insert_outfit_data(sample_data)
                 logger.info("Created sample outfit data")
 
+        # Index every hot query; existing indexes are left alone
+        db.ensure_indexes()
+        for query, index in db.verify_indexes().items():
+            if index is None:
+                logger.warning(f"Query {query} runs as a collection scan")
+
         db.close_connection()
         return True
 
@@ -167,7 +173,7 @@ def main():
     # Step 3: Setup database
     print("\n3. Setting up database...")
     if not setup_database():
-        print("✗ Database setup failed. Please check MongoDB connection.")
+        print("✗ Database setup failed. Please check the database settings in config.py.")
         return False
     print("✓ Database setup completed")
 
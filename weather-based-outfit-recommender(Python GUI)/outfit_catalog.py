@@ -0,0 +1,195 @@
+# outfit_catalog.py
+"""
+In-memory index over the outfit catalog.
+
+get_suitable_outfits asks for every item whose temperature and humidity
+ranges contain the current weather and whose conditions include the current
+category. The catalog is small and rarely changes, so it is loaded once and
+answered from bitsets: each item is one bit, numbered by rank (comfort first),
+and every filter is a precomputed mask. A query ANDs four or five masks and
+reads the lowest set bits.
+
+Two selections are supported, matching DatabaseHandler's query modes: the
+top SUITABLE_OUTFITS_LIMIT items overall ('find'), or the top k items of every
+category, projected to OUTFIT_FIELDS ('aggregate').
+"""
+
+import bisect
+import logging
+import math
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUITABLE_OUTFITS_LIMIT = 10  # Items returned by get_suitable_outfits in 'find' mode
+# Outfit fields read by the recommender, the UI and the web front end
+OUTFIT_FIELDS = ['clothing_type', 'category', 'material', 'comfort_rating', 'temp_min', 'temp_max']
+
+def outfit_rank_key(outfit):
+    """Sort key for suitable outfits: highest comfort_rating first (missing or null counts as 0), then by _id."""
+    return -(outfit.get('comfort_rating') or 0), str(outfit.get('_id', ''))
+
+def is_number(value):
+    """Return True for values a MongoDB numeric range query can match (not bool or NaN)."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value)
+
+def outfit_conditions(outfit):
+    """Return the weather conditions an equality query on weather_conditions would match."""
+    conditions = outfit.get('weather_conditions')
+    if isinstance(conditions, str):
+        return {conditions}
+    if isinstance(conditions, (list, tuple)):
+        return {condition for condition in conditions if isinstance(condition, str)}
+    return set()
+
+class _RangeMasks:
+    """Bitsets of the items whose bound is <= (lower bounds) or >= (upper bounds) each distinct value."""
+    def __init__(self, bounds, lower):
+        """
+        Args:
+            bounds (list): (value, bit) pairs
+            lower (bool): True for a lower bound (item matches when value <= x)
+        """
+        self.values = sorted({value for value, _ in bounds})
+        bits_by_value = {}
+        for value, bit in bounds:
+            bits_by_value[value] = bits_by_value.get(value, 0) | bit
+
+        self.masks = [0] * len(self.values)
+        mask = 0
+        order = range(len(self.values)) if lower else range(len(self.values) - 1, -1, -1)
+        for index in order:
+            mask |= bits_by_value[self.values[index]]
+            self.masks[index] = mask
+        self.lower = lower
+
+    def matching(self, x):
+        """Return the bitset of items whose bound admits x."""
+        if self.lower:
+            index = bisect.bisect_right(self.values, x) - 1
+            return self.masks[index] if index >= 0 else 0
+        index = bisect.bisect_left(self.values, x)
+        return self.masks[index] if index < len(self.values) else 0
+
+class OutfitCatalogIndex:
+    def __init__(self, outfits, per_category=None, fields=None):
+        """
+        Build the index.
+
+        Items without numeric temperature and humidity bounds are left out,
+        as a MongoDB range query would never return them. Memory grows with
+        the number of distinct bound values, which for whole degrees and
+        percentages stays small.
+
+        Args:
+            outfits (list): Outfit documents
+            per_category (int): Return the top per_category items of each category
+                instead of the top SUITABLE_OUTFITS_LIMIT overall
+            fields (list): Fields (besides _id) copied into results, or None for whole documents
+        """
+        self.per_category = per_category
+        self.fields = fields
+        self.outfits = sorted((outfit for outfit in outfits
+                               if all(is_number(outfit.get(field))
+                                      for field in ('temp_min', 'temp_max', 'humidity_min', 'humidity_max'))),
+                              key=outfit_rank_key)
+
+        bounds = {'temp_min': [], 'temp_max': [], 'humidity_min': [], 'humidity_max': []}
+        self.condition_masks = {}
+        self.category_masks = {}
+        for position, outfit in enumerate(self.outfits):
+            bit = 1 << position
+            for field, pairs in bounds.items():
+                pairs.append((outfit[field], bit))
+            for condition in outfit_conditions(outfit):
+                self.condition_masks[condition] = self.condition_masks.get(condition, 0) | bit
+            category = outfit.get('category')
+            self.category_masks[category] = self.category_masks.get(category, 0) | bit
+
+        self.temp_min = _RangeMasks(bounds['temp_min'], lower=True)
+        self.temp_max = _RangeMasks(bounds['temp_max'], lower=False)
+        self.humidity_min = _RangeMasks(bounds['humidity_min'], lower=True)
+        self.humidity_max = _RangeMasks(bounds['humidity_max'], lower=False)
+
+    def __len__(self):
+        return len(self.outfits)
+
+    def matching(self, temperature, humidity, weather_condition=None):
+        """
+        Return the bitset of items suitable for the weather (bit i is the i-th ranked item).
+
+        Args:
+            temperature (float): Temperature in Celsius
+            humidity (int): Humidity percentage
+            weather_condition (str): Weather condition category, or None for any
+
+        Returns:
+            int: Bitset of matching items
+        """
+        mask = (self.temp_min.matching(temperature) & self.temp_max.matching(temperature)
+                & self.humidity_min.matching(humidity) & self.humidity_max.matching(humidity))
+        if weather_condition:
+            mask &= self.condition_masks.get(weather_condition.lower(), 0)
+        return mask
+
+    @staticmethod
+    def _lowest(mask, limit):
+        """Return the positions of the lowest set bits of mask, up to limit."""
+        positions = []
+        while mask and len(positions) < limit:
+            low = mask & -mask
+            positions.append(low.bit_length() - 1)
+            mask ^= low
+        return positions
+
+    def select(self, mask):
+        """
+        Pick the items returned for a bitset of suitable items.
+
+        Returns:
+            list: Positions of the selected items, best ranked first
+        """
+        if self.per_category is None:
+            return self._lowest(mask, SUITABLE_OUTFITS_LIMIT)
+        positions = []
+        for category_mask in self.category_masks.values():
+            positions.extend(self._lowest(mask & category_mask, self.per_category))
+        return sorted(positions)
+
+    def document(self, position):
+        """Return a copy of the item at a position, limited to the index's fields."""
+        outfit = self.outfits[position]
+        if self.fields is None:
+            return dict(outfit)
+        document = {'_id': outfit.get('_id')}
+        for field in self.fields:
+            if field in outfit:
+                document[field] = outfit[field]
+        return document
+
+    def find_suitable(self, temperature, humidity, weather_condition=None):
+        """
+        Find suitable outfits, in the same order as DatabaseHandler's MongoDB query.
+
+        Args:
+            temperature (float): Temperature in Celsius
+            humidity (int): Humidity percentage
+            weather_condition (str): Weather condition category, or None for any
+
+        Returns:
+            list: Outfit documents, highest comfort_rating first
+        """
+        mask = self.matching(temperature, humidity, weather_condition)
+        return [self.document(position) for position in self.select(mask)]
+
+    def get_stats(self):
+        """Get index size."""
+        return {
+            'outfits': len(self.outfits),
+            'conditions': len(self.condition_masks),
+            'categories': len(self.category_masks),
+            'per_category': self.per_category,
+            'temperature_breakpoints': len(set(self.temp_min.values) | set(self.temp_max.values)),
+            'humidity_breakpoints': len(set(self.humidity_min.values) | set(self.humidity_max.values))
+        }
@@ -0,0 +1,183 @@
+# rate_limiter.py
+"""
+Token-bucket rate limiting for weather API calls.
+
+The bucket state can live in a small file guarded by an exclusive file lock,
+so every worker process of the same user draws from the same API quota. The
+file is created with mode 0600, and a file owned by another user or writable
+by others is not used.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to a per-process bucket
+    fcntl = None
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# open() flags for the state file; symlinks are not followed where the platform supports it
+_STATE_OPEN_FLAGS = os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0)
+
+# Priority lanes
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_STATE_FORMAT = 'dd'  # tokens, last refill time (epoch seconds)
+_STATE_SIZE = struct.calcsize(_STATE_FORMAT)
+
+class TokenBucket:
+    def __init__(self, calls_per_minute, burst, state_file=None, background_reserve=0.5):
+        """
+        Initialize a token bucket.
+
+        Args:
+            calls_per_minute (float): Sustained refill rate
+            burst (int): Bucket capacity
+            state_file (str): File shared between processes, or None for a per-process bucket
+            background_reserve (float): Fraction of the bucket only interactive calls may use
+        """
+        self.rate = calls_per_minute / 60.0
+        self.capacity = float(burst)
+        self.reserve = self.capacity * background_reserve
+        self.state_file = state_file if fcntl is not None else None
+        if state_file and fcntl is None:
+            logger.warning("File locking is not available on this platform; rate limit is per process")
+        if self.state_file and not self._state_file_is_private():
+            self.state_file = None
+
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._interactive_waiting = 0
+
+        self.granted = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.denied = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.total_wait = 0.0
+
+    def acquire(self, priority=INTERACTIVE, timeout=0.0):
+        """
+        Take one token, waiting up to timeout seconds for it.
+
+        Background calls never use the reserved part of the bucket and give
+        way while an interactive call in this process is waiting.
+
+        Args:
+            priority (str): INTERACTIVE or BACKGROUND
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: True if a token was taken
+        """
+        start = time.monotonic()
+        deadline = start + max(0.0, timeout)
+        waiting = False
+        try:
+            while True:
+                wait = self._try_take(priority)
+                if wait == 0.0:
+                    with self._lock:
+                        self.granted[priority] += 1
+                        self.total_wait += time.monotonic() - start
+                    return True
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self.denied[priority] += 1
+                    return False
+
+                if priority == INTERACTIVE and not waiting:
+                    waiting = True
+                    with self._lock:
+                        self._interactive_waiting += 1
+                time.sleep(min(wait, remaining))
+        finally:
+            if waiting:
+                with self._lock:
+                    self._interactive_waiting -= 1
+
+    def _try_take(self, priority):
+        """Take a token if the lane allows it. Returns 0.0 on success, else seconds until one may be available."""
+        floor = 1.0 if priority == INTERACTIVE else 1.0 + self.reserve
+        if priority == BACKGROUND and self._interactive_waiting:
+            return 1.0 / self.rate
+
+        def take(tokens):
+            if tokens >= floor:
+                return tokens - 1.0, 0.0
+            return tokens, (floor - tokens) / self.rate
+
+        return self._update(take)
+
+    def _state_file_is_private(self):
+        """Create the state file if needed and check that only this user can change it."""
+        try:
+            fd = os.open(self.state_file, _STATE_OPEN_FLAGS, 0o600)
+        except OSError as e:
+            logger.warning(f"Cannot open rate limit state file {self.state_file} ({e}); rate limit is per process")
+            return False
+        try:
+            status = os.fstat(fd)
+        finally:
+            os.close(fd)
+        if status.st_uid != os.getuid() or status.st_mode & 0o022:
+            logger.warning(f"Rate limit state file {self.state_file} is not private to this user; "
+                           f"rate limit is per process")
+            return False
+        return True
+
+    def _update(self, func):
+        """Refill the bucket, apply func(tokens) -> (tokens, result) and store the new state."""
+        if self.state_file is None:
+            with self._lock:
+                now = time.time()
+                tokens = self._refill(self._tokens, self._updated, now)
+                self._tokens, result = func(tokens)
+                self._updated = now
+                return result
+
+        fd = os.open(self.state_file, _STATE_OPEN_FLAGS, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, _STATE_SIZE, 0)
+            if len(data) == _STATE_SIZE:
+                tokens, updated = struct.unpack(_STATE_FORMAT, data)
+            else:
+                tokens, updated = self.capacity, time.time()
+            now = time.time()
+            tokens, result = func(self._refill(tokens, updated, now))
+            os.pwrite(fd, struct.pack(_STATE_FORMAT, tokens, now), 0)
+            return result
+        finally:
+            os.close(fd)  # Also releases the lock
+
+    def _refill(self, tokens, updated, now):
+        """Add tokens earned since the last update."""
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def available_tokens(self):
+        """Return the number of tokens currently in the bucket."""
+        return self._update(lambda tokens: (tokens, tokens))
+
+    def get_stats(self):
+        """Get bucket level and per-lane counters."""
+        available = self.available_tokens()
+        with self._lock:
+            granted = sum(self.granted.values())
+            return {
+                'available_tokens': round(available, 2),
+                'capacity': self.capacity,
+                'calls_per_minute': round(self.rate * 60, 2),
+                'shared': self.state_file is not None,
+                'granted': dict(self.granted),
+                'denied': dict(self.denied),
+                'avg_wait_ms': round(self.total_wait / granted * 1000, 2) if granted else 0.0
+            }
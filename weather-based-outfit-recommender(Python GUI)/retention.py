@@ -0,0 +1,117 @@
+# retention.py
+"""
+Daily roll-up of weather and recommendation history.
+
+TTL indexes on timestamp (WEATHER_RETENTION_DAYS, RECOMMENDATION_RETENTION_DAYS)
+delete old detail. Before that happens, the roll-up job has compacted every
+day into one summary document per city in the daily summary collection, so
+long-term trends outlive the detail. DatabaseHandler.ensure_indexes rolls up
+everything stored before it first enables TTL; after that, this job keeps the
+most recent ROLLUP_LOOKBACK_DAYS days up to date.
+
+Inside the Flask or desktop app (ROLLUP_ENABLED in config.py) the job runs in
+a background thread. Run on its own (python retention.py) it rolls up once,
+which suits a cron job; --all rolls up everything still stored.
+"""
+
+import argparse
+import logging
+import threading
+import time
+from datetime import datetime
+from config import ROLLUP_INTERVAL, ROLLUP_LOOKBACK_DAYS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class RollupJob:
+    def __init__(self, db, interval=ROLLUP_INTERVAL, lookback_days=ROLLUP_LOOKBACK_DAYS):
+        """
+        Initialize the roll-up job.
+
+        Args:
+            db (DatabaseHandler): Database whose history is rolled up
+            interval (float): Seconds between roll-up runs
+            lookback_days (int): Days (including today) recomputed by each run
+        """
+        self.db = db
+        self.interval = interval
+        self.lookback_days = lookback_days
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration_ms = None
+
+    def start(self):
+        """Start rolling up in a daemon thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='rollup-job', daemon=True)
+        self._thread.start()
+        logger.info(f"Roll-up job started (every {self.interval} s, last {self.lookback_days} days)")
+
+    def stop(self):
+        """Stop the roll-up thread."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        logger.info("Roll-up job stopped")
+
+    def _run(self):
+        """Roll up every interval seconds until stopped."""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Roll-up run failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def run_once(self):
+        """
+        Run a single roll-up.
+
+        Returns:
+            bool: True if both collections were rolled up
+        """
+        start = time.perf_counter()
+        success = self.db.rollup_daily_summaries(days=self.lookback_days)
+        self.last_duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        self.last_run = datetime.utcnow()
+        self.runs += 1
+        if not success:
+            self.failures += 1
+        return success
+
+    def get_stats(self):
+        """Get run counters and the duration of the last run."""
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'runs': self.runs,
+            'failures': self.failures,
+            'lookback_days': self.lookback_days,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_duration_ms': self.last_duration_ms
+        }
+
+# Roll up once, e.g. from cron
+if __name__ == "__main__":
+    from db_handler import create_database_handler
+
+    parser = argparse.ArgumentParser(description="Roll weather and recommendations up into daily summaries.")
+    parser.add_argument('--all', action='store_true', help="Roll up everything still stored, not just recent days")
+    args = parser.parse_args()
+
+    db = create_database_handler()
+    try:
+        if db.rollup_daily_summaries(days=None if args.all else ROLLUP_LOOKBACK_DAYS):
+            print(f"✓ Daily summaries updated ({'all stored days' if args.all else f'last {ROLLUP_LOOKBACK_DAYS} days'})")
+        else:
+            print("✗ Roll-up failed, see the log")
+    finally:
+        db.close_connection()
@@ -15,6 +15,7 @@ def test_imports():
     try:
         import config
         import db_handler
+        import sqlite_handler
         import weather_api
         import outfit_recommender
         print("✓ All modules imported successfully")
@@ -48,6 +49,456 @@ def test_database():
         print(f"✗ Database test failed: {e}")
         return False
 
+def test_indexes():
+    """Test that every hot query is answered from an index."""
+    print("\nTesting database indexes...")
+
+    try:
+        from db_handler import DatabaseHandler, find_index_scans
+
+        # Index scans are found at any depth of an explain() plan
+        plan = {'stage': 'LIMIT', 'inputStage': {'stage': 'FETCH', 'inputStage': {
+            'stage': 'IXSCAN', 'indexName': 'timestamp'}}}
+        if find_index_scans(plan) != ['timestamp'] or find_index_scans({'stage': 'COLLSCAN'}):
+            print("✗ Index scans not found in explain() plan")
+            return False
+
+        db = DatabaseHandler()
+        if not db.test_connection():
+            print("⚠ Database not reachable, skipping index creation and explain() checks")
+            return True
+
+        # Creating the indexes twice must not fail
+        if not db.ensure_indexes() or not db.ensure_indexes():
+            print("✗ Index creation failed")
+            db.close_connection()
+            return False
+
+        results = db.verify_indexes()
+        db.close_connection()
+        scans = [query for query, index in results.items() if index is None]
+        if scans:
+            print(f"✗ Queries running as collection scans: {', '.join(scans)}")
+            return False
+
+        print(f"✓ Indexes test successful: {len(results)} queries use indexes")
+        return True
+
+    except Exception as e:
+        print(f"✗ Indexes test failed: {e}")
+        return False
+
+def test_retention():
+    """Test TTL index options and the daily roll-up (the roll-up needs MongoDB 4.2+)."""
+    print("\nTesting retention and daily roll-up...")
+
+    try:
+        from datetime import timedelta
+        from db_handler import DatabaseHandler, timestamp_index, without_ttl
+
+        index = timestamp_index(30)
+        if index.document.get('expireAfterSeconds') != 30 * 24 * 3600 or 'expireAfterSeconds' in without_ttl(index).document:
+            print(f"✗ Unexpected TTL index options: {index.document}")
+            return False
+        if without_ttl(index).document != timestamp_index().document:
+            print("✗ Index without TTL differs from the plain timestamp index")
+            return False
+
+        # Changed retention settings change the TTL of the existing index (on a fake collection)
+        class FakeCollection:
+            name = 'weather'
+
+            def __init__(self, ttl):
+                self.indexes = {'timestamp': {'key': [('timestamp', -1)], 'expireAfterSeconds': ttl}}
+
+            def index_information(self):
+                return self.indexes
+
+            def drop_index(self, name):
+                del self.indexes[name]
+
+        class FakeDatabase:
+            def __init__(self, collection):
+                self.collection = collection
+
+            def command(self, name, collection, index):
+                self.collection.indexes[index['name']]['expireAfterSeconds'] = index['expireAfterSeconds']
+
+        db = DatabaseHandler()
+        for before, after in ((30, 7), (None, 7), (7, None)):
+            collection = FakeCollection(before * 24 * 3600 if before else None)
+            db.db = FakeDatabase(collection)
+            db._reconcile_ttl(collection, [timestamp_index(after)])
+            ttl = collection.indexes.get('timestamp', {}).get('expireAfterSeconds')
+            if ttl != (after * 24 * 3600 if after else None):
+                print(f"✗ TTL not changed from {before} to {after} days: {collection.indexes}")
+                return False
+        db.close_connection()
+
+        db = DatabaseHandler()
+        if not db.test_connection():
+            print("⚠ Database not reachable, skipping roll-up check")
+            return True
+
+        # Scratch collections, so stored history is left alone
+        db.weather_collection = db.db['retention_test_weather']
+        db.recommendations_collection = db.db['retention_test_recommendations']
+        db.daily_summary_collection = db.db['retention_test_summary']
+        try:
+            now = datetime.utcnow()
+            db.weather_collection.insert_many([
+                {'city': city, 'temperature': temperature, 'humidity': 50, 'weather_main': 'Clear',
+                 'timestamp': now - timedelta(days=days)}
+                for days in (0, 1) for city, temperature in (('Paris', 10), ('paris', 20))])
+            db.recommendations_collection.insert_one({'city': 'Paris', 'recommendation_count': 4,
+                                                      'weather': {'weather_main': 'Clear'}, 'timestamp': now})
+            if not db.rollup_daily_summaries() or not db.rollup_daily_summaries():
+                print("⚠ Roll-up not supported by this server ($merge needs MongoDB 4.2), skipping")
+                return True
+
+            summaries = db.get_daily_summaries('PARIS')
+            today = summaries[0] if summaries else {}
+            if (len(summaries) != 2 or today.get('weather', {}).get('readings') != 2
+                    or today['weather'].get('temp_avg') != 15 or today.get('recommendations', {}).get('count') != 1):
+                print(f"✗ Unexpected daily summaries: {summaries}")
+                return False
+        finally:
+            db.weather_collection.drop()
+            db.recommendations_collection.drop()
+            db.daily_summary_collection.drop()
+            db.close_connection()
+
+        print(f"✓ Retention test successful ({len(summaries)} daily summaries)")
+        return True
+
+    except Exception as e:
+        print(f"✗ Retention test failed: {e}")
+        return False
+
+def test_collection_pages():
+    """Test keyset cursors and filters of the collection viewer pages."""
+    print("\nTesting collection pages...")
+
+    try:
+        from pymongo import ASCENDING, DESCENDING
+        from db_handler import (DatabaseHandler, keyset_filter, encode_page_cursor, decode_page_cursor,
+                                collection_page_filters)
+
+        last = {'timestamp': datetime(2024, 5, 1, 12, 30), '_id': 'b'}
+        key = decode_page_cursor('weather', encode_page_cursor('weather', last))
+        if key != [last['timestamp'], 'b']:
+            print(f"✗ Page cursor did not round-trip: {key}")
+            return False
+        sort = [('timestamp', DESCENDING), ('_id', DESCENDING)]
+        expected = {'$or': [{'timestamp': {'$lt': last['timestamp']}}, {'timestamp': None},
+                            {'timestamp': last['timestamp'], '_id': {'$lt': 'b'}}]}
+        if (keyset_filter(sort, key) != expected
+                or keyset_filter([('_id', ASCENDING)], ['b']) != {'$or': [{'_id': {'$gt': 'b'}}]}):
+            print(f"✗ Unexpected keyset filter: {keyset_filter(sort, key)}")
+            return False
+
+        filters = collection_page_filters('weather', {'city': 'London', 'timestamp_from': '2024-05-01', 'fields': 'city'})
+        if filters != {'city': 'London', 'timestamp': (datetime(2024, 5, 1), None)}:
+            print(f"✗ Unexpected page filters: {filters}")
+            return False
+        for bad in [lambda: decode_page_cursor('outfit', encode_page_cursor('weather', last)),
+                    lambda: collection_page_filters('weather', {'timestamp_to': 'yesterday'})]:
+            try:
+                bad()
+                print("✗ Invalid page parameters were accepted")
+                return False
+            except ValueError:
+                pass
+
+        db = DatabaseHandler()
+        if not db.test_connection():
+            print("⚠ Database not reachable, skipping page walk")
+            return True
+
+        # Walk the first pages of weather history: newest first, no document twice
+        seen, previous, after = set(), None, None
+        for _ in range(20):
+            page = db.get_collection_page('weather', limit=5, after=after, fields=['city'])
+            if page is None:
+                print("✗ Page query failed")
+                db.close_connection()
+                return False
+            for document in page['data']:
+                stamp = document.get('timestamp')
+                if document['_id'] in seen or (previous and stamp and stamp > previous):
+                    print(f"✗ Page out of order at {document['_id']}")
+                    db.close_connection()
+                    return False
+                if 'raw_data' in document or 'temperature' in document:
+                    print(f"✗ Page not projected: {sorted(document)}")
+                    db.close_connection()
+                    return False
+                seen.add(document['_id'])
+                previous = stamp or previous
+            after = page['next']
+            if not after:
+                break
+        db.close_connection()
+
+        print(f"✓ Collection pages test successful ({len(seen)} documents paged)")
+        return True
+
+    except Exception as e:
+        print(f"✗ Collection pages test failed: {e}")
+        return False
+
+def test_sqlite_backend():
+    """Test the SQLite storage backend on a temporary file (no MongoDB needed)."""
+    print("\nTesting SQLite backend...")
+
+    try:
+        import os
+        import tempfile
+        import threading
+        from datetime import timedelta
+        import sqlite_handler
+        from db_handler import create_database_handler
+
+        directory = tempfile.mkdtemp()
+        db = create_database_handler('sqlite', path=os.path.join(directory, 'test.db'), outfit_query_mode='find')
+        configured_retention = sqlite_handler.WEATHER_RETENTION_DAYS
+        sqlite_handler.WEATHER_RETENTION_DAYS = 30  # Retention is off by default
+        try:
+            outfits = [
+                {'clothing_type': 'T-Shirt', 'category': 'Top', 'temp_min': 15, 'temp_max': 40, 'humidity_min': 0,
+                 'humidity_max': 100, 'weather_conditions': ['clear', 'clouds'], 'comfort_rating': 9},
+                {'clothing_type': 'Raincoat', 'category': 'Outerwear', 'temp_min': 5, 'temp_max': 25,
+                 'humidity_min': 40, 'humidity_max': 100, 'weather_conditions': 'rain', 'comfort_rating': 7},
+                {'clothing_type': 'Parka', 'category': 'Outerwear', 'temp_min': -30, 'temp_max': 5,
+                 'humidity_min': 0, 'humidity_max': 100, 'weather_conditions': ['snow'], 'comfort_rating': 8}
+            ]
+            db.insert_outfit_data(outfits)
+            db.ensure_indexes()
+
+            # The SQL query and the catalog index must agree
+            for weather in [(20, 60, 'Clear'), (20, 60, 'Rain'), (0, 50, 'snow'), (20, 60, None)]:
+                expected = [outfit['clothing_type'] for outfit in db._query_suitable_outfits(*weather)]
+                found = [outfit['clothing_type'] for outfit in db.get_suitable_outfits(*weather)]
+                if found != expected:
+                    print(f"✗ Suitable outfits for {weather} differ: {found} != {expected}")
+                    return False
+            if expected != ['T-Shirt', 'Raincoat']:
+                print(f"✗ Unexpected suitable outfits: {expected}")
+                return False
+
+            weather_id = db.insert_weather_data({'city': 'London', 'temperature': 12.5, 'humidity': 80,
+                                                 'weather_main': 'Rain', 'fetch_time': '2024-05-01 12:00:00'})
+            latest = db.get_latest_weather('LONDON')
+            if not latest or latest['_id'] != weather_id:
+                print(f"✗ Latest weather not found case-insensitively: {latest}")
+                return False
+            raincoat = db.get_suitable_outfits(12.5, 80, 'rain')[0]
+            db.insert_recommendation({'city': 'London', 'weather': latest, 'recommendation_count': 1,
+                                      'recommended_outfits': [{'outfit_type': 'Complete Outfit', 'items': [raincoat]}]},
+                                     weather_ref=weather_id)
+            history = db.get_recommendations_history(limit=5)
+            if (len(history) != 1 or history[0].get('weather_ref') != weather_id
+                    or history[0]['recommended_outfits'][0]['items'][0]['clothing_type'] != 'Raincoat'):
+                print(f"✗ Recommendation not stored normalized and hydrated: {history}")
+                return False
+            if db.get_popular_cities() != [{'city': 'London', 'count': 1}]:
+                print(f"✗ Unexpected popular cities: {db.get_popular_cities()}")
+                return False
+
+            # Pages walk newest first; old detail is rolled up before retention deletes it
+            for i in range(7):
+                db.insert_record('weather', {'city': 'Paris', 'temperature': i,
+                                             'timestamp': datetime.utcnow() - timedelta(days=100 - i)})
+            seen, after = [], None
+            while True:
+                page = db.get_collection_page('weather', limit=3, after=after, filters={'city': 'paris'})
+                seen.extend(document['temperature'] for document in page['data'])
+                after = page['next']
+                if not after:
+                    break
+            if seen != list(range(6, -1, -1)):
+                print(f"✗ Unexpected page walk: {seen}")
+                return False
+            if not db.rollup_daily_summaries(days=None):
+                print("✗ Roll-up failed")
+                return False
+            paris = db.get_daily_summaries('Paris')
+            stats = db.get_collection_stats()
+            if len(paris) != 7 or stats['weather_count'] != 1:
+                print(f"✗ Unexpected retention result: {len(paris)} summaries, {stats}")
+                return False
+
+            unused = [query for query, index in db.verify_indexes().items() if not index]
+            if unused:
+                print(f"✗ Queries without an index: {', '.join(unused)}")
+                return False
+
+            # Connections of finished threads are closed, and a released connection is not kept
+            for _ in range(5):
+                thread = threading.Thread(target=db.get_latest_weather, args=('London',))
+                thread.start()
+                thread.join()
+            db.get_latest_weather('London')
+            if db.get_connection_count() > 2:
+                print(f"✗ Connections of finished threads were kept: {db.get_connection_count()}")
+                return False
+            db.release_connection()
+            if db.get_connection_count() != 0 or not db.get_latest_weather('London'):
+                print(f"✗ Released connection was kept or not reopened: {db.get_connection_count()}")
+                return False
+        finally:
+            sqlite_handler.WEATHER_RETENTION_DAYS = configured_retention
+            db.close_connection()
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+        print("✓ SQLite backend test successful")
+        return True
+
+    except Exception as e:
+        print(f"✗ SQLite backend test failed: {e}")
+        return False
+
+def test_catalog_watcher():
+    """Test that outfit writes from outside the app rebuild the catalog index (needs a replica set)."""
+    print("\nTesting catalog change stream...")
+
+    try:
+        import time
+        from db_handler import DatabaseHandler, get_catalog_version
+        from catalog_watcher import CatalogWatcher
+
+        db = DatabaseHandler()
+        if not db.test_connection():
+            print("⚠ Database not reachable, skipping catalog watcher test")
+            return True
+
+        # Writes through the app bump the version themselves
+        version = get_catalog_version()
+        if db.bump_catalog_version() != version + 1:
+            print("✗ Catalog version was not bumped")
+            db.close_connection()
+            return False
+
+        watcher = CatalogWatcher(db)
+        watcher.start()
+        if not watcher.wait_until_ready(timeout=10):
+            watcher.stop()
+            db.close_connection()
+            print(f"⚠ Change streams not available ({watcher.last_error}), skipping catalog watcher test")
+            return True
+
+        db.get_outfit_index()
+        item = {'clothing_type': 'Watcher Test Item', 'category': 'Accessory', 'temp_min': -100, 'temp_max': 100,
+                'humidity_min': 0, 'humidity_max': 100, 'weather_conditions': ['clear'], 'comfort_rating': 100}
+        other = DatabaseHandler()  # Another writer that does not bump this process's version
+        other.outfit_collection.insert_one(item)
+        try:
+            deadline = time.monotonic() + 10
+            found = False
+            while time.monotonic() < deadline and not found:
+                found = any(outfit['clothing_type'] == 'Watcher Test Item'
+                            for outfit in db.get_suitable_outfits(20, 50, 'clear'))
+                time.sleep(0.1)
+        finally:
+            other.outfit_collection.delete_one({'_id': item['_id']})
+            other.close_connection()
+            watcher.stop()
+            db.close_connection()
+
+        if not found:
+            print(f"✗ Catalog index was not rebuilt after an outside write: {watcher.get_stats()}")
+            return False
+
+        print(f"✓ Catalog watcher test successful: {watcher.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Catalog watcher test failed: {e}")
+        return False
+
+def test_catalog_watcher_resume():
+    """Test that the catalog watcher resumes a failed change stream from its resume token (fake change stream)."""
+    print("\nTesting catalog watcher resume...")
+
+    watcher = None
+    try:
+        import threading
+        import time
+        from pymongo.errors import AutoReconnect, OperationFailure
+        from db_handler import get_catalog_version
+        from catalog_watcher import CatalogWatcher, CHANGE_STREAM_HISTORY_LOST
+
+        class FakeStream:
+            """Replays (resume token, change or exception) steps, then idles."""
+            alive = True
+
+            def __init__(self, steps):
+                self.steps = list(steps)
+                self.resume_token = None
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def try_next(self):
+                if not self.steps:
+                    time.sleep(0.01)
+                    return None
+                self.resume_token, change = self.steps.pop(0)
+                if isinstance(change, Exception):
+                    raise change
+                return change
+
+        # Each watch() call opens the next stream: a network error, then lost history, then a quiet stream
+        streams = [FakeStream([({'_data': '1'}, {'operationType': 'insert'}), ({'_data': '1'}, AutoReconnect('connection reset'))]),
+                   FakeStream([({'_data': '2'}, {'operationType': 'update'}),
+                               ({'_data': '2'}, OperationFailure('history lost', CHANGE_STREAM_HISTORY_LOST))]),
+                   FakeStream([({'_data': '3'}, None)])]
+        resumed_after = []
+        all_opened = threading.Event()
+
+        class FakeCollection:
+            def watch(self, resume_after=None, max_await_time_ms=None):
+                resumed_after.append(resume_after)
+                if len(resumed_after) == len(streams):
+                    all_opened.set()
+                return streams[min(len(resumed_after), len(streams)) - 1]
+
+        class FakeDatabase:
+            outfit_collection = FakeCollection()
+
+        version = get_catalog_version()
+        watcher = CatalogWatcher(FakeDatabase(), retry_interval=0.01)
+        watcher.start()
+        if not all_opened.wait(timeout=5):
+            print(f"✗ Change stream not reopened: {watcher.get_stats()}")
+            return False
+        time.sleep(0.05)
+        watcher.stop()
+
+        if resumed_after[:3] != [None, {'_data': '1'}, None]:
+            print(f"✗ Unexpected resume tokens: {resumed_after}")
+            return False
+        # Two events, plus one bump for each stream opened without a resume token
+        stats = watcher.get_stats()
+        if stats['events'] != 2 or stats['reconnects'] != 2 or get_catalog_version() != version + 4:
+            print(f"✗ Unexpected watcher state: {stats}, version {get_catalog_version() - version} bumps")
+            return False
+
+        print(f"✓ Catalog watcher resume test successful: {stats}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Catalog watcher resume test failed: {e}")
+        return False
+    finally:
+        if watcher is not None:
+            watcher.stop()
+
 def test_weather_api():
     """Test weather API connection."""
     print("\nTesting weather API...")
@@ -81,6 +532,957 @@ def test_weather_api():
         print(f"✗ Weather API test failed: {e}")
         return False
 
+def test_weather_cache():
+    """Test weather cache expiry, LRU eviction and counters."""
+    print("\nTesting weather cache...")
+
+    try:
+        import time
+        from weather_api import WeatherCache, normalize_city_name
+
+        cache = WeatherCache(ttl=0.05, stale_ttl=0.05, max_size=2)
+        key = (normalize_city_name('  New   York '), 'metric')
+        if key != ('new york', 'metric'):
+            print(f"✗ Unexpected cache key: {key}")
+            return False
+
+        cache.set(key, {'name': 'New York'})
+        if cache.get(key) != ({'name': 'New York'}, False):
+            print("✗ Fresh entry not served from cache")
+            return False
+
+        time.sleep(0.07)
+        if cache.get(key) != ({'name': 'New York'}, True):
+            print("✗ Expired entry not served as stale")
+            return False
+
+        time.sleep(0.05)
+        if cache.get(key) != (None, False):
+            print("✗ Entry served after stale window")
+            return False
+
+        cache.set(('a', 'metric'), 1)
+        cache.set(('b', 'metric'), 2)
+        cache.get(('a', 'metric'))
+        cache.set(('c', 'metric'), 3)
+        if cache.get(('b', 'metric'))[0] is not None or cache.get(('a', 'metric'))[0] != 1:
+            print("✗ Least recently used entry was not evicted")
+            return False
+
+        stats = cache.get_stats()
+        print(f"✓ Weather cache test successful: {stats}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Weather cache test failed: {e}")
+        return False
+
+def test_parsed_weather():
+    """Test the dict-style access of the __slots__ weather record."""
+    print("\nTesting parsed weather record...")
+
+    try:
+        from weather_api import ParsedWeather
+
+        weather = ParsedWeather('Pune', 'IN', 24.0, 24.5, 60, 'Clear', 'clear sky', weather_id=800)
+        if hasattr(weather, '__dict__'):
+            print("✗ ParsedWeather has a per-instance __dict__")
+            return False
+        if (weather['temperature'] != 24.0 or weather.get('stale') is not False or 'stale_age_seconds' not in weather
+                or weather.get('raw_data', 'default') is not None):
+            print(f"✗ Unexpected field access: {weather}")
+            return False
+        if 'keys' in weather or 'unknown' in weather or weather.get('unknown', 'default') != 'default':
+            print("✗ Non-field names treated as fields")
+            return False
+
+        # A slot without a value behaves like a missing key
+        del weather.raw_data
+        if 'raw_data' in weather or weather.get('raw_data', 'default') != 'default':
+            print("✗ Unset slot reported as present")
+            return False
+        try:
+            weather['raw_data']
+            print("✗ Unset slot returned a value")
+            return False
+        except KeyError:
+            pass
+
+        document = ParsedWeather.from_document(dict(weather.to_json(), _id='x', timestamp=None))
+        if document.to_json() != weather.to_json():
+            print(f"✗ Document round trip changed the record: {document}")
+            return False
+
+        print("✓ Parsed weather test successful")
+        return True
+
+    except Exception as e:
+        print(f"✗ Parsed weather test failed: {e}")
+        return False
+
+def test_geo_cache():
+    """Test that nearby places share one cache cell once their coordinates are known."""
+    print("\nTesting geo-quantized weather cache...")
+
+    try:
+        from weather_api import WeatherAPI, WeatherCache, geohash_encode
+        from gazetteer import CityIndex
+
+        if geohash_encode(57.64911, 10.40744, 11) != 'u4pruydqqvj':
+            print("✗ Unexpected geohash")
+            return False
+
+        locations = {'mumbai': (19.07, 72.88), 'navi mumbai': (19.03, 73.03), 'bombay': (19.07, 72.88)}
+        fetched = []
+
+        def fake_fetch(city, priority=None, lat=None, lon=None, deadline=None):
+            fetched.append(city)
+            lat, lon = locations[city.lower()]
+            return {'name': 'Mumbai' if city == 'Bombay' else city, 'coord': {'lat': lat, 'lon': lon}}
+
+        weather_api = WeatherAPI(cache=WeatherCache(), city_locations_cache=WeatherCache(ttl=float('inf')),
+                                 geohash_precision=4, city_index=CityIndex())
+        weather_api._fetch_weather_data = fake_fetch
+
+        weather_api.get_weather_data('Bombay')
+        mumbai = weather_api.get_weather_data('Mumbai')
+        weather_api.get_weather_data('Navi Mumbai')
+        cached = weather_api.get_weather_data(lat=19.05, lon=72.9)
+        bombay = weather_api.get_weather_data('bombay')
+
+        if fetched != ['Bombay', 'Navi Mumbai'] or cached is None:
+            print(f"✗ Nearby places were not served from one cell: fetched {fetched}")
+            return False
+        if mumbai['name'] != 'Mumbai' or bombay['name'] != 'Mumbai' or bombay['coord']['lon'] != 72.88:
+            print(f"✗ Cell data not labeled with the requested city: {bombay}")
+            return False
+
+        print(f"✓ Geo-quantized cache test successful: {weather_api.get_cache_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Geo-quantized cache test failed: {e}")
+        return False
+
+def test_unit_conversion():
+    """Test that every unit setting is served from one metric fetch."""
+    print("\nTesting unit conversion...")
+
+    try:
+        from weather_api import WeatherAPI, WeatherCache
+        from gazetteer import CityIndex
+
+        fetched = []
+
+        def fake_fetch(city, priority=None, lat=None, lon=None, deadline=None):
+            fetched.append(city)
+            return {'name': city, 'main': {'temp': 20.0, 'feels_like': -40.0, 'humidity': 50},
+                    'wind': {'speed': 10.0}}
+
+        weather_api = WeatherAPI(cache=WeatherCache(), city_index=CityIndex())
+        weather_api._fetch_weather_data = fake_fetch
+
+        metric = weather_api.get_weather_data('Oslo')
+        imperial = weather_api.get_weather_data('Oslo', 'imperial')
+        kelvin = weather_api.get_weather_data('Oslo', 'kelvin')
+
+        if len(fetched) != 1:
+            print(f"✗ Each unit setting called the API: {fetched}")
+            return False
+        if (imperial['main']['temp'] != 68.0 or imperial['main']['feels_like'] != -40.0
+                or imperial['wind']['speed'] != 22.37 or kelvin['main']['temp'] != 293.15
+                or kelvin['wind']['speed'] != 10.0 or metric['main']['temp'] != 20.0):
+            print(f"✗ Unexpected conversion: {imperial}, {kelvin}")
+            return False
+
+        print("✓ Unit conversion test successful")
+        return True
+
+    except Exception as e:
+        print(f"✗ Unit conversion test failed: {e}")
+        return False
+
+def test_gazetteer():
+    """Test city name canonicalization, prefix search and offline rejection of unknown names."""
+    print("\nTesting gazetteer...")
+
+    try:
+        from gazetteer import CityIndex, City
+        from weather_api import WeatherAPI, ERROR_NOT_FOUND
+
+        index = CityIndex([City('London', 'GB', 51.51, -0.13, 2643743), City('London', 'CA', 42.98, -81.25, None),
+                           City('Mumbai', 'IN', 19.08, 72.88, None), City('Sao Paulo', 'BR', -23.55, -46.63, None)],
+                          aliases={2: ['Bombay'], 3: ['São Paulo']})
+
+        if (index.resolve(' bombay ').name != 'Mumbai' or index.resolve('London').country != 'GB'
+                or index.resolve('london, ca').country != 'CA' or index.resolve('são paulo').name != 'Sao Paulo'
+                or index.resolve('Atlantis') is not None):
+            print("✗ Names not resolved correctly")
+            return False
+
+        suggestions = [(city.name, city.country) for city in index.suggest('lo')]
+        if suggestions != [('London', 'GB'), ('London', 'CA')] or index.suggest('x'):
+            print(f"✗ Unexpected suggestions: {suggestions}")
+            return False
+
+        weather_api = WeatherAPI(city_index=index, strict_city_names=True)
+        if weather_api.get_weather_data('Atlantis') is not None or weather_api.get_last_error() != ERROR_NOT_FOUND:
+            print("✗ Unknown city was not rejected offline")
+            return False
+
+        print(f"✓ Gazetteer test successful: {index.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Gazetteer test failed: {e}")
+        return False
+
+def test_stub_server():
+    """Test replaying recorded responses and 429 bursts from the stub server."""
+    print("\nTesting stub weather server...")
+
+    stub = None
+    try:
+        import requests
+        from stub_server import StubWeatherServer
+        from weather_api import WeatherAPI, WeatherCache
+        from gazetteer import CityIndex
+
+        recording = {'name': 'Pune', 'coord': {'lat': 18.52, 'lon': 73.86}, 'sys': {'country': 'IN'},
+                     'main': {'temp': 24.0, 'feels_like': 24.5, 'humidity': 60},
+                     'weather': [{'id': 800, 'main': 'Clear', 'description': 'clear sky'}]}
+        stub = StubWeatherServer([recording], burst_every=3, burst_length=2).start()
+
+        weather_api = WeatherAPI(cache=WeatherCache(), base_url=stub.base_url, city_index=CityIndex(),
+                                 city_locations_cache=WeatherCache(ttl=float('inf')))
+        weather = weather_api.parse_weather_data(weather_api.get_weather_data('pune'))
+        if weather is None or weather.temperature != 24.0 or weather.weather_detail != 'clear':
+            print(f"✗ Recording not replayed: {weather}")
+            return False
+        weather_api.close()
+
+        statuses = [requests.get(stub.base_url, params={'q': city}, timeout=5).status_code
+                    for city in ('Pune', 'Atlantis', 'Pune', 'Pune', 'Pune')]
+        if statuses != [200, 404, 429, 429, 200]:
+            print(f"✗ Unexpected statuses: {statuses}")
+            return False
+
+        print(f"✓ Stub weather server test successful: {stub.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Stub weather server test failed: {e}")
+        return False
+    finally:
+        if stub is not None:
+            stub.stop()
+
+def test_negative_cache():
+    """Test that unknown cities are cached and 401/429 responses pause API calls without further requests."""
+    print("\nTesting negative cache and upstream blocks...")
+
+    stub = None
+    try:
+        import time
+        from stub_server import StubWeatherServer
+        from rate_limiter import TokenBucket
+        from weather_api import WeatherAPI, WeatherCache, UpstreamBlock, ERROR_NOT_FOUND, ERROR_BLOCKED
+        from gazetteer import CityIndex
+        from config import AUTH_FAILURE_BLOCK_SECONDS
+
+        class StatusServer(StubWeatherServer):
+            status = None  # Answer every request with this status when set
+
+            def respond(self, params):
+                if self.status is not None:
+                    with self._lock:
+                        self.requests += 1
+                    return self.status, {'cod': self.status}, {'Retry-After': '1'}
+                return super().respond(params)
+
+        stub = StatusServer([{'name': 'Pune', 'main': {'temp': 24.0}}]).start()
+        weather_api = WeatherAPI(cache=WeatherCache(), base_url=stub.base_url, city_index=CityIndex(),
+                                 city_locations_cache=WeatherCache(ttl=float('inf')),
+                                 rate_limiter=TokenBucket(calls_per_minute=10 ** 9, burst=10 ** 9), hedging=False)
+        weather_api.negative_cache = WeatherCache(ttl=60, stale_ttl=0)
+        weather_api.upstream_block = UpstreamBlock()
+
+        def calls(city):
+            before = stub.get_stats()['requests']
+            weather = weather_api.get_weather_data(city, deadline=time.monotonic() + 0.5)
+            return weather, weather_api.get_last_error(), stub.get_stats()['requests'] - before
+
+        # 404: the second lookup is answered from the negative cache
+        first, second = calls('Atlantis'), calls('atlantis')
+        if first != (None, ERROR_NOT_FOUND, 1) or second != (None, ERROR_NOT_FOUND, 0):
+            print(f"✗ Unknown city not negative-cached: {first}, {second}")
+            return False
+        misses = weather_api.negative_cache.get_stats()['misses']
+        if not weather_api.check_request('Atlantis') or weather_api.negative_cache.get_stats()['misses'] != misses:
+            print("✗ check_request did not reject the cached city without counting a lookup")
+            return False
+
+        # 429: every city is paused for the Retry-After period
+        stub.status = 429
+        blocked, paused = calls('Pune'), calls('Pune')
+        if (blocked[1:] != (ERROR_BLOCKED, 1) or paused != (None, ERROR_BLOCKED, 0)
+                or not weather_api.check_request('Pune')):
+            print(f"✗ 429 did not pause API calls: {blocked}, {paused}")
+            return False
+        stub.status = None
+        time.sleep(1.1)
+        if calls('Pune')[2] != 1:
+            print("✗ API calls still paused after Retry-After")
+            return False
+
+        # 401: paused for AUTH_FAILURE_BLOCK_SECONDS
+        weather_api.cache = WeatherCache()
+        stub.status = 401
+        rejected, paused = calls('Pune'), calls('Pune')
+        remaining = weather_api.upstream_block.blocked_until - time.monotonic()
+        if (rejected[1:] != (ERROR_BLOCKED, 1) or paused != (None, ERROR_BLOCKED, 0)
+                or not AUTH_FAILURE_BLOCK_SECONDS - 5 < remaining <= AUTH_FAILURE_BLOCK_SECONDS):
+            print(f"✗ 401 did not pause API calls: {rejected}, {paused}, {remaining:.0f}s left")
+            return False
+        weather_api.close()
+
+        print(f"✓ Negative cache test successful: {weather_api.get_negative_cache_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Negative cache test failed: {e}")
+        return False
+    finally:
+        if stub is not None:
+            stub.stop()
+
+def test_deadline_and_hedging():
+    """Test that a slow upstream call gives up at the deadline and a slow attempt is answered by its hedge."""
+    print("\nTesting request deadlines and hedging...")
+
+    stub = None
+    try:
+        import threading
+        import time
+        from stub_server import StubWeatherServer
+        from rate_limiter import TokenBucket
+        from weather_api import WeatherAPI, WeatherCache, RequestHedger, ERROR_DEADLINE
+        from gazetteer import CityIndex
+
+        hedger = RequestHedger(percentile=95, min_delay=0.01, max_delay=1.0, min_samples=20)
+        if hedger.hedge_delay() is not None:
+            print("✗ Hedging started without latency samples")
+            return False
+        for latency in [0.02] * 95 + [0.5] * 5:
+            hedger.record_latency(latency)
+        if hedger.hedge_delay() != 0.5:
+            print(f"✗ Unexpected hedge delay: {hedger.hedge_delay()}")
+            return False
+
+        stub = StubWeatherServer([{'name': 'Pune', 'main': {'temp': 24.0}}], latency=2.0).start()
+        weather_api = WeatherAPI(cache=WeatherCache(), base_url=stub.base_url, city_index=CityIndex(),
+                                 hedger=RequestHedger())
+        start = time.monotonic()
+        weather = weather_api.get_weather_data('Pune', deadline=start + 0.5)
+        elapsed = time.monotonic() - start
+        weather_api.close()
+
+        if weather is not None or weather_api.get_last_error() != ERROR_DEADLINE or elapsed > 1.0:
+            print(f"✗ Deadline not enforced: {elapsed:.2f}s, error {weather_api.get_last_error()}")
+            return False
+        stub.stop()
+
+        # Only the first attempt is slow: the hedged second attempt answers it
+        slow_once = threading.Event()
+        slow_once.set()
+
+        class SlowFirstServer(StubWeatherServer):
+            def respond(self, params):
+                if slow_once.is_set():
+                    slow_once.clear()
+                    time.sleep(1.5)
+                return super().respond(params)
+
+        stub = SlowFirstServer([{'name': 'Pune', 'main': {'temp': 24.0}}]).start()
+        hedger = RequestHedger(min_delay=0.05, max_delay=0.1, min_samples=1)
+        hedger.record_latency(0.05)
+        weather_api = WeatherAPI(cache=WeatherCache(), base_url=stub.base_url, city_index=CityIndex(), hedger=hedger,
+                                 rate_limiter=TokenBucket(calls_per_minute=10 ** 9, burst=10 ** 9))
+        start = time.monotonic()
+        weather = weather_api.get_weather_data('Pune', deadline=start + 3.0)
+        hedged_elapsed = time.monotonic() - start
+        weather_api.close()
+
+        stats = hedger.get_stats()
+        if weather is None or hedged_elapsed > 1.0 or stats['hedged'] != 1 or stats['hedge_wins'] != 1:
+            print(f"✗ Slow attempt was not hedged: {hedged_elapsed:.2f}s, {stats}")
+            return False
+
+        print(f"✓ Deadline and hedging test successful: gave up after {elapsed:.2f}s, "
+              f"hedge answered in {hedged_elapsed:.2f}s")
+        return True
+
+    except Exception as e:
+        print(f"✗ Deadline and hedging test failed: {e}")
+        return False
+    finally:
+        if stub is not None:
+            stub.stop()
+
+def test_stale_fallback():
+    """Test that a failing upstream opens the circuit breaker and the last stored weather is served, flagged stale."""
+    print("\nTesting circuit breaker and stale fallback...")
+
+    stub = None
+    try:
+        import os
+        import tempfile
+        import time
+        from datetime import timedelta
+        from stub_server import StubWeatherServer
+        from rate_limiter import TokenBucket
+        from weather_api import WeatherAPI, WeatherCache, CircuitBreaker
+        from gazetteer import CityIndex
+        from db_handler import create_database_handler
+        from outfit_recommender import OutfitRecommender
+
+        stub = StubWeatherServer(error_rate=1.0).start()
+        recommender = OutfitRecommender(lattice_enabled=False)
+        recommender.db.close_connection()
+        directory = tempfile.mkdtemp()
+        recommender.db = create_database_handler('sqlite', path=os.path.join(directory, 'stale.db'))
+        recommender.weather_api = WeatherAPI(cache=WeatherCache(), base_url=stub.base_url, city_index=CityIndex(),
+                                             city_locations_cache=WeatherCache(ttl=float('inf')),
+                                             rate_limiter=TokenBucket(calls_per_minute=10 ** 9, burst=10 ** 9),
+                                             hedging=False)
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        recommender.weather_api.circuit_breaker = breaker
+        try:
+            recommender.db.insert_outfit_data([
+                {'clothing_type': 'T-Shirt', 'category': 'Top', 'temp_min': 15, 'temp_max': 40, 'humidity_min': 0,
+                 'humidity_max': 100, 'weather_conditions': ['clear'], 'comfort_rating': 9}])
+            recommender.db.insert_record('weather', {
+                'city': 'Pune', 'temperature': 24.0, 'feels_like': 24.5, 'humidity': 60, 'weather_main': 'Clear',
+                'timestamp': datetime.utcnow() - timedelta(hours=2)})
+
+            # Server errors are not a reason to serve old weather until the breaker opens
+            for _ in range(2):
+                result = recommender.get_weather_and_recommend('Pune', deadline=time.monotonic() + 0.5)
+                if result['success']:
+                    print(f"✗ Request succeeded against a failing upstream: {result}")
+                    return False
+            if breaker.state != CircuitBreaker.OPEN:
+                print(f"✗ Circuit breaker not opened: {breaker.get_stats()}")
+                return False
+
+            requests_sent = stub.get_stats()['requests']
+            result = recommender.get_weather_and_recommend('Pune')
+            weather = result['weather'].to_json() if result['weather'] is not None else {}
+            if (not result['success'] or not result.get('stale') or weather.get('temperature') != 24.0
+                    or not 7000 < (weather.get('stale_age_seconds') or 0) < 7400):
+                print(f"✗ Last known weather not served: {result}")
+                return False
+            if stub.get_stats()['requests'] != requests_sent:
+                print("✗ Request sent while the circuit breaker was open")
+                return False
+        finally:
+            recommender.weather_api.close()
+            recommender.db.close_connection()
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+        print(f"✓ Stale fallback test successful: {breaker.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Stale fallback test failed: {e}")
+        return False
+    finally:
+        if stub is not None:
+            stub.stop()
+
+def test_single_flight():
+    """Test that concurrent calls with the same key are coalesced."""
+    print("\nTesting request coalescing...")
+
+    try:
+        import threading
+        import time
+        from outfit_recommender import SingleFlight
+
+        single_flight = SingleFlight()
+        executions = []
+
+        def slow_lookup(city):
+            executions.append(city)
+            time.sleep(0.1)
+            return {'city': city}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(single_flight.do('mumbai', slow_lookup, 'Mumbai')))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = single_flight.get_stats()
+        if len(executions) != 1 or len(results) != 5 or stats['coalesced'] != 4:
+            print(f"✗ Calls were not coalesced: {len(executions)} executions, stats {stats}")
+            return False
+
+        print(f"✓ Request coalescing test successful: {stats}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Request coalescing test failed: {e}")
+        return False
+
+def test_outfit_catalog():
+    """Test that the outfit catalog index returns what the MongoDB query would."""
+    print("\nTesting outfit catalog index...")
+
+    try:
+        import random
+        from outfit_catalog import OutfitCatalogIndex, outfit_rank_key, OUTFIT_FIELDS
+
+        random.seed(7)
+        conditions = ['clear', 'clouds', 'rain', 'snow']
+        outfits = []
+        for i in range(300):
+            temp_min = random.randint(-20, 35)
+            outfits.append({
+                '_id': f'{i:04d}',
+                'category': random.choice(['Top', 'Bottom', 'Footwear']),
+                'temp_min': temp_min,
+                'temp_max': temp_min + random.randint(0, 20),
+                'humidity_min': random.choice([0, 30]),
+                'humidity_max': random.choice([70, 100]),
+                'weather_conditions': random.sample(conditions, random.randint(1, 3)),
+                'comfort_rating': random.randint(1, 10)
+            })
+        outfits.append({'_id': 'text', 'temp_min': '0', 'temp_max': 40, 'humidity_min': 0, 'humidity_max': 100,
+                        'weather_conditions': 'clear', 'comfort_rating': 10})  # Never matched by a range query
+        outfits.append({'_id': 'null', 'category': 'Top', 'temp_min': -30, 'temp_max': 60, 'humidity_min': 0,
+                        'humidity_max': 100, 'weather_conditions': ['clear'], 'comfort_rating': None})
+        if outfit_rank_key(outfits[-1]) != outfit_rank_key({'_id': 'null', 'comfort_rating': 0}):
+            print("✗ A null comfort_rating is not ranked as 0, as $ifNull does")
+            return False
+
+        def mongo_query(temperature, humidity, condition, per_category=None):
+            matches = sorted((o for o in outfits
+                              if isinstance(o['temp_min'], int) and o['temp_min'] <= temperature <= o['temp_max']
+                              and o['humidity_min'] <= humidity <= o['humidity_max']
+                              and (not condition or condition in o['weather_conditions'])), key=outfit_rank_key)
+            if per_category is None:
+                return matches[:10]
+            # The aggregation: best per_category items of each category, projected
+            kept = [o for o in matches
+                    if [m['category'] for m in matches[:matches.index(o)]].count(o['category']) < per_category]
+            return [{'_id': o['_id'], **{f: o[f] for f in OUTFIT_FIELDS if f in o}} for o in kept]
+
+        top_index = OutfitCatalogIndex(outfits)
+        category_index = OutfitCatalogIndex(outfits, per_category=3, fields=OUTFIT_FIELDS)
+        for temperature in range(-25, 60, 3):
+            for humidity in (0, 50, 85, 100):
+                for condition in (None, 'clear', 'snow', 'fog'):
+                    if (top_index.find_suitable(temperature, humidity, condition)
+                            != mongo_query(temperature, humidity, condition)
+                            or category_index.find_suitable(temperature, humidity, condition)
+                            != mongo_query(temperature, humidity, condition, per_category=3)):
+                        print(f"✗ Index differs from query for T:{temperature} H:{humidity} W:{condition}")
+                        return False
+
+        print(f"✓ Outfit catalog index test successful: {category_index.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Outfit catalog index test failed: {e}")
+        return False
+
+def test_outfit_query_modes():
+    """Test the find and aggregate outfit queries against the catalog index, and the fallback for old MongoDB."""
+    print("\nTesting outfit query modes...")
+
+    try:
+        import os
+        import random
+        import tempfile
+        from db_handler import DatabaseHandler, create_database_handler
+
+        random.seed(11)
+        conditions = ['clear', 'clouds', 'rain', 'snow']
+        outfits = []
+        for i in range(200):
+            temp_min = random.randint(-20, 35)
+            outfits.append({'clothing_type': f'Item {i}', 'category': random.choice(['Top', 'Bottom', 'Footwear']),
+                            'temp_min': temp_min, 'temp_max': temp_min + random.randint(0, 20),
+                            'humidity_min': random.choice([0, 30]), 'humidity_max': random.choice([70, 100]),
+                            'weather_conditions': random.sample(conditions, random.randint(1, 3)),
+                            'comfort_rating': random.randint(1, 10)})
+
+        # Both modes of the SQL query must agree with the catalog index built for that mode
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'modes.db')
+        handlers = {mode: create_database_handler('sqlite', path=path, outfit_query_mode=mode)
+                    for mode in ('find', 'aggregate')}
+        try:
+            handlers['find'].insert_outfit_data(outfits)
+            for mode, db in handlers.items():
+                index = db.get_outfit_index()
+                for temperature in range(-25, 60, 7):
+                    for humidity in (0, 50, 100):
+                        for condition in (None, 'rain', 'fog'):
+                            expected = index.find_suitable(temperature, humidity, condition)
+                            found = db._query_suitable_outfits(temperature, humidity, condition)
+                            if found != expected:
+                                print(f"✗ {mode} query differs from the index for T:{temperature} H:{humidity} "
+                                      f"W:{condition}")
+                                return False
+            find = handlers['find']._query_suitable_outfits(10, 50, None)
+            aggregate = handlers['aggregate']._query_suitable_outfits(10, 50, None)
+            if len(find) > 10 or find[0]['_id'] != aggregate[0]['_id']:
+                print("✗ Modes disagree on the best outfit")
+                return False
+            if len({outfit['category'] for outfit in aggregate}) != 3:
+                print(f"✗ Aggregate mode left out a category: {aggregate}")
+                return False
+        finally:
+            for db in handlers.values():
+                db.close_connection()
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+        # A server without $topN switches 'aggregate' to 'find' once
+        class OldServer:
+            calls = 0
+
+            def server_info(self):
+                OldServer.calls += 1
+                return {'versionArray': [4, 4, 29, 0]}
+
+        db = DatabaseHandler(outfit_index_enabled=False, outfit_query_mode='aggregate')
+        db.client = OldServer()
+        if db.check_outfit_query_mode() != 'find' or db.check_outfit_query_mode() != 'find' or OldServer.calls != 1:
+            print(f"✗ Aggregate mode kept on MongoDB 4.4 ({OldServer.calls} version checks)")
+            return False
+
+        print("✓ Outfit query modes test successful")
+        return True
+
+    except Exception as e:
+        print(f"✗ Outfit query modes test failed: {e}")
+        return False
+
+def test_recommendation_lattice():
+    """Test that precomputed recommendations match the ones computed per request."""
+    print("\nTesting recommendation lattice...")
+
+    try:
+        from outfit_catalog import OutfitCatalogIndex
+        from outfit_recommender import RecommendationLattice, build_recommendations
+
+        outfits = [
+            {'_id': 1, 'category': 'Top', 'temp_min': 10, 'temp_max': 30, 'humidity_min': 0, 'humidity_max': 100,
+             'weather_conditions': ['clear', 'rain'], 'comfort_rating': 8},
+            {'_id': 2, 'category': 'Bottom', 'temp_min': 0, 'temp_max': 25, 'humidity_min': 0, 'humidity_max': 80,
+             'weather_conditions': ['clear', 'rain'], 'comfort_rating': 7},
+            {'_id': 3, 'category': 'Footwear', 'temp_min': -10, 'temp_max': 40, 'humidity_min': 0,
+             'humidity_max': 100, 'weather_conditions': ['clear', 'rain', 'snow'], 'comfort_rating': 9},
+            {'_id': 4, 'category': 'Outerwear', 'temp_min': -20, 'temp_max': 20, 'humidity_min': 20,
+             'humidity_max': 100, 'weather_conditions': ['rain', 'snow'], 'comfort_rating': 9},
+            {'_id': 5, 'category': 'Accessory', 'temp_min': 25, 'temp_max': 45, 'humidity_min': 0,
+             'humidity_max': 60, 'weather_conditions': ['clear'], 'comfort_rating': 6}
+        ]
+        index = OutfitCatalogIndex(outfits)
+        lattice = RecommendationLattice(index)
+
+        # Every breakpoint, both sides of it, and the 15°C outerwear threshold
+        for temperature in (-30, -10, 0, 9.9, 10, 14.9, 15, 15.1, 20, 20.5, 25, 30, 40, 45, 50):
+            for humidity in (0, 19, 20, 60, 61, 80, 81, 100, 101):
+                for condition in ('clear', 'rain', 'snow', 'thunderstorm'):
+                    expected = build_recommendations(index.find_suitable(temperature, humidity, condition),
+                                                     temperature, condition)
+                    if lattice.lookup(temperature, humidity, condition) != expected:
+                        print(f"✗ Lattice differs for T:{temperature} H:{humidity} W:{condition}")
+                        return False
+
+        print(f"✓ Recommendation lattice test successful: {lattice.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Recommendation lattice test failed: {e}")
+        return False
+
+def test_recommendation_storage():
+    """Test that normalized recommendations keep outfit _ids and rehydrate to the same items."""
+    print("\nTesting normalized recommendation storage...")
+
+    try:
+        from db_handler import DatabaseHandler, normalize_recommendation
+        from outfit_recommender import build_recommendations
+
+        embedded = {
+            'city': 'Mumbai',
+            'weather': {'temperature': 29.9, 'humidity': 70, 'weather_main': 'Haze', 'weather_description': 'haze',
+                        'country': 'IN', 'raw_data': {'name': 'Mumbai'}},
+            'recommended_outfits': [{'outfit_type': 'Top Recommendations',
+                                     'items': [{'_id': 1, 'category': 'Top'}, {'_id': 2, 'category': 'Top'}]}],
+            'recommendation_count': 1
+        }
+        normalized = normalize_recommendation(embedded, weather_ref='weather-1')
+        expected = {
+            'city': 'Mumbai',
+            'weather': {'temperature': 29.9, 'humidity': 70, 'weather_main': 'Haze', 'weather_description': 'haze'},
+            'weather_ref': 'weather-1',
+            'recommended_outfits': [{'outfit_type': 'Top Recommendations', 'item_ids': [1, 2]}],
+            'recommendation_count': 1
+        }
+        if normalized != expected or normalize_recommendation(normalized) != expected:
+            print(f"✗ Unexpected normalized document: {normalized}")
+            return False
+
+        db = DatabaseHandler()
+        if not db.test_connection():
+            print("⚠ Database not reachable, skipping rehydration check")
+            return True
+
+        outfits = db.get_suitable_outfits(20, 60, 'clear')
+        recommendations = build_recommendations(outfits, 20, 'clear')
+        document = normalize_recommendation({'recommended_outfits': recommendations})
+        db.hydrate_recommendations([document])
+        db.close_connection()
+        hydrated = [[item['_id'] for item in group['items']] for group in document['recommended_outfits']]
+        if hydrated != [[item['_id'] for item in group['items']] for group in recommendations]:
+            print("✗ Rehydrated outfits differ from the recommended ones")
+            return False
+
+        print(f"✓ Recommendation storage test successful ({len(recommendations)} groups rehydrated)")
+        return True
+
+    except Exception as e:
+        print(f"✗ Recommendation storage test failed: {e}")
+        return False
+
+def test_rate_limiter():
+    """Test token bucket lanes: background calls leave the reserve to interactive ones."""
+    print("\nTesting rate limiter...")
+
+    stub = None
+    try:
+        from rate_limiter import TokenBucket, INTERACTIVE, BACKGROUND, fcntl
+        from stub_server import StubWeatherServer
+        from weather_api import WeatherAPI, WeatherCache, CircuitBreaker
+        from gazetteer import CityIndex
+
+        bucket = TokenBucket(calls_per_minute=1, burst=4, background_reserve=0.5)
+        background = [bucket.acquire(BACKGROUND) for _ in range(3)]
+        interactive = [bucket.acquire(INTERACTIVE) for _ in range(3)]
+
+        if background != [True, True, False] or interactive != [True, True, False]:
+            print(f"✗ Unexpected grants: background {background}, interactive {interactive}")
+            return False
+
+        # The shared state file is private to its owner; one others can write to is not used
+        if fcntl is not None:  # Shared state files need file locking
+            import os
+            import stat
+            import tempfile
+            directory = tempfile.mkdtemp()
+            private, shared = os.path.join(directory, 'private.bin'), os.path.join(directory, 'shared.bin')
+            try:
+                private_bucket = TokenBucket(calls_per_minute=1, burst=4, state_file=private)
+                private_bucket.acquire(INTERACTIVE)
+                os.close(os.open(shared, os.O_CREAT | os.O_WRONLY))
+                os.chmod(shared, 0o666)
+                shared_bucket = TokenBucket(calls_per_minute=1, burst=4, state_file=shared)
+                mode = stat.S_IMODE(os.stat(private).st_mode)
+                if mode != 0o600 or not private_bucket.get_stats()['shared'] or shared_bucket.get_stats()['shared']:
+                    print(f"✗ State file not private: mode {mode:o}, {shared_bucket.get_stats()}")
+                    return False
+            finally:
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+                os.rmdir(directory)
+
+        # Retries take tokens too: with two tokens a failing call is sent twice, not HTTP_MAX_RETRIES + 1 times
+        stub = StubWeatherServer(error_rate=1.0).start()
+        retry_bucket = TokenBucket(calls_per_minute=1, burst=2, background_reserve=0.0)
+        weather_api = WeatherAPI(cache=WeatherCache(), base_url=stub.base_url, city_index=CityIndex(),
+                                 city_locations_cache=WeatherCache(ttl=float('inf')), rate_limiter=retry_bucket,
+                                 hedging=False)
+        weather_api.circuit_breaker = CircuitBreaker()
+        weather = weather_api.get_weather_data('Pune')
+        weather_api.close()
+        if weather is not None or stub.get_stats()['requests'] != 2 or retry_bucket.granted[INTERACTIVE] != 2:
+            print(f"✗ Retries not limited by the bucket: {stub.get_stats()['requests']} requests, "
+                  f"{retry_bucket.get_stats()}")
+            return False
+
+        print(f"✓ Rate limiter test successful: {bucket.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Rate limiter test failed: {e}")
+        return False
+    finally:
+        if stub is not None:
+            stub.stop()
+
+def test_cache_warmer():
+    """Test that the cache warmer stops when the background budget is spent and leaves interactive tokens alone."""
+    print("\nTesting cache warmer budget...")
+
+    stub = None
+    try:
+        from stub_server import StubWeatherServer
+        from rate_limiter import TokenBucket, INTERACTIVE, BACKGROUND
+        from weather_api import WeatherAPI, WeatherCache
+        from gazetteer import CityIndex
+        from cache_warmer import CacheWarmer
+
+        class PopularCities:
+            def get_popular_cities(self, limit=10, since=None):
+                return [{'city': city, 'count': 10 - i} for i, city in enumerate(['Pune', 'Oslo', 'Lima', 'Rome'])]
+
+        stub = StubWeatherServer([{'name': 'Pune', 'main': {'temp': 24.0}}], any_city=True).start()
+        # Half of the 4-token bucket is reserved for interactive calls
+        bucket = TokenBucket(calls_per_minute=1, burst=4, background_reserve=0.5)
+        weather_api = WeatherAPI(cache=WeatherCache(), base_url=stub.base_url, city_index=CityIndex(),
+                                 city_locations_cache=WeatherCache(ttl=float('inf')), rate_limiter=bucket)
+        warmer = CacheWarmer(weather_api, PopularCities(), calls_per_minute=100)
+
+        refreshed = warmer.run_once()
+        stats = warmer.get_stats()
+        weather_api.close()
+        if refreshed != 2 or stats['budget_exhausted'] != 1 or stub.get_stats()['requests'] != 2:
+            print(f"✗ Warmer did not stop at the background budget: {refreshed} refreshed, {stats}")
+            return False
+        if bucket.granted[INTERACTIVE] or bucket.denied != {INTERACTIVE: 0, BACKGROUND: 1}:
+            print(f"✗ Unexpected token use: {bucket.get_stats()}")
+            return False
+        if not (bucket.acquire(INTERACTIVE) and bucket.acquire(INTERACTIVE)):
+            print("✗ Warmer used the interactive reserve")
+            return False
+
+        print(f"✓ Cache warmer test successful: {stats}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Cache warmer test failed: {e}")
+        return False
+    finally:
+        if stub is not None:
+            stub.stop()
+
+def test_write_behind():
+    """Test batched writes: size and time flushes, backpressure, retries and the flush on close."""
+    print("\nTesting write-behind buffer...")
+
+    try:
+        import threading
+        import time
+        from pymongo.errors import ServerSelectionTimeoutError
+        from write_behind import WriteBehindBuffer
+
+        class RecordingCollection:
+            """Records insert_many batches; insert_many blocks while the gate is closed."""
+            def __init__(self, name):
+                self.name = name
+                self.batches = []
+                self.gate = threading.Event()
+                self.gate.set()
+
+            def insert_many(self, documents, ordered=True):
+                self.gate.wait(5)
+                self.batches.append(list(documents))
+                return type('InsertManyResult', (), {'inserted_ids': [d['_id'] for d in documents]})()
+
+        weather, recommendations = RecordingCollection('weather'), RecordingCollection('recommendations')
+        buffer = WriteBehindBuffer(max_queue=4, batch_size=3, flush_interval=0.2, enqueue_timeout=0.2)
+
+        # A full batch is written at once, one insert_many per collection
+        for i in range(2):
+            buffer.put(weather, {'_id': i})
+        buffer.put(recommendations, {'_id': 2})
+        time.sleep(0.1)
+        if weather.batches != [[{'_id': 0}, {'_id': 1}]] or recommendations.batches != [[{'_id': 2}]]:
+            print(f"✗ Batch not written on size: {weather.batches}, {recommendations.batches}")
+            return False
+
+        # A partial batch is written once the oldest document has waited flush_interval
+        buffer.put(weather, {'_id': 3})
+        time.sleep(0.4)
+        if weather.batches[-1] != [{'_id': 3}]:
+            print(f"✗ Batch not written on time: {weather.batches}")
+            return False
+
+        # While the database is stuck, the queue fills up and writers are turned away
+        weather.gate.clear()
+        for i in range(4, 7):
+            buffer.put(weather, {'_id': i})  # Taken by the flushing thread, which then blocks
+        time.sleep(0.1)
+        accepted = [buffer.put(weather, {'_id': i}) for i in range(7, 12)]
+        weather.gate.set()
+        if accepted != [True, True, True, True, False]:
+            print(f"✗ Backpressure not applied: {accepted}")
+            return False
+
+        # Closing writes whatever is still queued
+        buffer.close()
+        written = sorted(d['_id'] for batch in weather.batches for d in batch)
+        stats = buffer.get_stats()
+        if written != [0, 1, 3, 4, 5, 6, 7, 8, 9, 10] or stats['queue_depth'] or stats['overflows'] != 1:
+            print(f"✗ Queue not drained on close: {written}, {stats}")
+            return False
+        if buffer.put(weather, {'_id': 12}):
+            print("✗ Closed buffer accepted a document")
+            return False
+
+        # Batches that fail while no server can be selected are retried until they are written
+        class FlakyCollection(RecordingCollection):
+            def __init__(self, name, failures):
+                super().__init__(name)
+                self.failures = failures
+
+            def insert_many(self, documents, ordered=True):
+                if self.failures:
+                    self.failures -= 1
+                    raise ServerSelectionTimeoutError('No replica set members available')
+                return super().insert_many(documents, ordered)
+
+        flaky = FlakyCollection('weather', failures=2)
+        buffer = WriteBehindBuffer(batch_size=3, flush_interval=0.05, max_retries=3, retry_delay=0.05)
+        for i in range(3):
+            buffer.put(flaky, {'_id': i})
+        deadline = time.monotonic() + 5
+        while not flaky.batches and time.monotonic() < deadline:
+            time.sleep(0.05)
+        buffer.close()
+        retry_stats = buffer.get_stats()
+        if (flaky.batches != [[{'_id': 0}, {'_id': 1}, {'_id': 2}]] or retry_stats['retries'] != 2
+                or retry_stats['failed'] or retry_stats['written'] != 3):
+            print(f"✗ Batch not written after transient errors: {flaky.batches}, {retry_stats}")
+            return False
+
+        # Retries are bounded: a server that never comes back costs the batch, not the app
+        down = FlakyCollection('weather', failures=100)
+        buffer = WriteBehindBuffer(flush_interval=0.01, max_retries=2, retry_delay=0.01)
+        buffer.put(down, {'_id': 0})
+        buffer.close()
+        if buffer.get_stats()['failed'] != 1 or buffer.get_stats()['queue_depth'] or down.failures != 97:
+            print(f"✗ Retries not bounded: {buffer.get_stats()}, {100 - down.failures} attempts")
+            return False
+
+        print(f"✓ Write-behind test successful: {stats}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Write-behind test failed: {e}")
+        return False
+
 def test_outfit_recommendation():
     """Test outfit recommendation system."""
     print("\nTesting outfit recommendation system...")
@@ -158,7 +1560,30 @@ def main():
     tests = [
         ("Module Imports", test_imports),
         ("Database Connection", test_database),
+        ("Database Indexes", test_indexes),
+        ("Retention", test_retention),
+        ("Collection Pages", test_collection_pages),
+        ("SQLite Backend", test_sqlite_backend),
+        ("Catalog Watcher", test_catalog_watcher),
+        ("Catalog Watcher Resume", test_catalog_watcher_resume),
         ("Weather API", test_weather_api),
+        ("Weather Cache", test_weather_cache),
+        ("Parsed Weather", test_parsed_weather),
+        ("Geo-Quantized Cache", test_geo_cache),
+        ("Unit Conversion", test_unit_conversion),
+        ("Gazetteer", test_gazetteer),
+        ("Stub Weather Server", test_stub_server),
+        ("Negative Cache", test_negative_cache),
+        ("Deadlines and Hedging", test_deadline_and_hedging),
+        ("Stale Fallback", test_stale_fallback),
+        ("Request Coalescing", test_single_flight),
+        ("Outfit Catalog Index", test_outfit_catalog),
+        ("Outfit Query Modes", test_outfit_query_modes),
+        ("Recommendation Lattice", test_recommendation_lattice),
+        ("Recommendation Storage", test_recommendation_storage),
+        ("Rate Limiter", test_rate_limiter),
+        ("Cache Warmer", test_cache_warmer),
+        ("Write-Behind Buffer", test_write_behind),
         ("Outfit Recommendation", test_outfit_recommendation),
         ("GUI Components", test_gui)
     ]
@@ -3,14 +3,15 @@ from tkinter import ttk, messagebox, scrolledtext, simpledialog
 import threading
 from datetime import datetime
 from outfit_recommender import OutfitRecommender
-from db_handler import DatabaseHandler
-from config import APP_TITLE, WINDOW_SIZE
+from db_handler import create_database_handler, collection_page_filters
+from catalog_watcher import CatalogWatcher
+from retention import RollupJob
+from config import APP_TITLE, WINDOW_SIZE, CATALOG_WATCHER_ENABLED, ROLLUP_ENABLED, DATABASE_BACKEND
 from PIL import Image, ImageTk
 import os
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from collections import defaultdict
-from bson.objectid import ObjectId
 
 class WeatherOutfitUI:
     def __init__(self):
@@ -21,7 +22,18 @@ class WeatherOutfitUI:
         self.root.resizable(True, True)
 
         self.recommender = OutfitRecommender()
-        self.db = DatabaseHandler()
+        self.db = create_database_handler()
+
+        # Pick up outfit edits made outside this window (web app, mongosh); change streams are MongoDB-only
+        self.catalog_watcher = (CatalogWatcher(self.db)
+                                if CATALOG_WATCHER_ENABLED and DATABASE_BACKEND == 'mongodb' else None)
+        if self.catalog_watcher:
+            self.catalog_watcher.start()
+
+        # Summarize history into daily per-city totals before TTL indexes delete it
+        self.rollup_job = RollupJob(self.db) if ROLLUP_ENABLED else None
+        if self.rollup_job:
+            self.rollup_job.start()
 
         self.spinner_frames = []
         self.load_spinner_frames()
@@ -220,6 +232,10 @@ class WeatherOutfitUI:
                                                f"{weather['weather_description']} | Humidity: {weather['humidity']}%")
 
             self.results_text.delete(1.0, tk.END)
+            if weather.get('stale'):
+                age = weather.get('stale_age_seconds')
+                age_text = f" from {max(1, round(age / 60))} min ago" if age is not None else ""
+                self.results_text.insert(tk.END, f"Weather service unavailable. Showing last known weather{age_text}.\n\n")
             if outfits:
                 advice = self.recommender.get_weather_advice(weather)
                 self.results_text.insert(tk.END, f"Weather Advice:\n{advice}\n\n")
@@ -262,7 +278,7 @@ class WeatherOutfitUI:
 
     def view_history(self):
         try:
-            history = self.db.get_recommendations_history(10)
+            history = self.db.get_recommendations_history(10, summary=True)
             win = tk.Toplevel(self.root)
             win.title("Recommendation History")
             win.geometry("600x400")
@@ -319,6 +335,21 @@ class WeatherOutfitUI:
 
         self.load_collection_btn = ttk.Button(selector_frame, text="Load Data", command=self.load_collection_data_threaded)
         self.load_collection_btn.pack(side=tk.LEFT, padx=10)
+        self.next_page_btn = ttk.Button(selector_frame, text="Next Page", state='disabled',
+                                        command=lambda: self.load_collection_data_threaded(next_page=True))
+        self.next_page_btn.pack(side=tk.LEFT, padx=5)
+        self.collection_next_cursor = None
+        self.collection_page_number = 0
+
+        # Filters as "city=London, timestamp_from=2024-01-01"; fields as "city, temperature"
+        query_frame = ttk.Frame(tab, padding=(10, 0))
+        query_frame.pack(fill=tk.X)
+        ttk.Label(query_frame, text="Filter:").pack(side=tk.LEFT, padx=5)
+        self.collection_filter_var = tk.StringVar()
+        ttk.Entry(query_frame, textvariable=self.collection_filter_var, width=40).pack(side=tk.LEFT, padx=5)
+        ttk.Label(query_frame, text="Fields:").pack(side=tk.LEFT, padx=5)
+        self.collection_fields_var = tk.StringVar()
+        ttk.Entry(query_frame, textvariable=self.collection_fields_var, width=30).pack(side=tk.LEFT, padx=5)
 
         self.tree_frame = ttk.Frame(tab)
         self.tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -341,12 +372,13 @@ class WeatherOutfitUI:
         self.collection_status_label = ttk.Label(tab, text="", style='Info.TLabel')
         self.collection_status_label.pack(fill=tk.X, padx=10, pady=(0,5))
 
-    def load_collection_data_threaded(self):
+    def load_collection_data_threaded(self, next_page=False):
         self.load_collection_btn.config(state='disabled')
+        self.next_page_btn.config(state='disabled')
         self.collection_status_label.config(text="Loading data...")
-        threading.Thread(target=self.load_collection_data).start()
+        threading.Thread(target=self.load_collection_data, args=(next_page,)).start()
 
-    def load_collection_data(self):
+    def load_collection_data(self, next_page=False):
         try:
             cname = self.collection_var.get()
             if cname not in ['weather','outfit','recommendations']:
@@ -355,12 +387,16 @@ class WeatherOutfitUI:
             self.collection_tree.delete(*self.collection_tree.get_children())
             self.collection_tree["columns"] = ()
 
-            if cname == 'weather':
-                data = self.db.get_weather_data(limit=50)
-            elif cname == 'outfit':
-                data = list(self.db.outfit_collection.find().limit(50))
-            else:
-                data = list(self.db.recommendations_collection.find().limit(50))
+            params = {key.strip(): value.strip() for key, value in
+                      (part.split('=', 1) for part in self.collection_filter_var.get().split(',') if '=' in part)}
+            fields = [field.strip() for field in self.collection_fields_var.get().split(',') if field.strip()]
+            page = self.db.get_collection_page(cname, after=self.collection_next_cursor if next_page else None,
+                                               fields=fields or None, filters=collection_page_filters(cname, params))
+            if page is None:
+                raise RuntimeError(f"Could not read the {cname} collection")
+            data = page['data']
+            self.collection_next_cursor = page['next']
+            self.collection_page_number = self.collection_page_number + 1 if next_page else 1
 
             if not data:
                 self.root.after(0, lambda: self.collection_status_label.config(text="No data found."))
@@ -386,12 +422,17 @@ class WeatherOutfitUI:
                     row.append(str(v))
                 self.root.after(0, lambda r=row: self.collection_tree.insert('', tk.END, values=r))
 
-            self.root.after(0, lambda: self.collection_status_label.config(text=f"Loaded {len(data)} records from '{cname}' collection."))
+            last = "" if self.collection_next_cursor else ", last"
+            status = f"Loaded {len(data)} records from '{cname}' collection (page {self.collection_page_number}{last})."
+            self.root.after(0, lambda: self.collection_status_label.config(text=status))
         except Exception as e:
+            self.collection_next_cursor = None
             self.root.after(0, lambda: self.collection_status_label.config(text=f"Error loading data: {e}"))
             messagebox.showerror("Error", f"Failed to load collection data: {e}")
         finally:
             self.root.after(0, lambda: self.load_collection_btn.config(state='normal'))
+            if self.collection_next_cursor:
+                self.root.after(0, lambda: self.next_page_btn.config(state='normal'))
 
     def setup_treeview_columns(self, cols):
         self.collection_tree["columns"] = cols
@@ -406,9 +447,11 @@ class WeatherOutfitUI:
 
     def insert_record(self, cname, record):
         try:
-            col = self.get_collection(cname)
-            result = col.insert_one(record)
-            messagebox.showinfo("Success", f"Record inserted with ID: {result.inserted_id}")
+            record_id = self.db.insert_record(cname, record)
+            if record_id is None:
+                messagebox.showerror("Error", "Failed to insert record, see the log")
+                return
+            messagebox.showinfo("Success", f"Record inserted with ID: {record_id}")
             self.load_collection_data_threaded()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to insert record: {e}")
@@ -431,16 +474,16 @@ class WeatherOutfitUI:
 
     def update_record(self, cname, record):
         try:
-            col = self.get_collection(cname)
             _id_str = record.get('_id','')
             if _id_str == '':
                 messagebox.showerror("Error","Record id (_id) missing")
                 return
-            _id = ObjectId(_id_str)
             new_record = record.copy()
             del new_record['_id']  # _id cannot be updated
             # Convert any datetimes or lists if needed here
-            col.update_one({'_id': _id}, {'$set': new_record})
+            if not self.db.update_record(cname, _id_str, new_record):
+                messagebox.showwarning("Not updated", "No record found or no changes made")
+                return
             messagebox.showinfo("Success", "Record updated successfully")
             self.load_collection_data_threaded()
         except Exception as e:
@@ -455,27 +498,19 @@ class WeatherOutfitUI:
         if not messagebox.askyesno("Confirm Delete", f"Delete {len(selected)} selected record(s)?"):
             return
         try:
-            col = self.get_collection(self.collection_var.get())
+            cname = self.collection_var.get()
+            deleted = 0
             for sel in selected:
                 item = self.collection_tree.item(sel)
                 values = item['values']
                 cols = self.collection_tree['columns']
                 record = {cols[i]: values[i] for i in range(len(cols))}
-                _id = ObjectId(record.get('_id'))
-                col.delete_one({'_id': _id})
-            messagebox.showinfo("Deleted", f"Deleted {len(selected)} record(s)")
+                deleted += self.db.delete_record(cname, str(record.get('_id')))
+            messagebox.showinfo("Deleted", f"Deleted {deleted} record(s)")
             self.load_collection_data_threaded()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to delete records: {e}")
 
-    def get_collection(self, cname):
-        if cname == 'weather':
-            return self.db.weather_collection
-        elif cname == 'outfit':
-            return self.db.outfit_collection
-        else:
-            return self.db.recommendations_collection
-
     ############# Tab 3: Visual Analytics (Line Chart) #############
 
     def create_visualization_tab(self):
@@ -503,7 +538,7 @@ class WeatherOutfitUI:
 
     def load_visualization(self):
         try:
-            data = list(self.db.recommendations_collection.find().sort('timestamp', -1).limit(100))
+            data = self.db.get_recommendations_history(limit=100, summary=True)
             if not data:
                 self.root.after(0, lambda: self.visualization_status_label.config(text="No recommendation data found."))
                 return
@@ -581,6 +616,10 @@ class WeatherOutfitUI:
 
     def on_closing(self):
         try:
+            if self.catalog_watcher:
+                self.catalog_watcher.stop()
+            if self.rollup_job:
+                self.rollup_job.stop()
             self.recommender.close()
             self.db.close_connection()
         except Exception as e:
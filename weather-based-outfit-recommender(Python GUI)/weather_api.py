@@ -1,43 +1,976 @@
 # weather_api.py
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
 import json
 import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from operator import attrgetter
 from datetime import datetime
-from config import OPENWEATHER_API_KEY, OPENWEATHER_BASE_URL
+from config import (OPENWEATHER_API_KEY, OPENWEATHER_BASE_URL, STORE_RAW_WEATHER, WEATHER_CACHE_ENABLED,
+                    WEATHER_CACHE_TTL, WEATHER_CACHE_STALE_TTL, WEATHER_CACHE_MAX_SIZE,
+                    WEATHER_CACHE_GEOHASH_PRECISION, CITY_LOCATION_CACHE_MAX_SIZE,
+                    HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+                    HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX,
+                    ASYNC_WEATHER_CONCURRENCY, NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_MAX_SIZE,
+                    AUTH_FAILURE_BLOCK_SECONDS, RATE_LIMIT_BLOCK_SECONDS,
+                    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT, RATE_LIMIT_ENABLED,
+                    RATE_LIMIT_CALLS_PER_MINUTE, RATE_LIMIT_BURST, RATE_LIMIT_BACKGROUND_RESERVE,
+                    RATE_LIMIT_INTERACTIVE_WAIT, RATE_LIMIT_STATE_FILE, GAZETTEER_STRICT,
+                    celsius_to_fahrenheit, celsius_to_kelvin, meters_per_second_to_miles_per_hour,
+                    DEADLINE_MIN_FETCH_TIME, HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_DELAY,
+                    HEDGE_MAX_DELAY, HEDGE_LATENCY_WINDOW, HEDGE_MIN_SAMPLES)
+from rate_limiter import TokenBucket, INTERACTIVE, BACKGROUND
+from gazetteer import get_city_index, normalize_city_name
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class WeatherAPI:
+# Responses worth retrying after a backoff
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Reasons get_weather_data may return None (see WeatherAPI.get_last_error)
+ERROR_NOT_FOUND = 'not_found'
+ERROR_BLOCKED = 'blocked'
+ERROR_CIRCUIT_OPEN = 'circuit_open'
+ERROR_RATE_LIMITED = 'rate_limited'
+ERROR_UPSTREAM = 'upstream_error'
+ERROR_DEADLINE = 'deadline_exceeded'
+
+# Unit systems get_weather_data can return; 'standard' is the API's name for kelvin
+SUPPORTED_UNITS = ('metric', 'imperial', 'kelvin', 'standard')
+
+# Failures where serving older weather beats failing the request
+UPSTREAM_UNAVAILABLE_ERRORS = (ERROR_CIRCUIT_OPEN, ERROR_RATE_LIMITED, ERROR_DEADLINE)
+
+# OpenWeatherMap condition ids (https://openweathermap.org/weather-conditions)
+# mapped to (outfit category, detailed condition). Ids missing from a group
+# fall back to the group default.
+CONDITION_GROUP_DEFAULTS = {
+    2: ('thunderstorm', 'thunderstorm'),
+    3: ('rain', 'drizzle'),
+    5: ('rain', 'rain'),
+    6: ('snow', 'snow'),
+    7: ('clear', 'atmosphere'),
+    8: ('clouds', 'clouds')
+}
+CONDITIONS_BY_ID = {
+    200: ('thunderstorm', 'thunderstorm_light_rain'), 201: ('thunderstorm', 'thunderstorm_rain'),
+    202: ('thunderstorm', 'thunderstorm_heavy_rain'), 210: ('thunderstorm', 'light_thunderstorm'),
+    211: ('thunderstorm', 'thunderstorm'), 212: ('thunderstorm', 'heavy_thunderstorm'),
+    221: ('thunderstorm', 'ragged_thunderstorm'), 230: ('thunderstorm', 'thunderstorm_light_drizzle'),
+    231: ('thunderstorm', 'thunderstorm_drizzle'), 232: ('thunderstorm', 'thunderstorm_heavy_drizzle'),
+    300: ('rain', 'light_drizzle'), 301: ('rain', 'drizzle'), 302: ('rain', 'heavy_drizzle'),
+    310: ('rain', 'light_drizzle_rain'), 311: ('rain', 'drizzle_rain'), 312: ('rain', 'heavy_drizzle_rain'),
+    313: ('rain', 'shower_drizzle'), 314: ('rain', 'heavy_shower_drizzle'), 321: ('rain', 'shower_drizzle'),
+    500: ('rain', 'light_rain'), 501: ('rain', 'moderate_rain'), 502: ('rain', 'heavy_rain'),
+    503: ('rain', 'very_heavy_rain'), 504: ('rain', 'extreme_rain'), 511: ('rain', 'freezing_rain'),
+    520: ('rain', 'light_shower_rain'), 521: ('rain', 'shower_rain'), 522: ('rain', 'heavy_shower_rain'),
+    531: ('rain', 'ragged_shower_rain'),
+    600: ('snow', 'light_snow'), 601: ('snow', 'snow'), 602: ('snow', 'heavy_snow'), 611: ('snow', 'sleet'),
+    612: ('snow', 'light_shower_sleet'), 613: ('snow', 'shower_sleet'), 615: ('snow', 'light_rain_snow'),
+    616: ('snow', 'rain_snow'), 620: ('snow', 'light_shower_snow'), 621: ('snow', 'shower_snow'),
+    622: ('snow', 'heavy_shower_snow'),
+    701: ('clouds', 'mist'), 711: ('clear', 'smoke'), 721: ('clouds', 'haze'), 731: ('clear', 'dust_whirls'),
+    741: ('clouds', 'fog'), 751: ('clear', 'sand'), 761: ('clear', 'dust'), 762: ('clear', 'volcanic_ash'),
+    771: ('clear', 'squalls'), 781: ('clear', 'tornado'),
+    800: ('clear', 'clear'), 801: ('clouds', 'few_clouds'), 802: ('clouds', 'scattered_clouds'),
+    803: ('clouds', 'broken_clouds'), 804: ('clouds', 'overcast_clouds')
+}
+CONDITION_ID_MIN = 200
+CONDITION_ID_MAX = 804
+
+def _build_condition_tables():
+    """Build dense category and detail tables indexed by condition id - CONDITION_ID_MIN."""
+    size = CONDITION_ID_MAX - CONDITION_ID_MIN + 1
+    categories = [None] * size
+    details = [None] * size
+    for condition_id in range(CONDITION_ID_MIN, CONDITION_ID_MAX + 1):
+        category, detail = CONDITIONS_BY_ID.get(condition_id, CONDITION_GROUP_DEFAULTS.get(condition_id // 100, (None, None)))
+        categories[condition_id - CONDITION_ID_MIN] = category
+        details[condition_id - CONDITION_ID_MIN] = detail
+    return tuple(categories), tuple(details)
+
+CONDITION_CATEGORY_TABLE, CONDITION_DETAIL_TABLE = _build_condition_tables()
+
+_MISSING = object()  # Marks a ParsedWeather slot that has no value
+
+class ParsedWeather:
+    """
+    Parsed weather for one city, holding only the fields the app uses.
+
+    Supports read-only dict-style access (weather['temperature'],
+    weather.get('stale')) so it can be used wherever the parsed dict was.
+    """
+    FIELDS = ('city', 'country', 'temperature', 'feels_like', 'humidity', 'weather_main',
+              'weather_description', 'weather_id', 'weather_detail', 'fetch_time')
+    __slots__ = FIELDS + ('stale', 'stale_age_seconds', 'raw_data')
+
+    _get_fields = attrgetter(*FIELDS)
+
+    def __init__(self, city, country, temperature, feels_like, humidity, weather_main,
+                 weather_description, weather_id=None, weather_detail=None, fetch_time=None,
+                 stale=False, stale_age_seconds=None, raw_data=None):
+        self.city = city
+        self.country = country
+        self.temperature = temperature
+        self.feels_like = feels_like
+        self.humidity = humidity
+        self.weather_main = weather_main
+        self.weather_description = weather_description
+        self.weather_id = weather_id
+        self.weather_detail = weather_detail
+        self.fetch_time = fetch_time
+        self.stale = stale
+        self.stale_age_seconds = stale_age_seconds
+        self.raw_data = raw_data
+
+    @classmethod
+    def from_document(cls, document):
+        """
+        Build a ParsedWeather from a stored weather document.
+
+        Args:
+            document (dict): Document from the weather collection
+
+        Returns:
+            ParsedWeather: Parsed weather (extra document keys are ignored)
+        """
+        return cls(**{name: document.get(name) for name in cls.FIELDS},
+                   raw_data=document.get('raw_data'))
+
+    def to_json(self):
+        """Return a JSON-serializable dict of the fields."""
+        data = dict(zip(self.FIELDS, self._get_fields(self)))
+        if self.stale:
+            data['stale'] = True
+            data['stale_age_seconds'] = self.stale_age_seconds
+        return data
+
+    def to_bson(self):
+        """Return a dict ready to be stored in MongoDB, including raw_data if it was kept."""
+        data = self.to_json()
+        if self.raw_data is not None:
+            data['raw_data'] = self.raw_data
+        return data
+
+    def keys(self):
+        return self.to_bson().keys()
+
+    def _lookup(self, key):
+        """Return the value of field key, or _MISSING if it is not a field or has no value."""
+        if key not in self.__slots__:
+            return _MISSING
+        return getattr(self, key, _MISSING)
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _MISSING
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def __repr__(self):
+        return f"ParsedWeather({self.to_json()!r})"
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash_encode(lat, lon, precision=WEATHER_CACHE_GEOHASH_PRECISION):
+    """
+    Encode coordinates as a geohash; points in the same grid cell share the same string.
+
+    Args:
+        lat (float): Latitude in degrees
+        lon (float): Longitude in degrees
+        precision (int): Number of characters (each adds 5 bits of resolution)
+
+    Returns:
+        str: Geohash of the cell containing the point
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    use_lon = True  # Bits alternate between longitude and latitude, longitude first
+
+    while len(chars) < precision:
+        value_range, value = (lon_range, lon) if use_lon else (lat_range, lat)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            value_range[0] = mid
+        else:
+            bits = bits * 2
+            value_range[1] = mid
+        use_lon = not use_lon
+
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+def convert_weather_units(weather_data, units):
+    """
+    Convert a metric API payload to another unit system, as if the API had been asked for it.
+
+    Args:
+        weather_data (dict): Payload fetched with units=metric
+        units (str): Target units ('metric', 'imperial', 'kelvin')
+
+    Returns:
+        dict: The payload itself for metric, otherwise a converted copy
+    """
+    if units == 'metric':
+        return weather_data
+    if units == 'imperial':
+        convert_temperature, convert_speed = celsius_to_fahrenheit, meters_per_second_to_miles_per_hour
+    else:
+        convert_temperature, convert_speed = celsius_to_kelvin, None  # Kelvin keeps wind in m/s
+
+    converted = dict(weather_data)
+    if 'main' in weather_data:
+        converted['main'] = dict(weather_data['main'])
+        for field in ('temp', 'feels_like', 'temp_min', 'temp_max'):
+            if converted['main'].get(field) is not None:
+                converted['main'][field] = round(convert_temperature(converted['main'][field]), 2)
+    if convert_speed and 'wind' in weather_data:
+        converted['wind'] = dict(weather_data['wind'])
+        for field in ('speed', 'gust'):
+            if converted['wind'].get(field) is not None:
+                converted['wind'][field] = round(convert_speed(converted['wind'][field]), 2)
+    return converted
+
+class WeatherCache:
+    def __init__(self, ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_CACHE_STALE_TTL, max_size=WEATHER_CACHE_MAX_SIZE):
+        """
+        Initialize a thread-safe TTL + LRU cache for weather responses.
+
+        Args:
+            ttl (float): Seconds an entry is served as fresh
+            stale_ttl (float): Extra seconds an expired entry may still be served as stale
+            max_size (int): Maximum number of entries before LRU eviction
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Look up a cached value.
+
+        Args:
+            key (tuple): Cache key
+
+        Returns:
+            tuple: (value, is_stale) where value is None on a miss
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+
+            value, stored_at = entry
+            age = now - stored_at
+            if age <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value, False
+            if age <= self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                return value, True
+
+            # Too old to serve at all
+            del self._entries[key]
+            self.misses += 1
+            return None, False
+
+    def peek(self, key):
+        """Return a servable value without touching counters or LRU order, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl + self.stale_ttl:
+                return None
+            return entry[0]
+
+    def get_fresh_seconds(self, key):
+        """Return seconds until an entry stops being fresh (negative once stale), or None if absent."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return self.ttl - (time.monotonic() - entry[1])
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries if the cache is full."""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def start_refresh(self, key):
+        """Mark a key as being refreshed. Returns False if a refresh is already running."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def finish_refresh(self, key):
+        """Clear the refreshing mark for a key."""
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def invalidate(self, key=None):
+        """Drop one entry, or every entry when no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_stats(self):
+        """Get cache hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0
+            }
+
+class UpstreamBlock:
     def __init__(self):
-        """Initialize Weather API handler."""
+        """Initialize process-wide state that pauses API calls after 401/429 responses."""
+        self._lock = threading.Lock()
+        self.blocked_until = 0.0
+        self.reason = None
+        self.rejections = 0
+
+    def block(self, reason, seconds):
+        """Reject every API call for the given number of seconds."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self.blocked_until:
+                self.blocked_until = until
+                self.reason = reason
+        logger.warning(f"Pausing weather API calls for {seconds:.0f}s: {reason}")
+
+    def is_blocked(self):
+        """Return True while API calls are paused."""
+        return time.monotonic() < self.blocked_until
+
+    def check(self):
+        """Return the reason API calls are paused, or None if they are allowed."""
+        if time.monotonic() >= self.blocked_until:
+            return None
+        with self._lock:
+            self.rejections += 1
+            return self.reason
+
+    def clear(self):
+        """Allow API calls again immediately."""
+        with self._lock:
+            self.blocked_until = 0.0
+            self.reason = None
+
+    def get_stats(self):
+        """Get the current block state."""
+        with self._lock:
+            remaining = max(0.0, self.blocked_until - time.monotonic())
+            return {
+                'blocked': remaining > 0,
+                'reason': self.reason if remaining > 0 else None,
+                'retry_in': round(remaining, 1),
+                'rejections': self.rejections
+            }
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        """
+        Initialize a circuit breaker for upstream weather API calls.
+
+        After failure_threshold consecutive failures the breaker opens and
+        rejects calls. Once reset_timeout seconds have passed a single trial
+        call is let through; its outcome closes or re-opens the breaker.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the breaker
+            reset_timeout (float): Seconds to stay open before a trial call
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+        self.total_failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow_request(self):
+        """Return True if an upstream call may be made now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """Record a successful call, closing the breaker."""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Weather API circuit breaker closed")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Record a failed call, opening the breaker once the threshold is reached."""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.total_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"Weather API circuit breaker opened after "
+                                   f"{self.consecutive_failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Give back the half-open trial slot when the trial call was never made."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def is_open(self):
+        """Return True while the breaker is not fully closed."""
+        return self.state != self.CLOSED
+
+    def get_stats(self):
+        """Get breaker state and counters."""
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'retry_in': round(retry_in, 1),
+                'total_failures': self.total_failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+
+class RequestHedger:
+    def __init__(self, percentile=HEDGE_PERCENTILE, min_delay=HEDGE_MIN_DELAY, max_delay=HEDGE_MAX_DELAY,
+                 window=HEDGE_LATENCY_WINDOW, min_samples=HEDGE_MIN_SAMPLES):
+        """
+        Initialize latency tracking for hedged requests.
+
+        A request that has not been answered after the recent latency
+        percentile gets a second, hedged attempt; whichever answers first wins.
+
+        Args:
+            percentile (float): Latency percentile used as the hedge delay
+            min_delay (float): Lower bound for the hedge delay in seconds
+            max_delay (float): Upper bound for the hedge delay in seconds
+            window (int): Number of recent latencies kept
+            min_samples (int): Latencies needed before hedging starts
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._delay = None
+        self._new_samples = 0
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record_latency(self, seconds):
+        """Record the latency of one upstream attempt."""
+        with self._lock:
+            self._latencies.append(seconds)
+            self._new_samples += 1
+
+    def hedge_delay(self):
+        """Return seconds to wait before hedging, or None while too few latencies are known."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            # Re-sort the window every few samples rather than on every request
+            if self._delay is None or self._new_samples >= 10:
+                ordered = sorted(self._latencies)
+                index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+                self._delay = min(self.max_delay, max(self.min_delay, ordered[index]))
+                self._new_samples = 0
+            return self._delay
+
+    def record_request(self, hedged, hedge_won):
+        """Count a request and whether a hedged attempt was sent and answered first."""
+        with self._lock:
+            self.requests += 1
+            self.hedged += hedged
+            self.hedge_wins += hedge_won
+
+    def get_stats(self):
+        """Get hedge rate and upstream latency percentiles."""
+        delay = self.hedge_delay()
+        with self._lock:
+            ordered = sorted(self._latencies)
+
+            def latency_ms(pct):
+                if not ordered:
+                    return None
+                return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000, 1)
+
+            return {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'hedge_rate': round(self.hedged / self.requests, 3) if self.requests else 0.0,
+                'hedge_delay_ms': round(delay * 1000, 1) if delay is not None else None,
+                'latency_p50_ms': latency_ms(50),
+                'latency_p95_ms': latency_ms(95),
+                'latency_p99_ms': latency_ms(99)
+            }
+
+# Shared by every WeatherAPI instance in the process
+weather_cache = WeatherCache()
+negative_cache = WeatherCache(ttl=NEGATIVE_CACHE_TTL, stale_ttl=0, max_size=NEGATIVE_CACHE_MAX_SIZE)
+# Normalized city name -> (lat, lon, city name returned by the API); coordinates never expire
+city_locations = WeatherCache(ttl=float('inf'), stale_ttl=0, max_size=CITY_LOCATION_CACHE_MAX_SIZE)
+upstream_block = UpstreamBlock()
+circuit_breaker = CircuitBreaker()
+request_hedger = RequestHedger()
+api_rate_limiter = TokenBucket(RATE_LIMIT_CALLS_PER_MINUTE, RATE_LIMIT_BURST, RATE_LIMIT_STATE_FILE,
+                               RATE_LIMIT_BACKGROUND_RESERVE)
+
+def create_http_session(pool_size=HTTP_POOL_SIZE):
+    """
+    Create a keep-alive HTTP session with a connection pool.
+
+    Retries are handled by WeatherAPI itself so that backoff can be jittered
+    and Retry-After headers honored.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections per host
+
+    Returns:
+        requests.Session: Configured session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Compute a jittered exponential backoff delay.
+
+    Args:
+        attempt (int): Zero-based retry attempt
+        retry_after (str): Value of a Retry-After response header, if any
+
+    Returns:
+        float: Seconds to wait before the next attempt
+    """
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass  # HTTP-date form, fall back to exponential backoff
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+class WeatherAPI:
+    def __init__(self, cache=None, base_url=None, rate_limiter=None, city_locations_cache=None,
+                 geohash_precision=WEATHER_CACHE_GEOHASH_PRECISION, city_index=None,
+                 strict_city_names=GAZETTEER_STRICT, hedger=None, hedging=HEDGE_ENABLED):
+        """
+        Initialize Weather API handler.
+
+        Responses are cached per geohash grid cell rather than per city name,
+        so different names for nearby places share one cached response once
+        their coordinates have been learned from an earlier response or
+        found in the offline city index.
+
+        Args:
+            cache (WeatherCache): Response cache, defaults to the process-wide cache
+            base_url (str): Weather endpoint, defaults to OPENWEATHER_BASE_URL
+            rate_limiter (TokenBucket): API-call budget, defaults to the shared bucket
+            city_locations_cache (WeatherCache): City name -> coordinates, defaults to the shared map
+            geohash_precision (int): Geohash length of a cache cell
+            city_index (CityIndex): Offline gazetteer, defaults to the one in GAZETTEER_FILE
+            strict_city_names (bool): Reject names missing from the city index without an API call
+            hedger (RequestHedger): Upstream latency tracker, defaults to the shared one
+            hedging (bool): Send a hedged second attempt when the first is slow
+        """
         self.api_key = OPENWEATHER_API_KEY
-        self.base_url = OPENWEATHER_BASE_URL
+        self.base_url = base_url or OPENWEATHER_BASE_URL
+        self.cache = cache if cache is not None else weather_cache
+        self.city_locations = city_locations_cache if city_locations_cache is not None else city_locations
+        self.geohash_precision = max(1, geohash_precision)
+        self.city_index = city_index if city_index is not None else get_city_index()
+        self.strict_city_names = strict_city_names
+        self.negative_cache = negative_cache
+        self.upstream_block = upstream_block
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = rate_limiter if rate_limiter is not None else api_rate_limiter
+        self._local = threading.local()
+        self.session = create_http_session()
+        self.timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        self.hedger = hedger if hedger is not None else request_hedger
+        self.hedging = hedging
+        self._executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix='weather-hedge')
 
         if self.api_key == "YOUR_API_KEY_HERE":
             logger.warning("Please set your OpenWeatherMap API key in config.py")
 
-    def get_weather_data(self, city, units='metric'):
+    def get_weather_data(self, city=None, units='metric', priority=INTERACTIVE, lat=None, lon=None, deadline=None):
+        """
+        Fetch weather data for a city or a pair of coordinates, serving it from the cache when possible.
+
+        Fresh cache entries are returned directly. Stale entries are returned
+        immediately while a background thread refreshes them. Requests that
+        check_request rejects return None without calling the API. When None
+        is returned, get_last_error tells why.
+
+        A city whose coordinates are known is served from the cache cell that
+        contains them, with the name and coordinates in the returned data set
+        to those the API gave for that city.
+
+        With a deadline, upstream attempts are cut short when it passes, and
+        no call is started with less than DEADLINE_MIN_FETCH_TIME left; the
+        last error is then ERROR_DEADLINE so callers can fall back to stored data.
+
+        Args:
+            city (str): City name, optional when lat and lon are given
+            units (str): Temperature units ('metric', 'imperial', 'kelvin'); the API is always
+                asked for metric data, which is converted locally
+            priority (str): Rate limiter lane, INTERACTIVE or BACKGROUND
+            lat (float): Latitude, takes precedence over city
+            lon (float): Longitude, takes precedence over city
+            deadline (float): time.monotonic() value by which the call must return
+
+        Returns:
+            dict: Weather data or None if error
+        """
+        if units not in SUPPORTED_UNITS:
+            raise ValueError(f"Unsupported units: {units}")
+        self._local.last_error = None
+        if not WEATHER_CACHE_ENABLED:
+            if self._rejection_reason(city, lat, lon, deadline):
+                return None
+            weather_data = self._fetch_weather_data(city, priority, lat, lon, deadline)
+            return convert_weather_units(weather_data, units) if weather_data else None
+
+        key = self._cache_key(city, lat, lon)
+        cached, is_stale = self.cache.get(key)
+
+        if cached is not None:
+            if is_stale and not self.upstream_block.is_blocked() and self.cache.start_refresh(key):
+                threading.Thread(target=self._refresh_cache_entry, args=(key, city, lat, lon),
+                                 daemon=True).start()
+            logger.debug(f"Serving {'stale' if is_stale else 'cached'} weather data for {city or (lat, lon)}")
+            return convert_weather_units(self._localize(cached, city, lat, lon), units)
+
+        rejection = self._rejection_reason(city, lat, lon, deadline)
+        if rejection:
+            logger.debug(f"Rejected weather request for {city or (lat, lon)}: {rejection}")
+            return None
+
+        weather_data = self._fetch_weather_data(city, priority, lat, lon, deadline)
+        if not weather_data:
+            return None
+        self._store(city, lat, lon, weather_data)
+        return convert_weather_units(weather_data, units)
+
+    def get_last_error(self):
+        """
+        Return why the last get_weather_data or refresh_weather_data call in this thread returned None.
+
+        Returns:
+            str: One of the ERROR_* constants, or None if the last call succeeded
+        """
+        return getattr(self._local, 'last_error', None)
+
+    def _set_last_error(self, error):
+        """Record the failure reason for the current thread."""
+        self._local.last_error = error
+
+    def refresh_weather_data(self, city, units='metric'):
         """
-        Fetch weather data for a given city.
+        Fetch weather data from the API and store it in the cache, ignoring any cached entry.
 
         Args:
             city (str): City name
             units (str): Temperature units ('metric', 'imperial', 'kelvin')
 
+        Returns:
+            dict: Weather data or None if error (see get_last_error)
+        """
+        self._local.last_error = None
+        if self._rejection_reason(city):
+            return None
+        weather_data = self._fetch_weather_data(city, BACKGROUND)
+        if not weather_data:
+            return None
+        if WEATHER_CACHE_ENABLED:
+            self._store(city, None, None, weather_data)
+        return convert_weather_units(weather_data, units)
+
+    def get_cache_fresh_seconds(self, city):
+        """Return seconds until the cached entry for a city stops being fresh, or None if not cached."""
+        return self.cache.get_fresh_seconds(self._cache_key(city))
+
+    def _refresh_cache_entry(self, key, city, lat=None, lon=None):
+        """Re-fetch a stale cache entry in the background."""
+        try:
+            weather_data = self._fetch_weather_data(city, BACKGROUND, lat, lon)
+            if weather_data:
+                self._store(city, lat, lon, weather_data)
+        finally:
+            self.cache.finish_refresh(key)
+
+    def _cache_key(self, city, lat=None, lon=None):
+        """
+        Build the cache key for a request. Entries hold metric data for every unit setting.
+
+        Coordinates, given or learned for the city, map to their geohash cell.
+        Until a city's coordinates are known it is keyed by its normalized name.
+        """
+        if lat is None or lon is None:
+            location = self._known_location(city)
+            if location is None:
+                return ('city', normalize_city_name(city))
+            lat, lon = location[0], location[1]
+        return ('cell', geohash_encode(lat, lon, self.geohash_precision))
+
+    def _known_location(self, city):
+        """Return (lat, lon, name) for a city, learned from the API or else taken from the city index."""
+        location = self.city_locations.peek(normalize_city_name(city))
+        if location is None:
+            entry = self.city_index.resolve(city)
+            if entry is not None:
+                location = (entry.lat, entry.lon, entry.name)
+        return location
+
+    def canonical_city(self, city):
+        """
+        Return the city index's name for a city or one of its aliases.
+
+        Args:
+            city (str): City name as typed by the user
+
+        Returns:
+            str: Canonical name ('Bombay' -> 'Mumbai'), or None if the name is not in the index
+        """
+        entry = self.city_index.resolve(city)
+        return entry.name if entry is not None else None
+
+    def _store(self, city, lat, lon, weather_data):
+        """Learn the city's coordinates from a response and cache it under their grid cell."""
+        coord = weather_data.get('coord') or {}
+        if coord.get('lat') is not None and coord.get('lon') is not None:
+            location = (coord['lat'], coord['lon'], weather_data.get('name') or city)
+            if city is not None:
+                self.city_locations.set(normalize_city_name(city), location)
+            # The name the API answered with ('Bombay' -> 'Mumbai') and the
+            # index's canonical name are other known spellings
+            for name in (weather_data.get('name'), self.canonical_city(city)):
+                if name and self.city_locations.peek(normalize_city_name(name)) is None:
+                    self.city_locations.set(normalize_city_name(name), location)
+            if lat is None or lon is None:
+                lat, lon = coord['lat'], coord['lon']
+        self.cache.set(self._cache_key(city, lat, lon), weather_data)
+
+    def _localize(self, weather_data, city, lat=None, lon=None):
+        """Return cell weather labeled with the requested city's own name and coordinates."""
+        if city is None or (lat is not None and lon is not None):
+            return weather_data
+        location = self._known_location(city)
+        if location is None:
+            return weather_data
+        coord = weather_data.get('coord') or {}
+        if (weather_data.get('name') == location[2] and coord.get('lat') == location[0]
+                and coord.get('lon') == location[1]):
+            return weather_data
+        return dict(weather_data, name=location[2], coord={'lat': location[0], 'lon': location[1]})
+
+    def check_request(self, city):
+        """
+        Check, without any network I/O, whether a lookup is known to fail.
+
+        All units share one cached entry, so the answer is the same for every unit.
+
+        Args:
+            city (str): City name
+
+        Returns:
+            str: Reason the request would fail, or None if it may be sent
+        """
+        if WEATHER_CACHE_ENABLED and self.cache.peek(self._cache_key(city)) is not None:
+            return None
+        return self._rejection_reason(city)
+
+    def _rejection_reason(self, city, lat=None, lon=None, deadline=None):
+        """Return why an API call for city would be rejected, or None."""
+        if deadline is not None and deadline - time.monotonic() < DEADLINE_MIN_FETCH_TIME:
+            self._set_last_error(ERROR_DEADLINE)
+            return "Request deadline reached before the weather could be fetched."
+        reason = self.upstream_block.check()
+        if reason:
+            self._set_last_error(ERROR_BLOCKED)
+            return reason
+        if lat is not None and lon is not None:
+            return None
+        if self.negative_cache.peek(normalize_city_name(city)) is not None:
+            self._set_last_error(ERROR_NOT_FOUND)
+            return f"City '{city}' not found."
+        if self.strict_city_names and len(self.city_index) and self.city_index.resolve(city) is None:
+            self._set_last_error(ERROR_NOT_FOUND)
+            return f"City '{city}' not found."
+        return None
+
+    def get_cache_stats(self):
+        """Get weather cache statistics."""
+        stats = self.cache.get_stats()
+        stats['geohash_precision'] = self.geohash_precision
+        stats['known_locations'] = self.city_locations.get_stats()['size']
+        return stats
+
+    def get_circuit_breaker_stats(self):
+        """Get circuit breaker state."""
+        return self.circuit_breaker.get_stats()
+
+    def get_rate_limiter_stats(self):
+        """Get rate limiter state."""
+        return self.rate_limiter.get_stats()
+
+    def get_hedge_stats(self):
+        """Get hedged request counters and upstream latency percentiles."""
+        return dict(self.hedger.get_stats(), enabled=self.hedging)
+
+    def get_negative_cache_stats(self):
+        """Get statistics for the unknown-city cache and the 401/429 block state."""
+        return {
+            'negative_cache': self.negative_cache.get_stats(),
+            'upstream_block': self.upstream_block.get_stats()
+        }
+
+    def _fetch_weather_data(self, city, priority=INTERACTIVE, lat=None, lon=None, deadline=None):
+        """
+        Fetch metric weather data for a given city or coordinates from the OpenWeatherMap API.
+
+        Server errors, timeouts and network errors count as failures for the
+        circuit breaker; while it is open no request is sent. Each call takes
+        a token from the shared rate limiter first: interactive calls queue for
+        up to RATE_LIMIT_INTERACTIVE_WAIT seconds, background calls give up at once.
+        Every retry takes another token, without waiting. Interactive calls are
+        hedged (see RequestHedger).
+
+        Args:
+            city (str): City name
+            priority (str): Rate limiter lane, INTERACTIVE or BACKGROUND
+            lat (float): Latitude, used with lon instead of city when given
+            lon (float): Longitude
+            deadline (float): time.monotonic() value by which the call must return
+
         Returns:
             dict: Weather data or None if error
         """
+        by_coords = lat is not None and lon is not None
+        if by_coords:
+            city = f"({lat}, {lon})"  # Label for log messages
+
+        if not self.circuit_breaker.allow_request():
+            logger.warning(f"Weather API circuit breaker is open, not fetching weather data for {city}")
+            self._set_last_error(ERROR_CIRCUIT_OPEN)
+            return None
+
+        if RATE_LIMIT_ENABLED:
+            timeout = RATE_LIMIT_INTERACTIVE_WAIT if priority == INTERACTIVE else 0.0
+            if deadline is not None:
+                timeout = max(0.0, min(timeout, deadline - time.monotonic() - DEADLINE_MIN_FETCH_TIME))
+            if not self.rate_limiter.acquire(priority, timeout):
+                logger.warning(f"Weather API call budget exhausted, not fetching weather data for {city}")
+                # Give back the trial slot if this call was the breaker's half-open probe
+                self.circuit_breaker.release_trial()
+                self._set_last_error(ERROR_RATE_LIMITED)
+                return None
+
         try:
             # Build API URL
             params = {
-                'q': city,
                 'appid': self.api_key,
-                'units': units
+                'units': 'metric'  # Other units are converted locally from the same payload
             }
+            entry = None if by_coords else self.city_index.resolve(city)
+            if by_coords:
+                params['lat'] = lat
+                params['lon'] = lon
+            elif entry is not None and entry.city_id:
+                params['id'] = entry.city_id  # Unambiguous, unlike a name
+            else:
+                params['q'] = city
 
-            response = requests.get(self.base_url, params=params, timeout=10)
+            response = self._request_with_retries(params, deadline, hedge=priority == INTERACTIVE, priority=priority)
+
+            if response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
 
             if response.status_code == 200:
                 weather_data = response.json()
@@ -45,73 +978,235 @@ class WeatherAPI:
                 return weather_data
             elif response.status_code == 401:
                 logger.error("Invalid API key. Please check your OpenWeatherMap API key.")
+                self.upstream_block.block("Invalid API key. Please check your OpenWeatherMap API key.",
+                                          AUTH_FAILURE_BLOCK_SECONDS)
+                self._set_last_error(ERROR_BLOCKED)
                 return None
             elif response.status_code == 404:
                 logger.error(f"City '{city}' not found.")
+                if not by_coords:
+                    self.negative_cache.set(normalize_city_name(city), response.status_code)
+                self._set_last_error(ERROR_NOT_FOUND)
+                return None
+            elif response.status_code == 429:
+                logger.error("API rate limit exceeded.")
+                self.upstream_block.block("Weather API rate limit exceeded. Please try again shortly.",
+                                          self._retry_after_seconds(response, RATE_LIMIT_BLOCK_SECONDS))
+                self._set_last_error(ERROR_BLOCKED)
                 return None
             else:
                 logger.error(f"API request failed with status code: {response.status_code}")
+                self._set_last_error(ERROR_UPSTREAM)
                 return None
 
         except requests.exceptions.RequestException as e:
+            if deadline is not None and deadline - time.monotonic() < DEADLINE_MIN_FETCH_TIME:
+                # Cut short by the caller's deadline, not a sign the API is down
+                logger.warning(f"Request deadline reached while fetching weather data for {city}")
+                self.circuit_breaker.release_trial()
+                self._set_last_error(ERROR_DEADLINE)
+                return None
             logger.error(f"Network error while fetching weather data: {e}")
+            self.circuit_breaker.record_failure()
+            self._set_last_error(ERROR_UPSTREAM)
             return None
         except json.JSONDecodeError as e:
             logger.error(f"Error parsing weather data JSON: {e}")
+            self.circuit_breaker.record_failure()
+            self._set_last_error(ERROR_UPSTREAM)
             return None
         except Exception as e:
             logger.error(f"Unexpected error fetching weather data: {e}")
+            self.circuit_breaker.record_failure()
+            self._set_last_error(ERROR_UPSTREAM)
             return None
 
-    def parse_weather_data(self, raw_data):
+    def _request_with_retries(self, params, deadline=None, hedge=False, priority=INTERACTIVE):
+        """
+        Send a GET request, retrying 429/5xx responses and connection errors.
+
+        The caller has taken a token for the first attempt; each retry takes
+        another one from the rate limiter in the priority lane, and the last
+        response (or error) is returned instead of retrying when none is left.
+
+        Args:
+            params (dict): Query parameters
+            deadline (float): time.monotonic() value after which no attempt or retry is made
+            hedge (bool): Hedge slow attempts (see _send)
+            priority (str): Rate limiter lane retries take their tokens from
+
+        Returns:
+            requests.Response: Last response received
+        """
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            try:
+                response = self._send(params, deadline, hedge)
+            except requests.exceptions.ConnectionError as e:
+                delay = backoff_delay(attempt)
+                if (attempt == HTTP_MAX_RETRIES or not self._has_time_for(delay, deadline)
+                        or not self._take_retry_token(priority)):
+                    raise
+                logger.warning(f"Connection error ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+                return response
+
+            delay = backoff_delay(attempt, response.headers.get('Retry-After'))
+            if not self._has_time_for(delay, deadline) or not self._take_retry_token(priority):
+                return response
+            logger.warning(f"API returned {response.status_code}, retrying in {delay:.2f}s "
+                           f"(attempt {attempt + 1}/{HTTP_MAX_RETRIES})")
+            time.sleep(delay)
+
+    def _take_retry_token(self, priority):
+        """Take a rate limiter token for a retry without waiting. Returns False if the budget is spent."""
+        if not RATE_LIMIT_ENABLED or self.rate_limiter.acquire(priority, 0.0):
+            return True
+        logger.warning("Weather API call budget exhausted, not retrying")
+        return False
+
+    def _has_time_for(self, delay, deadline):
+        """Return True if another attempt after delay seconds would still start before the deadline."""
+        return deadline is None or time.monotonic() + delay + DEADLINE_MIN_FETCH_TIME <= deadline
+
+    def _send(self, params, deadline=None, hedge=False):
+        """
+        Send one GET request, hedging it if it is slower than usual.
+
+        When the first attempt has not answered within the hedge delay, a
+        second identical attempt is sent (if the rate limiter has a spare
+        background token) and the first response to arrive is used. Timeouts
+        are shortened so that no attempt outlives the deadline.
+
+        Args:
+            params (dict): Query parameters
+            deadline (float): time.monotonic() value by which a response is needed
+            hedge (bool): Allow a hedged second attempt
+
+        Returns:
+            requests.Response: First response received
+        """
+        timeout = self.timeout
+        if deadline is not None:
+            remaining = max(0.001, deadline - time.monotonic())
+            timeout = (min(HTTP_CONNECT_TIMEOUT, remaining), min(HTTP_READ_TIMEOUT, remaining))
+
+        hedge_delay = self.hedger.hedge_delay() if hedge and self.hedging else None
+        if hedge_delay is None:
+            if hedge:
+                self.hedger.record_request(hedged=False, hedge_won=False)
+            return self._timed_get(params, timeout)
+
+        first = self._executor.submit(self._timed_get, params, timeout)
+        wait_time = hedge_delay if deadline is None else min(hedge_delay, max(0.0, deadline - time.monotonic()))
+        if wait([first], timeout=wait_time).done:
+            self.hedger.record_request(hedged=False, hedge_won=False)
+            return first.result()
+
+        attempts = [first]
+        if self._has_time_for(0.0, deadline) and (not RATE_LIMIT_ENABLED
+                                                  or self.rate_limiter.acquire(BACKGROUND, 0.0)):
+            attempts.append(self._executor.submit(self._timed_get, params, timeout))
+        hedged = len(attempts) > 1
+
+        pending = set(attempts)
+        error = None
+        while pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e
+                    continue
+                self.hedger.record_request(hedged, hedge_won=future is not first)
+                return response
+
+        self.hedger.record_request(hedged, hedge_won=False)
+        if error is not None and not pending:
+            raise error
+        raise requests.exceptions.Timeout("No response from the weather API before the request deadline")
+
+    def _timed_get(self, params, timeout):
+        """Send a GET request and record its latency for the hedge delay."""
+        start = time.monotonic()
+        response = self.session.get(self.base_url, params=params, timeout=timeout)
+        self.hedger.record_latency(time.monotonic() - start)
+        return response
+
+    def _retry_after_seconds(self, response, default):
+        """Read a numeric Retry-After header, falling back to a default."""
+        try:
+            return float(response.headers.get('Retry-After', default))
+        except ValueError:
+            return default
+
+    def close(self):
+        """Close pooled HTTP connections."""
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def parse_weather_data(self, raw_data, keep_raw=STORE_RAW_WEATHER):
         """
         Parse raw weather data into a cleaner format.
 
         Args:
             raw_data (dict): Raw weather data from API
+            keep_raw (bool): Keep the full API payload as raw_data
 
         Returns:
-            dict: Parsed weather data
+            ParsedWeather: Parsed weather data
         """
         try:
             if not raw_data:
                 return None
 
-            parsed_data = {
-                'city': raw_data.get('name', 'Unknown'),
-                'country': raw_data.get('sys', {}).get('country', 'Unknown'),
-                'temperature': round(raw_data.get('main', {}).get('temp', 0), 1),
-                'feels_like': round(raw_data.get('main', {}).get('feels_like', 0), 1),
-                'humidity': raw_data.get('main', {}).get('humidity', 0),
-                'pressure': raw_data.get('main', {}).get('pressure', 0),
-                'weather_main': raw_data.get('weather', [{}])[0].get('main', 'Unknown'),
-                'weather_description': raw_data.get('weather', [{}])[0].get('description', 'Unknown'),
-                'wind_speed': raw_data.get('wind', {}).get('speed', 0),
-                'wind_direction': raw_data.get('wind', {}).get('deg', 0),
-                'cloudiness': raw_data.get('clouds', {}).get('all', 0),
-                'visibility': raw_data.get('visibility', 0),
-                'sunrise': datetime.fromtimestamp(raw_data.get('sys', {}).get('sunrise', 0)).strftime('%H:%M:%S'),
-                'sunset': datetime.fromtimestamp(raw_data.get('sys', {}).get('sunset', 0)).strftime('%H:%M:%S'),
-                'fetch_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'raw_data': raw_data  # Keep original data for reference
-            }
+            main = raw_data.get('main', {})
+            weather = raw_data.get('weather', [{}])[0]
+            weather_id = weather.get('id')
 
-            return parsed_data
+            return ParsedWeather(
+                city=raw_data.get('name', 'Unknown'),
+                country=raw_data.get('sys', {}).get('country', 'Unknown'),
+                temperature=round(main.get('temp', 0), 1),
+                feels_like=round(main.get('feels_like', 0), 1),
+                humidity=main.get('humidity', 0),
+                weather_main=weather.get('main', 'Unknown'),
+                weather_description=weather.get('description', 'Unknown'),
+                weather_id=weather_id,
+                weather_detail=self.get_weather_condition_detail(weather_id),
+                fetch_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                raw_data=raw_data if keep_raw else None
+            )
 
         except Exception as e:
             logger.error(f"Error parsing weather data: {e}")
             return None
 
-    def get_weather_condition_category(self, weather_main):
+    def get_weather_condition_category(self, weather_main, weather_id=None):
         """
         Categorize weather condition for outfit matching.
 
+        The numeric condition id is resolved with a single table lookup; the
+        weather_main string is only used when no valid id is available.
+
         Args:
             weather_main (str): Main weather condition from API
+            weather_id (int): Condition id from API (200-804), optional
 
         Returns:
             str: Categorized weather condition
         """
+        if isinstance(weather_id, int) and CONDITION_ID_MIN <= weather_id <= CONDITION_ID_MAX:
+            category = CONDITION_CATEGORY_TABLE[weather_id - CONDITION_ID_MIN]
+            if category:
+                return category
+
         weather_main = weather_main.lower()
 
         if weather_main in ['rain', 'drizzle']:
@@ -129,6 +1224,20 @@ class WeatherAPI:
         else:
             return 'clear'  # Default fallback
 
+    def get_weather_condition_detail(self, weather_id):
+        """
+        Get the detailed condition for a condition id, e.g. 'light_rain' or 'heavy_rain'.
+
+        Args:
+            weather_id (int): Condition id from API (200-804)
+
+        Returns:
+            str: Detailed condition or None if the id is unknown
+        """
+        if isinstance(weather_id, int) and CONDITION_ID_MIN <= weather_id <= CONDITION_ID_MAX:
+            return CONDITION_DETAIL_TABLE[weather_id - CONDITION_ID_MIN]
+        return None
+
     def test_api_connection(self):
         """Test API connection with a simple request."""
         try:
@@ -143,6 +1252,88 @@ class WeatherAPI:
             logger.error(f"API connection test failed: {e}")
             return False
 
+class AsyncWeatherAPI:
+    def __init__(self, weather_api=None, concurrency=ASYNC_WEATHER_CONCURRENCY):
+        """
+        Initialize an asyncio front end for WeatherAPI.
+
+        Requests run on a worker pool no larger than the HTTP connection pool and
+        go through the wrapped WeatherAPI, so they share its keep-alive session
+        and response cache.
+
+        Args:
+            weather_api (WeatherAPI): Sync API handler to wrap, created if not given
+            concurrency (int): Default number of requests in flight at once
+        """
+        self._owns_weather_api = weather_api is None
+        self.weather_api = weather_api if weather_api is not None else WeatherAPI()
+        self.concurrency = max(1, min(concurrency, HTTP_POOL_SIZE))
+        self._executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix='weather-api')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    async def get_weather_data(self, city, units='metric'):
+        """
+        Fetch raw weather data for a city without blocking the event loop.
+
+        Args:
+            city (str): City name
+            units (str): Temperature units ('metric', 'imperial', 'kelvin')
+
+        Returns:
+            dict: Weather data or None if error
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.weather_api.get_weather_data, city, units)
+
+    async def get_weather(self, city, units='metric'):
+        """
+        Fetch and parse weather data for a city.
+
+        Returns:
+            ParsedWeather: Parsed weather data (see WeatherAPI.parse_weather_data) or None if error
+        """
+        raw_data = await self.get_weather_data(city, units)
+        return self.weather_api.parse_weather_data(raw_data) if raw_data else None
+
+    async def get_weather_many(self, cities, units='metric', concurrency=None):
+        """
+        Fetch and parse weather data for many cities concurrently.
+
+        Cities that normalize to the same name are fetched once.
+
+        Args:
+            cities (list): City names
+            units (str): Temperature units ('metric', 'imperial', 'kelvin')
+            concurrency (int): Maximum requests in flight, defaults to self.concurrency
+
+        Returns:
+            dict: City name -> parsed weather data, or None for cities that failed
+        """
+        semaphore = asyncio.Semaphore(max(1, min(concurrency or self.concurrency, HTTP_POOL_SIZE)))
+
+        async def fetch_one(city):
+            async with semaphore:
+                return await self.get_weather(city, units)
+
+        unique = {}
+        for city in cities:
+            unique.setdefault(normalize_city_name(city), city)
+
+        results = await asyncio.gather(*(fetch_one(city) for city in unique.values()))
+        by_key = dict(zip(unique.keys(), results))
+        return {city: by_key[normalize_city_name(city)] for city in cities}
+
+    def close(self):
+        """Shut down the worker pool and, if owned, the wrapped WeatherAPI."""
+        self._executor.shutdown(wait=False)
+        if self._owns_weather_api:
+            self.weather_api.close()
+
 # Test the weather API
 if __name__ == "__main__":
     weather_api = WeatherAPI()
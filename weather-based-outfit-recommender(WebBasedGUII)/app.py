@@ -1,9 +1,16 @@
 from flask import Flask, render_template, request, jsonify
 from outfit_recommender import OutfitRecommender
-from db_handler import DatabaseHandler
+from db_handler import create_database_handler, COLLECTION_PAGES, collection_page_filters
+from cache_warmer import CacheWarmer
+from catalog_watcher import CatalogWatcher
+from retention import RollupJob
+from gazetteer import get_city_index
+from config import (CACHE_WARMER_ENABLED, CATALOG_WATCHER_ENABLED, ROLLUP_ENABLED, REQUEST_DEADLINE,
+                    COLLECTION_PAGE_SIZE, DATABASE_BACKEND)
 from bson import ObjectId
 from datetime import datetime
 import logging
+import time
 from collections import defaultdict
 import numpy as np
 
@@ -14,7 +21,9 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 def serialize_doc(obj):
-    """Recursively convert MongoDB documents so ObjectId and datetime are JSON serializable."""
+    """Recursively convert MongoDB documents so ObjectId, datetime and ParsedWeather are JSON serializable."""
+    if hasattr(obj, 'to_json'):
+        return obj.to_json()
     if isinstance(obj, list):
         return [serialize_doc(i) for i in obj]
     elif isinstance(obj, dict):
@@ -24,7 +33,7 @@ def serialize_doc(obj):
                 new_obj[k] = str(v)
             elif isinstance(v, datetime):
                 new_obj[k] = v.isoformat()
-            elif isinstance(v, (dict, list)):
+            elif isinstance(v, (dict, list)) or hasattr(v, 'to_json'):
                 new_obj[k] = serialize_doc(v)
             else:
                 new_obj[k] = v
@@ -38,18 +47,42 @@ def serialize_doc(obj):
 
 try:
     recommender = OutfitRecommender()
-    db = DatabaseHandler()
+    db = create_database_handler()
     if not db.test_connection():
-        logger.error("Failed to connect to MongoDB. Please check MONGO_URI in config.py")
+        logger.error(f"Failed to connect to the {DATABASE_BACKEND} database. Please check config.py")
         db = None
         recommender = None
     else:
-        logger.info("MongoDB connection successful.")
+        logger.info(f"Database connection successful ({DATABASE_BACKEND}).")
+        db.ensure_indexes()
+        recommender.precompute_recommendations()
 except Exception as e:
     logger.exception(f"Exception during initialization: {e}")
     db = None
     recommender = None
 
+cache_warmer = None
+if recommender is not None and CACHE_WARMER_ENABLED:
+    cache_warmer = CacheWarmer(recommender.weather_api, db)
+    cache_warmer.start()
+
+catalog_watcher = None
+if db is not None and CATALOG_WATCHER_ENABLED and DATABASE_BACKEND == 'mongodb':  # Change streams are MongoDB-only
+    catalog_watcher = CatalogWatcher(db)
+    catalog_watcher.start()
+
+rollup_job = None
+if db is not None and ROLLUP_ENABLED:
+    rollup_job = RollupJob(db)
+    rollup_job.start()
+
+@app.teardown_appcontext
+def release_database_connection(exception=None):
+    """Close the request thread's database connection so per-request threads do not leave any behind."""
+    for handler in (db, recommender.db if recommender is not None else None):
+        if handler is not None:
+            handler.release_connection()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -59,11 +92,12 @@ def get_recommendation():
     if recommender is None:
         return jsonify({'success': False, 'error': 'Database connection not established.'})
     try:
+        deadline = time.monotonic() + REQUEST_DEADLINE
         data = request.get_json()
         city = data.get('city', '').strip()
         if not city:
             return jsonify({'success': False, 'error': 'Please enter a city name.'})
-        result = recommender.get_weather_and_recommend(city)
+        result = recommender.get_weather_and_recommend(city, deadline=deadline)
         if result['success']:
             advice = recommender.get_weather_advice(result['weather'])
             result['advice'] = advice
@@ -78,7 +112,7 @@ def get_history():
     if db is None:
         return jsonify({'success': False, 'error': 'Database connection not established.'})
     try:
-        history = db.get_recommendations_history(10)
+        history = db.get_recommendations_history(10, summary=True)
         history_serialized = serialize_doc(history)
         return jsonify({'success': True, 'history': history_serialized})
     except Exception as e:
@@ -96,21 +130,66 @@ def get_db_stats():
         logger.exception(f"Error in /api/db-stats: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/status')
+def get_status():
+    if recommender is None:
+        return jsonify({'success': False, 'error': 'Database connection not established.'})
+    try:
+        weather_api = recommender.weather_api
+        status = {
+            'circuit_breaker': weather_api.get_circuit_breaker_stats(),
+            'weather_cache': weather_api.get_cache_stats(),
+            'rate_limiter': weather_api.get_rate_limiter_stats(),
+            'hedging': weather_api.get_hedge_stats(),
+            'single_flight': recommender.get_single_flight_stats(),
+            'outfit_index': recommender.db.get_outfit_index_stats(),
+            'recommendation_lattice': recommender.get_lattice_stats(),
+            'write_behind': recommender.db.get_write_behind_stats()
+        }
+        status.update(weather_api.get_negative_cache_stats())
+        if cache_warmer is not None:
+            status['cache_warmer'] = cache_warmer.get_stats()
+        if catalog_watcher is not None:
+            status['catalog_watcher'] = catalog_watcher.get_stats()
+        if rollup_job is not None:
+            status['rollup'] = rollup_job.get_stats()
+        return jsonify({'success': True, 'status': status})
+    except Exception as e:
+        logger.exception(f"Error in /api/status: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/cities/suggest')
+def suggest_cities():
+    try:
+        prefix = request.args.get('prefix', '').strip()
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        cities = [{'name': city.name, 'country': city.country, 'lat': city.lat, 'lon': city.lon}
+                  for city in get_city_index().suggest(prefix, limit)]
+        return jsonify({'success': True, 'cities': cities})
+    except Exception as e:
+        logger.exception(f"Error in /api/cities/suggest: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/collections/<collection_name>')
 def get_collection_data(collection_name):
     if db is None:
         return jsonify({'success': False, 'error': 'Database connection not established.'})
     try:
-        if collection_name not in ['weather', 'outfit', 'recommendations']:
+        if collection_name not in COLLECTION_PAGES:
             return jsonify({'success': False, 'error': 'Invalid collection name.'})
-        if collection_name == 'weather':
-            data = db.get_weather_data(limit=50)
-        elif collection_name == 'outfit':
-            data = list(db.outfit_collection.find().limit(50))
-        else:
-            data = list(db.recommendations_collection.find().limit(50))
-        data_serialized = serialize_doc(data)
-        return jsonify({'success': True, 'data': data_serialized})
+        # ?limit=&after=<next cursor>&fields=a,b&<filter>=<value>&timestamp_from=&timestamp_to=
+        fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+        page = db.get_collection_page(collection_name,
+                                      limit=request.args.get('limit', COLLECTION_PAGE_SIZE, type=int),
+                                      after=request.args.get('after') or None,
+                                      fields=fields or None,
+                                      filters=collection_page_filters(collection_name, request.args))
+        if page is None:
+            return jsonify({'success': False, 'error': f'Could not read the {collection_name} collection.'})
+        data_serialized = serialize_doc(page['data'])
+        return jsonify({'success': True, 'data': data_serialized, 'next': page['next']})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
     except Exception as e:
         logger.exception(f"Error in /api/collections/{collection_name}: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -124,9 +203,10 @@ def add_record(collection_name):
             return jsonify({'success': False, 'error': 'Invalid collection name.'})
         data = request.get_json()
         record = data.get('record', {})
-        col = get_collection(collection_name)
-        result = col.insert_one(record)
-        return jsonify({'success': True, 'message': f'Record inserted with ID: {str(result.inserted_id)}'})
+        record_id = db.insert_record(collection_name, record)
+        if record_id is None:
+            return jsonify({'success': False, 'error': 'Record could not be inserted'})
+        return jsonify({'success': True, 'message': f'Record inserted with ID: {str(record_id)}'})
     except Exception as e:
         logger.exception(f"Error in add_record: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -142,9 +222,7 @@ def update_record(collection_name, record_id):
         record = data.get('record', {})
         if '_id' in record:
             del record['_id']
-        col = get_collection(collection_name)
-        result = col.update_one({'_id': ObjectId(record_id)}, {'$set': record})
-        if result.modified_count > 0:
+        if db.update_record(collection_name, record_id, record):
             return jsonify({'success': True, 'message': 'Record updated successfully'})
         else:
             return jsonify({'success': False, 'error': 'No record found or no changes made'})
@@ -159,9 +237,7 @@ def delete_record(collection_name, record_id):
     try:
         if collection_name not in ['weather', 'outfit', 'recommendations']:
             return jsonify({'success': False, 'error': 'Invalid collection name.'})
-        col = get_collection(collection_name)
-        result = col.delete_one({'_id': ObjectId(record_id)})
-        if result.deleted_count > 0:
+        if db.delete_record(collection_name, record_id):
             return jsonify({'success': True, 'message': 'Record deleted successfully'})
         else:
             return jsonify({'success': False, 'error': 'Record not found'})
@@ -174,7 +250,7 @@ def get_heatmap_data():
     if db is None:
         return jsonify({'success': False, 'error': 'Database connection not established.'})
     try:
-        data = list(db.recommendations_collection.find().limit(200))
+        data = db.get_recommendations_history(limit=200)
         if not data:
             return jsonify({'success': False, 'error': 'No recommendation data found.'})
         
@@ -251,13 +327,5 @@ def get_heatmap_data():
         logger.exception(f"Error generating heatmap data: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-def get_collection(collection_name):
-    if collection_name == 'weather':
-        return db.weather_collection
-    elif collection_name == 'outfit':
-        return db.outfit_collection
-    else:
-        return db.recommendations_collection
-
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
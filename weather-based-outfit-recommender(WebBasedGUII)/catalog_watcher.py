@@ -0,0 +1,137 @@
+# catalog_watcher.py
+"""
+Change-stream watcher for the outfit catalog.
+
+Writes made through the app bump the catalog version themselves. The watcher
+also catches writes from other processes (another worker, the desktop app,
+mongosh) by following a MongoDB change stream on the outfit collection and
+bumping the version for every change, so in-memory catalog indexes and
+recommendation lattices are rebuilt without a restart.
+
+Change streams need a replica set; a single-node one is enough:
+
+    mongod --replSet rs0 --dbpath data
+    mongosh --eval "rs.initiate()"
+    MONGO_URI = "mongodb://localhost:27017/?replicaSet=rs0"
+"""
+
+import logging
+import threading
+from datetime import datetime
+from pymongo.errors import OperationFailure, PyMongoError
+from db_handler import bump_catalog_version
+from config import CATALOG_WATCHER_RETRY_INTERVAL
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Server error codes meaning change streams cannot be opened on this deployment
+CHANGE_STREAM_UNSUPPORTED_CODES = {40573}  # Only supported on replica sets
+CHANGE_STREAM_HISTORY_LOST = 286  # Resume token no longer in the oplog
+
+class CatalogWatcher:
+    def __init__(self, db, retry_interval=CATALOG_WATCHER_RETRY_INTERVAL, max_await_ms=1000):
+        """
+        Initialize the catalog watcher.
+
+        Args:
+            db (DatabaseHandler): Database whose outfit collection is watched
+            retry_interval (float): Seconds to wait before reopening a failed change stream
+            max_await_ms (int): How long one poll of the change stream waits for an event
+        """
+        self.db = db
+        self.retry_interval = retry_interval
+        self.max_await_ms = max_await_ms
+
+        self._resume_token = None
+        self._stop_event = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+
+        self.events = 0
+        self.reconnects = 0
+        self.connected = False
+        self.supported = True
+        self.last_event = None
+        self.last_error = None
+
+    def start(self):
+        """Start watching in a daemon thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='catalog-watcher', daemon=True)
+        self._thread.start()
+        logger.info("Catalog watcher started")
+
+    def stop(self):
+        """Stop the watching thread."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.max_await_ms / 1000 + 1)
+        logger.info("Catalog watcher stopped")
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Wait until the change stream is open, or watching has failed for good.
+
+        Returns:
+            bool: True if the change stream is open
+        """
+        self._ready.wait(timeout)
+        return self.connected
+
+    def _run(self):
+        """Follow the change stream until stopped, reopening it after errors."""
+        while not self._stop_event.is_set():
+            try:
+                with self.db.outfit_collection.watch(resume_after=self._resume_token,
+                                                     max_await_time_ms=self.max_await_ms) as stream:
+                    if self._resume_token is None:
+                        # Changes made before the stream opened were not seen
+                        bump_catalog_version()
+                    self.connected = True
+                    self._ready.set()
+                    while not self._stop_event.is_set() and stream.alive:
+                        change = stream.try_next()
+                        self._resume_token = stream.resume_token  # Advances even without events
+                        if change is None:
+                            continue
+                        self.events += 1
+                        self.last_event = datetime.utcnow()
+                        version = bump_catalog_version()
+                        logger.info(f"Outfit catalog {change.get('operationType')}; catalog version {version}")
+            except OperationFailure as e:
+                self.last_error = str(e)
+                if e.code in CHANGE_STREAM_UNSUPPORTED_CODES:
+                    logger.error(f"Catalog watcher disabled: change streams need a replica set ({e})")
+                    self.supported = False
+                    break
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    self._resume_token = None  # Start over from now
+                logger.error(f"Catalog change stream failed: {e}")
+            except PyMongoError as e:
+                self.last_error = str(e)
+                logger.error(f"Catalog change stream failed: {e}")
+
+            self.connected = False
+            if self._stop_event.is_set():
+                break
+            self.reconnects += 1
+            self._stop_event.wait(self.retry_interval)
+
+        self.connected = False
+        self._ready.set()
+
+    def get_stats(self):
+        """Get change-stream state and event counters."""
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'connected': self.connected,
+            'supported': self.supported,
+            'events': self.events,
+            'reconnects': self.reconnects,
+            'last_event': self.last_event.isoformat() if self.last_event else None,
+            'last_error': self.last_error
+        }
@@ -1,9 +1,103 @@
 # config.py
+import getpass
 import os
+import tempfile
 
 # OpenWeatherMap API Configuration
 OPENWEATHER_API_KEY = "Your Api Key"  # Replace with your actual API key
-OPENWEATHER_BASE_URL = "http://api.openweathermap.org/data/2.5/weather"
+OPENWEATHER_UPSTREAM_URL = "http://api.openweathermap.org/data/2.5/weather"
+OPENWEATHER_BASE_URL = os.environ.get('OPENWEATHER_BASE_URL', OPENWEATHER_UPSTREAM_URL)  # Set to a stub_server.py URL for offline load tests
+STORE_RAW_WEATHER = False  # Keep the full API payload in stored weather documents
+
+# Weather cache configuration
+WEATHER_CACHE_ENABLED = True
+WEATHER_CACHE_TTL = 600  # Seconds a cached response is served as fresh
+WEATHER_CACHE_STALE_TTL = 300  # Extra seconds a stale response is served while it refreshes
+WEATHER_CACHE_MAX_SIZE = 1000  # Least recently used entries are evicted beyond this
+WEATHER_CACHE_GEOHASH_PRECISION = 5  # Geohash length of a cache cell (5 = about 4.9 x 4.9 km)
+CITY_LOCATION_CACHE_MAX_SIZE = 10000  # City names remembered with the coordinates the API returned
+NEGATIVE_CACHE_TTL = 300  # Seconds an unknown city (404) is rejected without calling the API
+NEGATIVE_CACHE_MAX_SIZE = 10000
+AUTH_FAILURE_BLOCK_SECONDS = 300  # Pause all API calls after an invalid-key (401) response
+RATE_LIMIT_BLOCK_SECONDS = 60  # Pause all API calls after a 429 without a Retry-After header
+
+# Gazetteer configuration (offline city index)
+GAZETTEER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cities.csv')  # CSV or OpenWeatherMap city.list.json(.gz)
+GAZETTEER_STRICT = False  # Reject names missing from the gazetteer without calling the API
+
+# Rate limit configuration (shared by all worker processes on this machine)
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_CALLS_PER_MINUTE = 60  # OpenWeatherMap free tier quota
+RATE_LIMIT_BURST = 10  # Calls that may be made back to back
+RATE_LIMIT_BACKGROUND_RESERVE = 0.5  # Fraction of the burst kept for interactive requests
+RATE_LIMIT_INTERACTIVE_WAIT = 2.0  # Seconds an interactive request queues for a token
+# One file per user; it is created readable and writable by its owner only
+RATE_LIMIT_STATE_FILE = os.path.join(tempfile.gettempdir(), f'weather_outfit_rate_limit_{getpass.getuser()}.bin')
+
+# Cache warmer configuration
+CACHE_WARMER_ENABLED = False  # Start the warmer inside the Flask app
+CACHE_WARMER_TOP_N = 50  # Number of most requested cities kept warm
+CACHE_WARMER_WINDOW_HOURS = 24  # How far back requests are counted when ranking cities
+CACHE_WARMER_LEAD_TIME = 60  # Seconds before expiry at which an entry is refreshed
+CACHE_WARMER_INTERVAL = 15  # Seconds between warming passes
+CACHE_WARMER_RANK_INTERVAL = 300  # Seconds between re-ranking popular cities
+CACHE_WARMER_CALLS_PER_MINUTE = 20  # API-call budget for refreshes
+
+# Circuit breaker configuration
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures or timeouts before the breaker opens
+CIRCUIT_RESET_TIMEOUT = 30  # Seconds the breaker stays open before a trial request
+
+# HTTP client configuration
+HTTP_POOL_SIZE = 20  # Keep-alive connections kept open to the weather API
+HTTP_CONNECT_TIMEOUT = 3.05  # Seconds to establish a connection
+HTTP_READ_TIMEOUT = 10  # Seconds to wait for the response
+HTTP_MAX_RETRIES = 3  # Retries on 429/5xx responses and connection errors
+HTTP_BACKOFF_BASE = 0.5  # Seconds, doubled on every retry
+HTTP_BACKOFF_MAX = 8  # Upper bound for a single backoff delay
+ASYNC_WEATHER_CONCURRENCY = 10  # Concurrent requests in AsyncWeatherAPI.get_weather_many
+
+# Deadline and hedged request configuration
+REQUEST_DEADLINE = 4.0  # End-to-end seconds allowed for a /api/recommend request
+DEADLINE_MIN_FETCH_TIME = 0.25  # With less time left, skip the API and fall back to stored weather
+HEDGE_ENABLED = True  # Send a second attempt when the first is slower than usual
+HEDGE_PERCENTILE = 95  # Upstream latency percentile used as the hedge delay
+HEDGE_MIN_DELAY = 0.05  # Lower bound for the hedge delay, in seconds
+HEDGE_MAX_DELAY = 2.0  # Upper bound for the hedge delay, in seconds
+HEDGE_LATENCY_WINDOW = 500  # Recent upstream latencies the percentile is computed over
+HEDGE_MIN_SAMPLES = 20  # Hedge only once this many latencies have been seen
+
+# Outfit catalog index
+OUTFIT_INDEX_ENABLED = True  # Answer get_suitable_outfits from an in-memory copy of the outfit catalog
+OUTFIT_QUERY_MODE = 'find'  # 'find': best 10 items overall; 'aggregate': best items of every category (MongoDB 5.2+)
+OUTFIT_TOP_K_PER_CATEGORY = 3  # Items per category returned in 'aggregate' mode
+RECOMMENDATION_LATTICE_ENABLED = True  # Precompute recommendations for every temperature/humidity/condition cell
+RECOMMENDATION_LATTICE_MAX_CELLS = 500000  # Larger lattices are not built; recommendations are computed per request
+CATALOG_WATCHER_ENABLED = False  # Follow a change stream on the outfit collection (needs a replica set)
+CATALOG_WATCHER_RETRY_INTERVAL = 5  # Seconds before reopening a failed change stream
+
+# Write-behind persistence
+WRITE_BEHIND_ENABLED = False  # Queue weather and recommendation inserts and write them in batches (not durable on return)
+WRITE_BEHIND_MAX_QUEUE = 10000  # Queued documents before writers are held back
+WRITE_BEHIND_BATCH_SIZE = 100  # Write as soon as this many documents are queued
+WRITE_BEHIND_FLUSH_INTERVAL = 1.0  # Seconds a queued document may wait before it is written
+WRITE_BEHIND_ENQUEUE_TIMEOUT = 2.0  # Seconds a writer waits for room before inserting the document itself
+WRITE_BEHIND_MAX_RETRIES = 5  # Times a batch is retried after a connection error or timeout before it is dropped
+WRITE_BEHIND_RETRY_DELAY = 1.0  # Seconds before the first retry, doubled on every further retry
+RECOMMENDATION_STORAGE = 'normalized'  # 'normalized': outfit _ids and a weather reference; 'embedded': full copies
+
+# Retention
+WEATHER_RETENTION_DAYS = None  # Days after which a TTL index deletes weather documents, e.g. 30 (None keeps them)
+RECOMMENDATION_RETENTION_DAYS = None  # Days after which a TTL index deletes recommendations, e.g. 90 (None keeps them)
+ROLLUP_ENABLED = False  # Keep daily per-city summaries of weather and recommendations up to date in the background
+ROLLUP_INTERVAL = 3600  # Seconds between roll-up runs
+ROLLUP_LOOKBACK_DAYS = 2  # Days (including today) recomputed by each roll-up run
+RAW_WEATHER_CAPPED_MB = 0  # Keep raw API payloads (STORE_RAW_WEATHER) in a capped collection of this size; 0 to keep them in weather documents
+
+# Storage backend
+DATABASE_BACKEND = "mongodb"  # 'mongodb', or 'sqlite' to keep everything in one local file (no database server)
+SQLITE_PATH = "weather_outfit.db"  # Database file used by the 'sqlite' backend
+SQLITE_BUSY_TIMEOUT = 5.0  # Seconds a write waits for another connection's transaction
+SQLITE_CACHED_STATEMENTS = 256  # Prepared statements kept per connection
 
 # MongoDB Configuration
 MONGO_URI = "mongodb://localhost:27017/"
@@ -13,6 +107,12 @@ DATABASE_NAME = "weather_outfit_db"
 WEATHER_COLLECTION = "weather_data"
 OUTFIT_COLLECTION = "outfit_dataset"
 RECOMMENDATIONS_COLLECTION = "recommendations"
+DAILY_SUMMARY_COLLECTION = "daily_city_summary"
+RAW_WEATHER_COLLECTION = "weather_raw"
+
+# Collection viewer
+COLLECTION_PAGE_SIZE = 50  # Documents per collection viewer page
+COLLECTION_PAGE_MAX = 500  # Largest page a client may ask for
 
 # UI Configuration
 APP_TITLE = "Weather-Based Outfit Recommendation System"
@@ -24,3 +124,10 @@ def celsius_to_fahrenheit(celsius):
 
 def fahrenheit_to_celsius(fahrenheit):
     return (fahrenheit - 32) * 5/9
+
+def celsius_to_kelvin(celsius):
+    return celsius + 273.15
+
+# Wind speed conversion
+def meters_per_second_to_miles_per_hour(speed):
+    return speed * 3600 / 1609.344
@@ -0,0 +1,191 @@
+# gazetteer.py
+"""
+Offline city index used to canonicalize city names and reject unknown ones
+before any API call.
+
+The index is loaded from a gazetteer file: the bundled cities.csv
+(name, country, lat, lon, id, aliases), or OpenWeatherMap's city list
+(city.list.json or city.list.json.gz) for complete coverage and city ids.
+"""
+
+import bisect
+import csv
+import gzip
+import json
+import logging
+import threading
+import unicodedata
+from collections import namedtuple
+from config import GAZETTEER_FILE
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+City = namedtuple('City', ['name', 'country', 'lat', 'lon', 'city_id'])
+
+def normalize_city_name(city):
+    """Normalize a city name for use as a lookup key ('  New   york ' -> 'new york')."""
+    return ' '.join(str(city).split()).casefold()
+
+def fold_city_name(city):
+    """Normalize a city name and strip accents, for index lookups ('São Paulo' -> 'sao paulo')."""
+    decomposed = unicodedata.normalize('NFKD', normalize_city_name(city))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+class CityIndex:
+    def __init__(self, cities=(), aliases=None):
+        """
+        Build a city index.
+
+        Names are kept in one sorted array, so an exact lookup is a dict hit
+        and a prefix search is a binary search followed by a short scan.
+
+        Args:
+            cities (iterable): City records, most prominent first; the first
+                city with a given name wins exact lookups
+            aliases (dict): Position in cities -> list of alternative names
+        """
+        self.cities = list(cities)
+        aliases = aliases or {}
+
+        pairs = set()
+        for position, city in enumerate(self.cities):
+            for name in [city.name] + list(aliases.get(position, ())):
+                key = fold_city_name(name)
+                if key:
+                    pairs.add((key, position))
+
+        ordered = sorted(pairs)
+        self._keys = [key for key, _ in ordered]
+        self._positions = [position for _, position in ordered]
+        self._exact = {}
+        for key, position in ordered:
+            if key not in self._exact or position < self._exact[key]:
+                self._exact[key] = position
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index from a gazetteer file.
+
+        Args:
+            path (str): CSV file, or OpenWeatherMap city.list.json(.gz)
+
+        Returns:
+            CityIndex: Loaded index
+        """
+        if path.endswith('.json') or path.endswith('.json.gz'):
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as f:
+                records = json.load(f)
+            cities = [City(record['name'], record.get('country', ''), record['coord']['lat'],
+                           record['coord']['lon'], record.get('id'))
+                      for record in records if record.get('name')]
+            return cls(cities)
+
+        cities = []
+        aliases = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if not row.get('name'):
+                    continue
+                city_id = row.get('id') or None
+                cities.append(City(row['name'], row.get('country', ''), float(row['lat']), float(row['lon']),
+                                   int(city_id) if city_id else None))
+                if row.get('aliases'):
+                    aliases[len(cities) - 1] = row['aliases'].split('|')
+        return cls(cities, aliases)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def resolve(self, name):
+        """
+        Resolve a name or alias to a city.
+
+        A trailing country code narrows the match ('London,CA').
+
+        Args:
+            name (str): City name as typed by the user
+
+        Returns:
+            City: Matching city, or None if the name is unknown
+        """
+        if not name:
+            return None
+        key = fold_city_name(name)
+        position = self._exact.get(key)
+        if position is not None:
+            return self.cities[position]
+
+        city_name, _, country = key.rpartition(',')
+        country = country.strip()
+        if not city_name or len(country) != 2:
+            return None
+        key = city_name.strip()
+        start = bisect.bisect_left(self._keys, key)
+        for index in range(start, len(self._keys)):
+            if self._keys[index] != key:
+                break
+            city = self.cities[self._positions[index]]
+            if city.country.casefold() == country:
+                return city
+        return None
+
+    def suggest(self, prefix, limit=10):
+        """
+        Find cities whose name or alias starts with a prefix.
+
+        Args:
+            prefix (str): Beginning of a city name
+            limit (int): Maximum number of cities returned
+
+        Returns:
+            list: City records in name order, without duplicates
+        """
+        key = fold_city_name(prefix)
+        if not key or limit <= 0:
+            return []
+
+        start = bisect.bisect_left(self._keys, key)
+        seen = set()
+        results = []
+        for index in range(start, len(self._keys)):
+            if not self._keys[index].startswith(key):
+                break
+            position = self._positions[index]
+            if position not in seen:
+                seen.add(position)
+                results.append(self.cities[position])
+                if len(results) >= limit:
+                    break
+        return results
+
+    def get_stats(self):
+        """Get index size."""
+        return {'cities': len(self.cities), 'names': len(self._keys)}
+
+_city_index = None
+_city_index_lock = threading.Lock()
+
+def get_city_index(path=GAZETTEER_FILE):
+    """
+    Return the process-wide city index, loading it on first use.
+
+    Returns:
+        CityIndex: Loaded index, or an empty index if the file cannot be read
+    """
+    global _city_index
+    with _city_index_lock:
+        if _city_index is None:
+            if not path:
+                _city_index = CityIndex()
+            else:
+                try:
+                    _city_index = CityIndex.load(path)
+                    logger.info(f"Loaded {len(_city_index)} cities from gazetteer {path}")
+                except Exception as e:
+                    logger.error(f"Error loading gazetteer {path}: {e}")
+                    _city_index = CityIndex()
+        return _city_index
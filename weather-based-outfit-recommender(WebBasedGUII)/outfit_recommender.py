@@ -1,33 +1,324 @@
 # outfit_recommender.py
+import bisect
 import logging
+import threading
+import time
+from array import array
 from datetime import datetime
-from db_handler import DatabaseHandler
-from weather_api import WeatherAPI
+from config import RECOMMENDATION_LATTICE_ENABLED, RECOMMENDATION_LATTICE_MAX_CELLS
+from db_handler import create_database_handler
+from outfit_catalog import is_number
+from weather_api import WeatherAPI, ParsedWeather, normalize_city_name, UPSTREAM_UNAVAILABLE_ERRORS
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class OutfitRecommender:
+class _InFlightCall:
+    """A computation that other callers with the same key can wait on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
     def __init__(self):
-        """Initialize the outfit recommender system."""
-        self.db = DatabaseHandler()
+        """Initialize a registry that coalesces concurrent calls sharing a key."""
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Run func once for all concurrent callers using the same key.
+
+        The first caller runs func; callers arriving while it is still running
+        wait for it and receive the same result (or exception).
+
+        Args:
+            key: Hashable key identifying the computation
+            func (callable): Computation to run
+
+        Returns:
+            The value returned by func
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def get_stats(self):
+        """Get coalescing counters."""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls)
+            }
+
+# Categories a complete outfit needs
+ESSENTIAL_CATEGORIES = ['Top', 'Bottom', 'Footwear']
+# Outerwear is added below this temperature (Celsius) or in these conditions
+OUTERWEAR_BELOW = 15
+OUTERWEAR_CONDITIONS = ['rain', 'snow']
+
+def build_recommendations(outfits, temperature, weather_category):
+    """
+    Group suitable outfits into a complete outfit and per-category recommendations.
+
+    Args:
+        outfits (list): Suitable outfits, highest comfort_rating first
+        temperature (float): Temperature in Celsius
+        weather_category (str): Weather condition category
+
+    Returns:
+        list: List of recommended outfits
+    """
+    # Group outfits by category for a complete outfit
+    outfit_by_category = {}
+    for outfit in outfits:
+        category = outfit['category']
+        if category not in outfit_by_category:
+            outfit_by_category[category] = []
+        outfit_by_category[category].append(outfit)
+
+    # Build recommended outfit combinations
+    recommendations = []
+
+    # Create outfit combinations
+    if all(cat in outfit_by_category for cat in ESSENTIAL_CATEGORIES):
+        # Complete outfit recommendation
+        complete_outfit = {
+            'outfit_type': 'Complete Outfit',
+            'items': []
+        }
+
+        # Add top-rated item from each essential category
+        for cat in ESSENTIAL_CATEGORIES:
+            if outfit_by_category[cat]:
+                best_item = max(outfit_by_category[cat], key=lambda x: x.get('comfort_rating') or 0)
+                complete_outfit['items'].append(best_item)
+
+        # Add outerwear if needed (cold or rainy weather)
+        if temperature < OUTERWEAR_BELOW or weather_category in OUTERWEAR_CONDITIONS:
+            if 'Outerwear' in outfit_by_category:
+                best_outerwear = max(outfit_by_category['Outerwear'], key=lambda x: x.get('comfort_rating') or 0)
+                complete_outfit['items'].append(best_outerwear)
+
+        # Add accessories based on weather
+        if 'Accessory' in outfit_by_category:
+            for accessory in outfit_by_category['Accessory'][:2]:  # Max 2 accessories
+                complete_outfit['items'].append(accessory)
+
+        recommendations.append(complete_outfit)
+
+    # Also provide individual category recommendations
+    for category, items in outfit_by_category.items():
+        if items:
+            category_rec = {
+                'outfit_type': f'{category} Recommendations',
+                'items': items[:3]  # Top 3 in each category
+            }
+            recommendations.append(category_rec)
+
+    return recommendations
+
+def copy_recommendations(recommendations):
+    """Copy recommendations down to the item dicts, so callers can modify them."""
+    return [dict(rec, items=[dict(item) for item in rec['items']]) for rec in recommendations]
+
+def _cell_points(breakpoints):
+    """Return one value inside each cell: below, at and between the breakpoints, and above."""
+    if not breakpoints:
+        return [0]
+    points = [breakpoints[0] - 1]
+    for lower, upper in zip(breakpoints, breakpoints[1:]):
+        points.extend([lower, (lower + upper) / 2])
+    points.extend([breakpoints[-1], breakpoints[-1] + 1])
+    return points
+
+def _cell(breakpoints, value):
+    """Return the cell of a value: 2i for the open interval below breakpoint i, 2i + 1 for breakpoint i."""
+    index = bisect.bisect_left(breakpoints, value)
+    if index < len(breakpoints) and breakpoints[index] == value:
+        return 2 * index + 1
+    return 2 * index
+
+class RecommendationLattice:
+    def __init__(self, index):
+        """
+        Precompute recommend_outfits for every weather cell of a catalog index.
+
+        Suitable outfits only change where some item's temperature or
+        humidity range starts or ends, and the outerwear rule only at
+        OUTERWEAR_BELOW, so the (temperature, humidity, condition) space splits
+        into cells with one answer each. Cells hold a position in a table of
+        distinct answers; looking one up is two binary searches and one
+        array index.
+
+        Args:
+            index (OutfitCatalogIndex): Catalog index the lattice is built from
+        """
+        start = time.perf_counter()
+        self.index = index
+        self.temperatures = sorted(set(index.temp_min.values) | set(index.temp_max.values) | {OUTERWEAR_BELOW})
+        self.humidities = sorted(set(index.humidity_min.values) | set(index.humidity_max.values))
+        self.conditions = {condition: position for position, condition in enumerate(sorted(index.condition_masks))}
+        self._temperature_cells = 2 * len(self.temperatures) + 1
+        self._humidity_cells = 2 * len(self.humidities) + 1
+
+        humidity_masks = [index.humidity_min.matching(humidity) & index.humidity_max.matching(humidity)
+                          for humidity in _cell_points(self.humidities)]
+        self.results = []
+        self.cells = array('I')
+        positions = {}
+        for condition in self.conditions:
+            condition_mask = index.condition_masks[condition]
+            for temperature in _cell_points(self.temperatures):
+                temperature_mask = (index.temp_min.matching(temperature) & index.temp_max.matching(temperature)
+                                    & condition_mask)
+                outerwear = temperature < OUTERWEAR_BELOW or condition in OUTERWEAR_CONDITIONS
+                for humidity_mask in humidity_masks:
+                    top = index.select(temperature_mask & humidity_mask)
+                    key = (tuple(top), outerwear)
+                    position = positions.get(key)
+                    if position is None:
+                        position = positions[key] = len(self.results)
+                        outfits = [index.document(item) for item in top]
+                        self.results.append(build_recommendations(outfits, temperature, condition))
+                    self.cells.append(position)
+        self.build_seconds = time.perf_counter() - start
+
+    @staticmethod
+    def cell_count(index):
+        """Return the number of cells a lattice over index would have, without building it."""
+        temperatures = set(index.temp_min.values) | set(index.temp_max.values) | {OUTERWEAR_BELOW}
+        humidities = set(index.humidity_min.values) | set(index.humidity_max.values)
+        return (2 * len(temperatures) + 1) * (2 * len(humidities) + 1) * len(index.condition_masks)
+
+    def lookup(self, temperature, humidity, weather_category):
+        """
+        Return the precomputed recommendations for the weather.
+
+        The lists are shared between calls; use copy_recommendations before modifying them.
+
+        Returns:
+            list: List of recommended outfits (empty for a condition no item is suitable for)
+        """
+        condition = self.conditions.get(weather_category)
+        if condition is None:
+            return []
+        cell = ((condition * self._temperature_cells + _cell(self.temperatures, temperature))
+                * self._humidity_cells + _cell(self.humidities, humidity))
+        return self.results[self.cells[cell]]
+
+    def get_stats(self):
+        """Get lattice size and build time."""
+        return {
+            'cells': len(self.cells),
+            'distinct_recommendations': len(self.results),
+            'temperature_breakpoints': len(self.temperatures),
+            'humidity_breakpoints': len(self.humidities),
+            'conditions': len(self.conditions),
+            'build_ms': round(self.build_seconds * 1000, 1)
+        }
+
+class OutfitRecommender:
+    def __init__(self, lattice_enabled=RECOMMENDATION_LATTICE_ENABLED,
+                 max_lattice_cells=RECOMMENDATION_LATTICE_MAX_CELLS):
+        """
+        Initialize the outfit recommender system.
+
+        Args:
+            lattice_enabled (bool): Serve recommendations from a precomputed RecommendationLattice
+            max_lattice_cells (int): Largest lattice built; bigger catalogs are served per request
+        """
+        self.db = create_database_handler()
         self.weather_api = WeatherAPI()
+        self.single_flight = SingleFlight()
+
+        self.lattice_enabled = lattice_enabled
+        self.max_lattice_cells = max_lattice_cells
+        self._lattice = None
+        self._lattice_index = None  # Catalog index the lattice was built (or skipped) for
+        self._lattice_lock = threading.Lock()
+        self.lattice_hits = 0
 
-    def get_weather_and_recommend(self, city):
+    def get_weather_and_recommend(self, city, deadline=None):
         """
         Get weather data and generate outfit recommendations.
 
+        Concurrent calls for the same city share one weather fetch, one
+        recommendation and one set of database writes. Cities already known
+        to be unknown, and calls made while the API key is rejected or rate
+        limited, fail immediately without a network call. If the deadline
+        leaves no time for the weather API, the last stored weather is used.
+
         Args:
             city (str): City name
+            deadline (float): time.monotonic() value by which the weather must be known
 
         Returns:
             dict: Complete recommendation data
         """
+        rejection = self.weather_api.check_request(city)
+        if rejection:
+            return {
+                'success': False,
+                'error': rejection,
+                'weather': None,
+                'outfits': []
+            }
+
+        # Aliases of the same city ('Bombay', 'Mumbai') share one call
+        key = normalize_city_name(self.weather_api.canonical_city(city) or city)
+        result = self.single_flight.do(key, self._get_weather_and_recommend, city, deadline)
+        # Each caller gets its own top-level dict so callers can add keys safely
+        return dict(result)
+
+    def get_single_flight_stats(self):
+        """Get counters for coalesced get_weather_and_recommend calls."""
+        return self.single_flight.get_stats()
+
+    def _get_weather_and_recommend(self, city, deadline=None):
+        """Fetch weather, recommend outfits and store both (see get_weather_and_recommend)."""
         try:
             # Step 1: Fetch weather data
             logger.info(f"Fetching weather data for {city}")
-            raw_weather = self.weather_api.get_weather_data(city)
+            raw_weather = self.weather_api.get_weather_data(city, deadline=deadline)
+
+            if not raw_weather and self.weather_api.get_last_error() in UPSTREAM_UNAVAILABLE_ERRORS:
+                last_known = self.get_last_known_weather(city)
+                if last_known:
+                    logger.warning(f"Weather API unavailable, serving last known weather for {city}")
+                    return self._recommend_for_weather(city, last_known, store_weather=False)
 
             if not raw_weather:
                 return {
@@ -48,32 +339,58 @@ class OutfitRecommender:
                     'outfits': []
                 }
 
+            return self._recommend_for_weather(city, weather_data)
+
+        except Exception as e:
+            logger.error(f"Error in get_weather_and_recommend: {e}")
+            return {
+                'success': False,
+                'error': str(e),
+                'weather': None,
+                'outfits': []
+            }
+
+    def _recommend_for_weather(self, city, weather_data, store_weather=True):
+        """
+        Recommend outfits for parsed weather data and store the recommendation.
+
+        Args:
+            city (str): City name as requested
+            weather_data (ParsedWeather): Parsed weather data
+            store_weather (bool): Whether to store weather_data in the weather collection
+
+        Returns:
+            dict: Complete recommendation data
+        """
+        try:
             # Step 3: Store weather data in database
-            self.db.insert_weather_data(weather_data)
+            weather_ref = self.db.insert_weather_data(weather_data) if store_weather else None
 
             # Step 4: Get outfit recommendations
             outfits = self.recommend_outfits(
                 temperature=weather_data['temperature'],
                 humidity=weather_data['humidity'],
-                weather_condition=weather_data['weather_main']
+                weather_condition=weather_data['weather_main'],
+                weather_id=weather_data.get('weather_id')
             )
 
             # Step 5: Create recommendation record
             recommendation_data = {
                 'city': city,
-                'weather': weather_data,
+                'weather': weather_data.to_bson(),
                 'recommended_outfits': outfits,
                 'recommendation_count': len(outfits)
             }
 
             # Step 6: Store recommendation in database
-            self.db.insert_recommendation(recommendation_data)
+            self.db.insert_recommendation(recommendation_data, weather_ref=weather_ref)
 
             return {
                 'success': True,
                 'weather': weather_data,
                 'outfits': outfits,
-                'recommendation_data': recommendation_data
+                'recommendation_data': recommendation_data,
+                'stale': weather_data.stale
             }
 
         except Exception as e:
@@ -85,7 +402,28 @@ class OutfitRecommender:
                 'outfits': []
             }
 
-    def recommend_outfits(self, temperature, humidity, weather_condition):
+    def get_last_known_weather(self, city):
+        """
+        Get the most recent stored weather for a city, flagged as stale.
+
+        Args:
+            city (str): City name
+
+        Returns:
+            ParsedWeather: Weather data with stale and stale_age_seconds set, or None
+        """
+        document = self.db.get_latest_weather(city)
+        if not document:
+            return None
+
+        weather_data = ParsedWeather.from_document(document)
+        timestamp = document.get('timestamp')
+        age = (datetime.utcnow() - timestamp).total_seconds() if isinstance(timestamp, datetime) else None
+        weather_data.stale = True
+        weather_data.stale_age_seconds = int(age) if age is not None else None
+        return weather_data
+
+    def recommend_outfits(self, temperature, humidity, weather_condition, weather_id=None):
         """
         Recommend outfits based on weather conditions.
 
@@ -93,13 +431,23 @@ class OutfitRecommender:
             temperature (float): Temperature in Celsius
             humidity (int): Humidity percentage
             weather_condition (str): Weather condition
+            weather_id (int): OpenWeatherMap condition id, preferred over weather_condition when given
 
         Returns:
             list: List of recommended outfits
         """
         try:
             # Get weather condition category for matching
-            weather_category = self.weather_api.get_weather_condition_category(weather_condition)
+            weather_category = self.weather_api.get_weather_condition_category(weather_condition, weather_id)
+
+            # Serve from the precomputed lattice when the catalog has one
+            lattice = self.get_lattice() if is_number(temperature) and is_number(humidity) else None
+            if lattice is not None:
+                self.lattice_hits += 1
+                recommendations = lattice.lookup(temperature, humidity, weather_category)
+                if not recommendations:
+                    logger.warning(f"No outfits found for T:{temperature}°C, H:{humidity}%, W:{weather_category}")
+                return copy_recommendations(recommendations)
 
             # Get suitable outfits from database
             outfits = self.db.get_suitable_outfits(temperature, humidity, weather_category)
@@ -108,61 +456,60 @@ class OutfitRecommender:
                 logger.warning(f"No outfits found for T:{temperature}°C, H:{humidity}%, W:{weather_category}")
                 return []
 
-            # Group outfits by category for a complete outfit
-            outfit_by_category = {}
-            for outfit in outfits:
-                category = outfit['category']
-                if category not in outfit_by_category:
-                    outfit_by_category[category] = []
-                outfit_by_category[category].append(outfit)
-
-            # Build recommended outfit combinations
-            recommendations = []
-
-            # Ensure we have essential categories
-            essential_categories = ['Top', 'Bottom', 'Footwear']
-
-            # Create outfit combinations
-            if all(cat in outfit_by_category for cat in essential_categories):
-                # Complete outfit recommendation
-                complete_outfit = {
-                    'outfit_type': 'Complete Outfit',
-                    'items': []
-                }
-
-                # Add top-rated item from each essential category
-                for cat in essential_categories:
-                    if outfit_by_category[cat]:
-                        best_item = max(outfit_by_category[cat], key=lambda x: x.get('comfort_rating', 0))
-                        complete_outfit['items'].append(best_item)
+            return build_recommendations(outfits, temperature, weather_category)
 
-                # Add outerwear if needed (cold or rainy weather)
-                if temperature < 15 or weather_category in ['rain', 'snow']:
-                    if 'Outerwear' in outfit_by_category:
-                        best_outerwear = max(outfit_by_category['Outerwear'], key=lambda x: x.get('comfort_rating', 0))
-                        complete_outfit['items'].append(best_outerwear)
-
-                # Add accessories based on weather
-                if 'Accessory' in outfit_by_category:
-                    for accessory in outfit_by_category['Accessory'][:2]:  # Max 2 accessories
-                        complete_outfit['items'].append(accessory)
-
-                recommendations.append(complete_outfit)
+        except Exception as e:
+            logger.error(f"Error recommending outfits: {e}")
+            return []
 
-            # Also provide individual category recommendations
-            for category, items in outfit_by_category.items():
-                if items:
-                    category_rec = {
-                        'outfit_type': f'{category} Recommendations',
-                        'items': items[:3]  # Top 3 in each category
-                    }
-                    recommendations.append(category_rec)
+    def get_lattice(self):
+        """
+        Return the recommendation lattice for the current outfit catalog, building it if the catalog changed.
 
-            return recommendations
+        While one caller builds, others get None and compute their
+        recommendations per request instead of waiting.
 
+        Returns:
+            RecommendationLattice: Lattice, or None if it is disabled, too large or being built
+        """
+        if not self.lattice_enabled:
+            return None
+        index = self.db.get_outfit_index()
+        if index is None:
+            return None
+        if self._lattice_index is index:
+            return self._lattice
+        if not self._lattice_lock.acquire(blocking=False):
+            return None
+        try:
+            if self._lattice_index is not index:
+                cells = RecommendationLattice.cell_count(index)
+                if cells > self.max_lattice_cells:
+                    logger.warning(f"Recommendation lattice would have {cells} cells; computing per request")
+                    lattice = None
+                else:
+                    lattice = RecommendationLattice(index)
+                    logger.info(f"Recommendation lattice built: {lattice.get_stats()}")
+                self._lattice, self._lattice_index = lattice, index
+            return self._lattice
         except Exception as e:
-            logger.error(f"Error recommending outfits: {e}")
-            return []
+            logger.error(f"Error building recommendation lattice: {e}")
+            self._lattice, self._lattice_index = None, index
+            return None
+        finally:
+            self._lattice_lock.release()
+
+    def precompute_recommendations(self):
+        """Build the outfit catalog index and recommendation lattice ahead of the first request."""
+        return self.get_lattice() is not None
+
+    def get_lattice_stats(self):
+        """Get recommendation lattice size and hit counter."""
+        lattice = self._lattice
+        stats = {'enabled': self.lattice_enabled, 'loaded': lattice is not None, 'hits': self.lattice_hits}
+        if lattice is not None:
+            stats.update(lattice.get_stats())
+        return stats
 
     def get_outfit_summary(self, recommendations):
         """
@@ -204,7 +551,7 @@ class OutfitRecommender:
         Generate weather-specific advice.
 
         Args:
-            weather_data (dict): Weather data
+            weather_data (ParsedWeather): Weather data
 
         Returns:
             str: Weather advice
@@ -251,8 +598,9 @@ class OutfitRecommender:
             return "Stay comfortable and dress appropriately for the weather!"
 
     def close(self):
-        """Close database connection."""
+        """Close database and HTTP connections."""
         self.db.close_connection()
+        self.weather_api.close()
 
 # Test the outfit recommender
 if __name__ == "__main__":
@@ -0,0 +1,1011 @@
+# sqlite_handler.py
+"""
+Embedded SQLite storage behind the DatabaseHandler interface.
+
+With DATABASE_BACKEND = 'sqlite' in config.py everything is kept in one local
+file (SQLITE_PATH), so single-node kiosks and CI need no MongoDB server.
+Documents are stored as JSON (bson.json_util, so ObjectIds and datetimes
+round-trip) beside the columns queries filter and sort on, and every hot query
+has an index. Each thread gets its own connection in WAL mode, so readers do
+not wait for the writer. A connection is closed when its thread ends (or at
+the end of a web request, see release_connection), so threads started per
+request do not leave connections behind.
+
+Values are always bound as parameters. The hot queries are module constants;
+the page, record and retention queries put table and column names from the
+fixed tables below into the SQL, so they too come from a small set of
+statements that sqlite3 keeps prepared in its per-connection cache.
+
+What MongoDB does on the server is done here instead:
+- TTL indexes: ensure_indexes records the configured retention, and
+  rollup_daily_summaries deletes detail older than it after rolling it up.
+- Change streams: none; outfit edits made by other processes are picked up on restart.
+- Write-behind: not used; a WAL commit is cheap enough to write inserts directly.
+- Capped raw-weather collection: raw payloads stay in the weather documents.
+
+City names are matched case-insensitively for ASCII letters only (NOCASE).
+"""
+
+import json
+import logging
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId, json_util
+from pymongo import ASCENDING
+from config import (SQLITE_PATH, SQLITE_BUSY_TIMEOUT, SQLITE_CACHED_STATEMENTS, OUTFIT_INDEX_ENABLED,
+                    OUTFIT_QUERY_MODE, OUTFIT_TOP_K_PER_CATEGORY, RECOMMENDATION_STORAGE, WEATHER_RETENTION_DAYS,
+                    RECOMMENDATION_RETENTION_DAYS, ROLLUP_LOOKBACK_DAYS, COLLECTION_PAGE_SIZE, COLLECTION_PAGE_MAX)
+from db_handler import (OUTFIT_QUERY_MODES, RECOMMENDATION_STORAGE_MODES, HISTORY_FIELDS, COLLECTION_PAGES,
+                        bump_catalog_version, get_catalog_version, normalize_recommendation, encode_page_cursor,
+                        decode_page_cursor)
+from outfit_catalog import OutfitCatalogIndex, is_number, outfit_conditions, SUITABLE_OUTFITS_LIMIT, OUTFIT_FIELDS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tables, created when the handler opens the file. Timestamps are stored as
+# sortable UTC text ('' when missing, which sorts first like a missing date in
+# MongoDB) and city names compare case-insensitively.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS weather (
+        id TEXT PRIMARY KEY,
+        city TEXT COLLATE NOCASE,
+        timestamp TEXT NOT NULL DEFAULT '',
+        document TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS outfits (
+        id TEXT PRIMARY KEY,
+        category TEXT,
+        temp_min REAL,
+        temp_max REAL,
+        humidity_min REAL,
+        humidity_max REAL,
+        comfort_rating REAL,
+        document TEXT NOT NULL
+    )""",
+    # One row per weather condition of an outfit (weather_conditions may be a list)
+    """CREATE TABLE IF NOT EXISTS outfit_conditions (
+        condition TEXT NOT NULL,
+        outfit_id TEXT NOT NULL,
+        PRIMARY KEY (condition, outfit_id)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS recommendations (
+        id TEXT PRIMARY KEY,
+        city TEXT COLLATE NOCASE,
+        timestamp TEXT NOT NULL DEFAULT '',
+        document TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS daily_summaries (
+        city TEXT COLLATE NOCASE NOT NULL,
+        day TEXT NOT NULL,
+        weather TEXT,
+        recommendations TEXT,
+        PRIMARY KEY (city, day)
+    )""",
+    # Retention (days) currently applied to each table, like the TTL of a MongoDB index
+    """CREATE TABLE IF NOT EXISTS retention (
+        collection TEXT PRIMARY KEY,
+        days REAL
+    )"""
+]
+
+# Indexes for every hot query, created by ensure_indexes. Each ends in id, so
+# sorting by (timestamp, id) and keyset pages are read straight off the index.
+INDEXES = {
+    # get_weather_data / get_latest_weather / get_collection_page: one city, newest first
+    'weather_city_timestamp': "CREATE INDEX IF NOT EXISTS weather_city_timestamp ON weather (city, timestamp, id)",
+    # The same without a city; also finds expired weather
+    'weather_timestamp': "CREATE INDEX IF NOT EXISTS weather_timestamp ON weather (timestamp, id)",
+    # get_suitable_outfits: temperature and humidity ranges, read from the index alone
+    'outfits_temp_humidity': ("CREATE INDEX IF NOT EXISTS outfits_temp_humidity "
+                              "ON outfits (temp_min, temp_max, humidity_min, humidity_max)"),
+    # get_collection_page filtered by category
+    'outfits_category': "CREATE INDEX IF NOT EXISTS outfits_category ON outfits (category, id)",
+    # Removing an outfit's conditions
+    'outfit_conditions_outfit': "CREATE INDEX IF NOT EXISTS outfit_conditions_outfit ON outfit_conditions (outfit_id)",
+    # get_recommendations_history, get_popular_cities and get_collection_page; also finds expired recommendations
+    'recommendations_timestamp': ("CREATE INDEX IF NOT EXISTS recommendations_timestamp "
+                                  "ON recommendations (timestamp, id)"),
+    'recommendations_city_timestamp': ("CREATE INDEX IF NOT EXISTS recommendations_city_timestamp "
+                                       "ON recommendations (city, timestamp, id)")
+}
+
+# Tables behind the collection names used by the viewers (COLLECTION_PAGES)
+COLLECTION_TABLES = {'weather': 'weather', 'outfit': 'outfits', 'recommendations': 'recommendations'}
+# Columns behind the sort and filter fields of COLLECTION_PAGES
+PAGE_COLUMNS = {'_id': 'id', 'timestamp': 'timestamp', 'city': 'city', 'category': 'category',
+                'weather_conditions': 'id IN (SELECT outfit_id FROM outfit_conditions WHERE condition = ?)'}
+
+INSERT_WEATHER = "INSERT INTO weather (id, city, timestamp, document) VALUES (?, ?, ?, ?)"
+INSERT_RECOMMENDATION = "INSERT INTO recommendations (id, city, timestamp, document) VALUES (?, ?, ?, ?)"
+INSERT_OUTFIT = ("INSERT INTO outfits (id, category, temp_min, temp_max, humidity_min, humidity_max, comfort_rating, "
+                 "document) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+INSERT_CONDITION = "INSERT OR IGNORE INTO outfit_conditions (condition, outfit_id) VALUES (?, ?)"
+
+SELECT_WEATHER = "SELECT document FROM weather ORDER BY timestamp DESC, id DESC LIMIT ?"
+SELECT_CITY_WEATHER = "SELECT document FROM weather WHERE city = ? ORDER BY timestamp DESC, id DESC LIMIT ?"
+SELECT_HISTORY = "SELECT document FROM recommendations ORDER BY timestamp DESC, id DESC LIMIT ?"
+SELECT_OUTFITS_BY_ID = "SELECT document FROM outfits WHERE id IN (SELECT value FROM json_each(?))"
+SELECT_POPULAR_CITIES = ("SELECT city, COUNT(*) AS count FROM recommendations "
+                         "WHERE timestamp >= ? AND city IS NOT NULL GROUP BY lower(city) ORDER BY count DESC LIMIT ?")
+
+# get_suitable_outfits without the catalog index; {condition} is '' or CONDITION_FILTER
+SUITABLE_OUTFITS_WHERE = "temp_min <= ? AND temp_max >= ? AND humidity_min <= ? AND humidity_max >= ?{condition}"
+CONDITION_FILTER = " AND id IN (SELECT outfit_id FROM outfit_conditions WHERE condition = ?)"
+SELECT_SUITABLE = ("SELECT document FROM outfits WHERE " + SUITABLE_OUTFITS_WHERE +
+                   " ORDER BY COALESCE(comfort_rating, 0) DESC, id LIMIT ?")
+# The best items of every category, as in db_handler.suitable_outfits_pipeline
+SELECT_SUITABLE_PER_CATEGORY = (
+    "SELECT document FROM (SELECT document, id, COALESCE(comfort_rating, 0) AS rank, "
+    "ROW_NUMBER() OVER (PARTITION BY category ORDER BY COALESCE(comfort_rating, 0) DESC, id) AS position "
+    "FROM outfits WHERE " + SUITABLE_OUTFITS_WHERE + ") WHERE position <= ? ORDER BY rank DESC, id")
+
+# Daily summaries, merged like the $merge in DatabaseHandler.rollup_daily_summaries.
+# The WHERE clause before GROUP BY keeps the upsert unambiguous.
+ROLLUP_WEATHER = """
+    INSERT INTO daily_summaries (city, day, weather)
+    SELECT city, substr(timestamp, 1, 10) AS day, json_object(
+        'readings', COUNT(*),
+        'temp_min', MIN(temperature), 'temp_max', MAX(temperature), 'temp_avg', AVG(temperature),
+        'humidity_avg', AVG(humidity),
+        'conditions', json_group_array(DISTINCT weather_main) FILTER (WHERE weather_main IS NOT NULL))
+    FROM (SELECT city, timestamp, json_extract(document, '$.temperature') AS temperature,
+                 json_extract(document, '$.humidity') AS humidity,
+                 json_extract(document, '$.weather_main') AS weather_main
+          FROM weather WHERE city IS NOT NULL AND timestamp >= ?)
+    WHERE true GROUP BY lower(city), day
+    ON CONFLICT (city, day) DO UPDATE SET weather = excluded.weather"""
+ROLLUP_RECOMMENDATIONS = """
+    INSERT INTO daily_summaries (city, day, recommendations)
+    SELECT city, substr(timestamp, 1, 10) AS day, json_object(
+        'count', COUNT(*),
+        'outfit_groups', COALESCE(SUM(outfit_groups), 0),
+        'conditions', json_group_array(DISTINCT weather_main) FILTER (WHERE weather_main IS NOT NULL))
+    FROM (SELECT city, timestamp, json_extract(document, '$.recommendation_count') AS outfit_groups,
+                 json_extract(document, '$.weather.weather_main') AS weather_main
+          FROM recommendations WHERE city IS NOT NULL AND timestamp >= ?)
+    WHERE true GROUP BY lower(city), day
+    ON CONFLICT (city, day) DO UPDATE SET recommendations = excluded.recommendations"""
+
+def sortable_timestamp(value):
+    """
+    Return the text stored in a timestamp column: UTC, to the millisecond like a BSON date.
+
+    Values that are not datetimes are stored as '' and sort before every date.
+    """
+    if not isinstance(value, datetime):
+        return ''
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}'
+
+def project(document, fields):
+    """
+    Return _id and the given fields of a document, like a MongoDB projection.
+
+    Args:
+        document (dict): Document
+        fields (list): Field names; dotted names select inside sub-documents
+
+    Returns:
+        dict: Projected document
+    """
+    projected = {'_id': document['_id']} if '_id' in document else {}
+    for field in fields:
+        source, target = document, projected
+        *parents, leaf = field.split('.')
+        for parent in parents:
+            source = source.get(parent)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(parent, {})
+        else:
+            if leaf in source:
+                target[leaf] = source[leaf]
+    return projected
+
+def find_index_names(plan):
+    """Return the indexes named in EXPLAIN QUERY PLAN rows ('PRIMARY KEY' for a primary key search)."""
+    names = []
+    for row in plan:
+        match = re.search(r'USING (?:COVERING )?INDEX (\w+)|USING (?:INTEGER )?(PRIMARY KEY)', row[-1])
+        if match:
+            names.append(match.group(1) or match.group(2))
+    return names
+
+class SQLiteDatabaseHandler:
+    def __init__(self, path=SQLITE_PATH, outfit_index_enabled=OUTFIT_INDEX_ENABLED,
+                 outfit_query_mode=OUTFIT_QUERY_MODE, per_category=OUTFIT_TOP_K_PER_CATEGORY, write_behind=False,
+                 recommendation_storage=RECOMMENDATION_STORAGE):
+        """
+        Open (or create) the SQLite database.
+
+        Args:
+            path (str): Database file
+            outfit_index_enabled (bool): Answer get_suitable_outfits from an in-memory catalog index
+            outfit_query_mode (str): 'aggregate' for the top per_category items of every category,
+                'find' for the top 10 items overall
+            per_category (int): Items per category in 'aggregate' mode
+            write_behind (bool): Accepted for DatabaseHandler compatibility; inserts are always written directly
+            recommendation_storage (str): 'normalized' to store outfit _ids and a weather reference,
+                'embedded' to store full copies of the weather and outfit documents
+        """
+        if outfit_query_mode not in OUTFIT_QUERY_MODES:
+            raise ValueError(f"Unsupported outfit query mode: {outfit_query_mode}")
+        if recommendation_storage not in RECOMMENDATION_STORAGE_MODES:
+            raise ValueError(f"Unsupported recommendation storage: {recommendation_storage}")
+        self.path = path
+        self.recommendation_storage = recommendation_storage
+        self.outfit_query_mode = outfit_query_mode
+        self.per_category = per_category
+        self.outfit_index_enabled = outfit_index_enabled
+        self._outfit_index = None
+        self._outfit_index_version = None
+        self._outfit_index_lock = threading.Lock()
+        self.outfit_index_hits = 0
+        self.outfit_index_fallbacks = 0
+        self.write_behind = None
+
+        self._local = threading.local()
+        self._connections = {}  # Thread -> its connection
+        self._connections_lock = threading.Lock()
+        try:
+            with self._connection() as connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+            logger.info(f"SQLite database opened at {path}")
+        except Exception as e:
+            logger.error(f"Failed to open SQLite database {path}: {e}")
+            raise
+
+    def _connection(self):
+        """Return this thread's connection, opening it on first use."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # check_same_thread=False only so close_connection can close it; each thread uses its own
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT,
+                                         cached_statements=SQLITE_CACHED_STATEMENTS, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints; safe with WAL
+            self._local.connection = connection
+            with self._connections_lock:
+                self._prune_connections()
+                self._connections[threading.current_thread()] = connection
+        return connection
+
+    def _prune_connections(self):
+        """Close the connections of threads that have ended. Call with _connections_lock held."""
+        for thread in [thread for thread in self._connections if not thread.is_alive()]:
+            self._connections.pop(thread).close()
+
+    def release_connection(self):
+        """
+        Close this thread's connection; the thread's next query opens a new one.
+
+        Called at the end of each web request, so a server thread never holds a
+        connection (and a WAL read snapshot) between requests.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+        self._local.connection = None
+        with self._connections_lock:
+            self._connections.pop(threading.current_thread(), None)
+            self._prune_connections()
+        connection.close()
+
+    def get_connection_count(self):
+        """Return the number of open connections."""
+        with self._connections_lock:
+            return len(self._connections)
+
+    def _query(self, sql, parameters=()):
+        """Run a SELECT of one document column and return the decoded documents."""
+        return [json_util.loads(row[0]) for row in self._connection().execute(sql, parameters)]
+
+    @staticmethod
+    def _document_row(document):
+        """Return (id, city, timestamp, document) for the weather and recommendations tables."""
+        city = document.get('city')
+        return (str(document['_id']), city if isinstance(city, str) else None,
+                sortable_timestamp(document.get('timestamp')), json_util.dumps(document))
+
+    @staticmethod
+    def _insert_outfits(connection, outfits):
+        """Insert outfit documents (with _ids) and their weather conditions."""
+        rows = []
+        for outfit in outfits:
+            category = outfit.get('category')
+            numbers = [outfit.get(field) if is_number(outfit.get(field)) else None
+                       for field in ('temp_min', 'temp_max', 'humidity_min', 'humidity_max', 'comfort_rating')]
+            rows.append((str(outfit['_id']), category if isinstance(category, str) else None, *numbers,
+                         json_util.dumps(outfit)))
+        connection.executemany(INSERT_OUTFIT, rows)
+        connection.executemany(INSERT_CONDITION, [(condition, str(outfit['_id'])) for outfit in outfits
+                                                  for condition in outfit_conditions(outfit)])
+
+    def test_connection(self):
+        """Test database connection."""
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except Exception as e:
+            logger.error(f"Database connection test failed: {e}")
+            return False
+
+    def flush_writes(self):
+        """Nothing to write: inserts are never queued with SQLite."""
+
+    def insert_weather_data(self, weather_data):
+        """Insert weather data (a dict or ParsedWeather) into database."""
+        try:
+            if hasattr(weather_data, 'to_bson'):
+                weather_data = weather_data.to_bson()
+            # Add timestamp
+            weather_data['timestamp'] = datetime.utcnow()
+            weather_data.setdefault('_id', ObjectId())
+            with self._connection() as connection:
+                connection.execute(INSERT_WEATHER, self._document_row(weather_data))
+            logger.debug(f"Weather data inserted with ID: {weather_data['_id']}")
+            return weather_data['_id']
+        except Exception as e:
+            logger.error(f"Error inserting weather data: {e}")
+            return None
+
+    def insert_outfit_data(self, outfit_data):
+        """Insert outfit data into database."""
+        try:
+            outfits = outfit_data if isinstance(outfit_data, list) else [outfit_data]
+            for outfit in outfits:
+                outfit.setdefault('_id', ObjectId())
+            with self._connection() as connection:
+                self._insert_outfits(connection, outfits)
+            if isinstance(outfit_data, list):
+                logger.info(f"Inserted {len(outfits)} outfit records")
+                return [outfit['_id'] for outfit in outfits]
+            logger.info(f"Outfit data inserted with ID: {outfit_data['_id']}")
+            return outfit_data['_id']
+        except Exception as e:
+            logger.error(f"Error inserting outfit data: {e}")
+            return None
+        finally:
+            self.bump_catalog_version()
+
+    def insert_recommendation(self, recommendation_data, weather_ref=None):
+        """
+        Insert recommendation into database.
+
+        Args:
+            recommendation_data (dict): Recommendation with full weather and outfit documents
+            weather_ref (ObjectId): _id of the stored weather document, kept in normalized storage
+
+        Returns:
+            ObjectId: ID of the recommendation, or None on error
+        """
+        try:
+            # Add timestamp
+            recommendation_data['timestamp'] = datetime.utcnow()
+            recommendation_data.setdefault('_id', ObjectId())
+            document = recommendation_data
+            if self.recommendation_storage == 'normalized':
+                document = normalize_recommendation(recommendation_data, weather_ref)
+            with self._connection() as connection:
+                connection.execute(INSERT_RECOMMENDATION, self._document_row(document))
+            logger.debug(f"Recommendation inserted with ID: {document['_id']}")
+            return document['_id']
+        except Exception as e:
+            logger.error(f"Error inserting recommendation: {e}")
+            return None
+
+    def get_weather_data(self, city=None, limit=10):
+        """Retrieve weather data from database, newest first. City names are matched case-insensitively."""
+        try:
+            if city:
+                return self._query(SELECT_CITY_WEATHER, (city, limit))
+            return self._query(SELECT_WEATHER, (limit,))
+        except Exception as e:
+            logger.error(f"Error retrieving weather data: {e}")
+            return []
+
+    def get_latest_weather(self, city):
+        """
+        Get the most recently stored weather document for a city.
+
+        City names are matched case-insensitively.
+
+        Args:
+            city (str): City name
+
+        Returns:
+            dict: Weather document or None if none is stored
+        """
+        try:
+            documents = self._query(SELECT_CITY_WEATHER, (city, 1))
+            return documents[0] if documents else None
+        except Exception as e:
+            logger.error(f"Error retrieving latest weather for {city}: {e}")
+            return None
+
+    def get_suitable_outfits(self, temperature, humidity, weather_condition):
+        """
+        Get suitable outfits based on weather conditions, highest comfort_rating first.
+
+        Same items in the same order as DatabaseHandler.get_suitable_outfits:
+        answered from the in-memory catalog index when it is enabled,
+        otherwise from the outfits table.
+        """
+        index = self.get_outfit_index() if is_number(temperature) and is_number(humidity) else None
+        if index is not None:
+            self.outfit_index_hits += 1
+            return index.find_suitable(temperature, humidity, weather_condition)
+        self.outfit_index_fallbacks += 1
+        return self._query_suitable_outfits(temperature, humidity, weather_condition)
+
+    def _query_suitable_outfits(self, temperature, humidity, weather_condition, mode=None):
+        """Get suitable outfits with an SQL query (see get_suitable_outfits)."""
+        try:
+            parameters = [temperature, temperature, humidity, humidity]
+            if weather_condition:
+                parameters.append(weather_condition.lower())
+            condition = CONDITION_FILTER if weather_condition else ''
+
+            if (mode or self.outfit_query_mode) == 'aggregate':
+                sql = SELECT_SUITABLE_PER_CATEGORY.format(condition=condition)
+                return [project(outfit, OUTFIT_FIELDS) for outfit in self._query(sql, parameters + [self.per_category])]
+            sql = SELECT_SUITABLE.format(condition=condition)
+            return self._query(sql, parameters + [SUITABLE_OUTFITS_LIMIT])
+        except Exception as e:
+            logger.error(f"Error getting suitable outfits: {e}")
+            return []
+
+    def get_outfit_index(self):
+        """
+        Return the in-memory outfit catalog index, loading it on first use
+        and again after the catalog version changes.
+
+        Returns:
+            OutfitCatalogIndex: Catalog index, or None if it is disabled or cannot be loaded
+        """
+        if not self.outfit_index_enabled:
+            return None
+        version = get_catalog_version()
+        index = self._outfit_index
+        if index is not None and self._outfit_index_version == version:
+            return index
+        with self._outfit_index_lock:
+            if self._outfit_index is None or self._outfit_index_version != version:
+                try:
+                    outfits = self._query("SELECT document FROM outfits")
+                    if self.outfit_query_mode == 'aggregate':
+                        self._outfit_index = OutfitCatalogIndex(outfits, self.per_category, OUTFIT_FIELDS)
+                    else:
+                        self._outfit_index = OutfitCatalogIndex(outfits)
+                    self._outfit_index_version = version
+                    logger.info(f"Outfit catalog index built with {len(self._outfit_index)} items (version {version})")
+                except Exception as e:
+                    logger.error(f"Error building outfit catalog index: {e}")
+                    self._outfit_index = None
+            return self._outfit_index
+
+    def bump_catalog_version(self):
+        """
+        Mark the outfit catalog as changed after writing to the outfits table.
+
+        Returns:
+            int: New catalog version
+        """
+        return bump_catalog_version()
+
+    def get_outfit_index_stats(self):
+        """Get outfit catalog index size and hit counters."""
+        index = self._outfit_index
+        stats = {
+            'enabled': self.outfit_index_enabled,
+            'loaded': index is not None,
+            'catalog_version': get_catalog_version(),
+            'index_version': self._outfit_index_version,
+            'hits': self.outfit_index_hits,
+            'fallbacks': self.outfit_index_fallbacks
+        }
+        if index is not None:
+            stats.update(index.get_stats())
+        return stats
+
+    def get_write_behind_stats(self):
+        """Get write-behind counters; SQLite writes directly."""
+        return {'enabled': False}
+
+    def hydrate_recommendations(self, recommendations):
+        """
+        Replace the outfit _ids of normalized recommendations with the outfit documents.
+
+        All outfits are read with one query. Outfits since removed from the
+        catalog are left out, and embedded recommendations are left as they are.
+
+        Args:
+            recommendations (list): Recommendation documents, changed in place
+
+        Returns:
+            list: The same recommendations, with 'items' in every group
+        """
+        groups = [group for recommendation in recommendations
+                  for group in recommendation.get('recommended_outfits') or []
+                  if isinstance(group, dict) and 'item_ids' in group]
+        if not groups:
+            return recommendations
+        try:
+            ids = json.dumps(list({str(outfit_id) for group in groups for outfit_id in group['item_ids']}))
+            outfits = {outfit['_id']: project(outfit, OUTFIT_FIELDS)
+                       for outfit in self._query(SELECT_OUTFITS_BY_ID, (ids,))}
+        except Exception as e:
+            logger.error(f"Error loading recommended outfits: {e}")
+            outfits = {}
+        for group in groups:
+            group['items'] = [dict(outfits[outfit_id]) for outfit_id in group.pop('item_ids')
+                              if outfit_id in outfits]
+        return recommendations
+
+    def get_recommendations_history(self, limit=10, summary=False):
+        """
+        Get recommendation history, newest first.
+
+        Args:
+            limit (int): Maximum number of recommendations
+            summary (bool): Return only HISTORY_FIELDS (city, time, count and weather),
+                without the recommended outfits
+
+        Returns:
+            list: Recommendation documents
+        """
+        try:
+            recommendations = self._query(SELECT_HISTORY, (limit,))
+            if summary:
+                return [project(recommendation, HISTORY_FIELDS) for recommendation in recommendations]
+            return self.hydrate_recommendations(recommendations)
+        except Exception as e:
+            logger.error(f"Error retrieving recommendations history: {e}")
+            return []
+
+    def migrate_recommendations(self, batch_size=500, dry_run=False):
+        """
+        Convert embedded recommendation documents to normalized storage.
+
+        Documents are rewritten in batches of batch_size, one transaction each.
+        Weather references are found by city and fetch time.
+
+        Args:
+            batch_size (int): Documents rewritten per transaction
+            dry_run (bool): Only measure the documents, write nothing
+
+        Returns:
+            dict: Documents 'migrated', and their JSON size in bytes 'before' and 'after'
+        """
+        stats = {'migrated': 0, 'before': 0, 'after': 0}
+        try:
+            last = ''
+            while True:
+                rows = self._connection().execute(
+                    "SELECT id, document FROM recommendations "
+                    "WHERE id > ? AND json_type(document, '$.weather_ref') IS NULL ORDER BY id LIMIT ?",
+                    (last, batch_size)).fetchall()
+                if not rows:
+                    break
+                last = rows[-1][0]
+                self._migrate_recommendation_batch([json_util.loads(document) for _, document in rows],
+                                                   stats, dry_run)
+            logger.info(f"{'Measured' if dry_run else 'Migrated'} {stats['migrated']} recommendations: "
+                        f"{stats['before']} -> {stats['after']} bytes")
+        except Exception as e:
+            logger.error(f"Error migrating recommendations: {e}")
+        return stats
+
+    def _migrate_recommendation_batch(self, batch, stats, dry_run):
+        """Normalize one batch of embedded recommendations (see migrate_recommendations)."""
+        keys = {}
+        for document in batch:
+            weather = document.get('weather')
+            if isinstance(weather, dict) and weather.get('fetch_time') and isinstance(weather.get('city'), str):
+                keys[document['_id']] = (weather['city'], weather['fetch_time'])
+
+        weather_refs = {}
+        if keys:
+            cities = json.dumps(list({city for city, _ in keys.values()}))
+            for weather in self._query("SELECT document FROM weather WHERE city IN (SELECT value FROM json_each(?))",
+                                       (cities,)):
+                weather_refs.setdefault((weather.get('city'), weather.get('fetch_time')), weather['_id'])
+
+        rows = []
+        before = after = 0
+        for document in batch:
+            normalized = normalize_recommendation(document, weather_refs.get(keys.get(document['_id'])))
+            before += len(json_util.dumps(document))
+            after += len(json_util.dumps(normalized))
+            rows.append((json_util.dumps(normalized), str(document['_id'])))
+        if not dry_run:
+            with self._connection() as connection:
+                connection.executemany("UPDATE recommendations SET document = ? WHERE id = ?", rows)
+        stats['migrated'] += len(batch)
+        stats['before'] += before
+        stats['after'] += after
+
+    def _collection_page_query(self, collection_name, limit=COLLECTION_PAGE_SIZE, after=None, filters=None):
+        """Build the SQL and parameters for get_collection_page, asking for one document more than limit."""
+        spec = COLLECTION_PAGES.get(collection_name)
+        if spec is None:
+            raise ValueError(f"Unknown collection: {collection_name}")
+        clauses, parameters = [], []
+        for field, value in (filters or {}).items():
+            if isinstance(value, tuple):
+                if field not in spec['ranges']:
+                    raise ValueError(f"Cannot filter {collection_name} by a range of {field}")
+                low, high = value
+                if low is not None or high is not None:
+                    # Missing timestamps ('') never fall in a range, as in MongoDB
+                    clauses.append(f"{PAGE_COLUMNS[field]} > ''")
+                if low is not None:
+                    clauses.append(f"{PAGE_COLUMNS[field]} >= ?")
+                    parameters.append(sortable_timestamp(low))
+                if high is not None:
+                    clauses.append(f"{PAGE_COLUMNS[field]} <= ?")
+                    parameters.append(sortable_timestamp(high))
+            elif field in spec['filters'] and not isinstance(value, (dict, list)):
+                column = PAGE_COLUMNS[field]
+                clauses.append(column if '?' in column else f"{column} = ?")
+                parameters.append(value)
+            else:
+                raise ValueError(f"Cannot filter {collection_name} by {field}")
+
+        sort = spec['sort']
+        columns = [PAGE_COLUMNS[field] for field, _ in sort]
+        if after:
+            # Every page sort is in one direction, so a row-value comparison walks the index
+            key = decode_page_cursor(collection_name, after)
+            operator = '>' if sort[0][1] == ASCENDING else '<'
+            clauses.append(f"({', '.join(columns)}) {operator} ({', '.join('?' * len(columns))})")
+            parameters.extend(sortable_timestamp(value) if field == 'timestamp' else str(value)
+                              for (field, _), value in zip(sort, key))
+        order = ', '.join(f"{column} {'ASC' if direction == ASCENDING else 'DESC'}"
+                          for column, (_, direction) in zip(columns, sort))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        sql = f"SELECT document FROM {COLLECTION_TABLES[collection_name]}{where} ORDER BY {order} LIMIT ?"
+        return sql, parameters + [limit + 1]
+
+    def get_collection_page(self, collection_name, limit=COLLECTION_PAGE_SIZE, after=None, fields=None, filters=None):
+        """
+        Get one page of a collection for the collection viewers.
+
+        Pages, cursors, filters and fields work as in DatabaseHandler.get_collection_page.
+
+        Returns:
+            dict: 'data' (documents) and 'next' (cursor, None on the last page), or None on database errors
+
+        Raises:
+            ValueError: Unknown collection, filter or field, or an invalid cursor
+        """
+        limit = max(1, min(int(limit), COLLECTION_PAGE_MAX))
+        sql, parameters = self._collection_page_query(collection_name, limit, after, filters)
+        if fields and not all(isinstance(field, str) and field and not field.startswith('$') for field in fields):
+            raise ValueError(f"Invalid fields: {fields}")
+        try:
+            documents = self._query(sql, parameters)
+        except Exception as e:
+            logger.error(f"Error retrieving {collection_name} page: {e}")
+            return None
+        more = len(documents) > limit
+        documents = documents[:limit]
+        next_cursor = encode_page_cursor(collection_name, documents[-1]) if more else None
+
+        spec = COLLECTION_PAGES[collection_name]
+        if fields:
+            documents = [project(document, list(fields) + [field for field, _ in spec['sort']])
+                         for document in documents]
+        elif spec['exclude']:
+            documents = [{key: value for key, value in document.items() if key not in spec['exclude']}
+                         for document in documents]
+        return {'data': documents, 'next': next_cursor}
+
+    def insert_record(self, collection_name, record):
+        """
+        Insert a document into a collection by its viewer name ('weather', 'outfit' or 'recommendations').
+
+        Returns:
+            ObjectId: ID of the document, or None on error
+        """
+        try:
+            record.setdefault('_id', ObjectId())
+            with self._connection() as connection:
+                if collection_name == 'outfit':
+                    self._insert_outfits(connection, [record])
+                else:
+                    insert = INSERT_WEATHER if collection_name == 'weather' else INSERT_RECOMMENDATION
+                    connection.execute(insert, self._document_row(record))
+            if collection_name == 'outfit':
+                self.bump_catalog_version()
+            return record['_id']
+        except Exception as e:
+            logger.error(f"Error inserting record into {collection_name}: {e}")
+            return None
+
+    def update_record(self, collection_name, record_id, changes):
+        """
+        Set fields of a document, like a MongoDB $set.
+
+        Args:
+            collection_name (str): 'weather', 'outfit' or 'recommendations'
+            record_id (str): _id of the document
+            changes (dict): Top-level fields to set (_id is ignored)
+
+        Returns:
+            bool: True if the document was found and changed
+        """
+        try:
+            table = COLLECTION_TABLES[collection_name]
+            with self._connection() as connection:
+                row = connection.execute(f"SELECT document FROM {table} WHERE id = ?", (str(record_id),)).fetchone()
+                if row is None:
+                    return False
+                document = json_util.loads(row[0])
+                updated = dict(document, **{key: value for key, value in changes.items() if key != '_id'})
+                if updated == document:
+                    return False
+                connection.execute(f"DELETE FROM {table} WHERE id = ?", (str(record_id),))
+                if collection_name == 'outfit':
+                    connection.execute("DELETE FROM outfit_conditions WHERE outfit_id = ?", (str(record_id),))
+                    self._insert_outfits(connection, [updated])
+                else:
+                    insert = INSERT_WEATHER if collection_name == 'weather' else INSERT_RECOMMENDATION
+                    connection.execute(insert, self._document_row(updated))
+            if collection_name == 'outfit':
+                self.bump_catalog_version()
+            return True
+        except Exception as e:
+            logger.error(f"Error updating record {record_id} in {collection_name}: {e}")
+            return False
+
+    def delete_record(self, collection_name, record_id):
+        """
+        Delete a document by _id.
+
+        Returns:
+            bool: True if a document was deleted
+        """
+        try:
+            table = COLLECTION_TABLES[collection_name]
+            with self._connection() as connection:
+                deleted = connection.execute(f"DELETE FROM {table} WHERE id = ?", (str(record_id),)).rowcount
+                if collection_name == 'outfit':
+                    connection.execute("DELETE FROM outfit_conditions WHERE outfit_id = ?", (str(record_id),))
+            if collection_name == 'outfit' and deleted:
+                self.bump_catalog_version()
+            return deleted > 0
+        except Exception as e:
+            logger.error(f"Error deleting record {record_id} from {collection_name}: {e}")
+            return False
+
+    def get_popular_cities(self, limit=10, since=None):
+        """
+        Get the most requested cities from the recommendation history.
+
+        Args:
+            limit (int): Maximum number of cities
+            since (datetime): Only count recommendations made after this time
+
+        Returns:
+            list: Dicts with 'city' and 'count', most requested first
+        """
+        try:
+            # '' (no timestamp) is only counted without a since
+            rows = self._connection().execute(SELECT_POPULAR_CITIES, (sortable_timestamp(since), limit))
+            return [{'city': city, 'count': count} for city, count in rows]
+        except Exception as e:
+            logger.error(f"Error retrieving popular cities: {e}")
+            return []
+
+    def _applied_retention(self):
+        """Return the retention in days currently applied to each table (None when detail is kept)."""
+        return dict(self._connection().execute("SELECT collection, days FROM retention"))
+
+    def ensure_indexes(self):
+        """
+        Create the indexes in INDEXES and apply the configured retention. Safe to call on every startup.
+
+        Before retention starts deleting a table's detail, or deletes it sooner,
+        everything stored is rolled up into daily summaries, as DatabaseHandler
+        does before enabling a TTL index. If that fails, the previous retention
+        stays in force and is tried again on the next call.
+
+        Returns:
+            bool: True if every index exists
+        """
+        success = True
+        try:
+            with self._connection() as connection:
+                for statement in INDEXES.values():
+                    connection.execute(statement)
+            logger.info(f"SQLite indexes: {', '.join(INDEXES)}")
+        except Exception as e:
+            logger.error(f"Error creating SQLite indexes: {e}")
+            success = False
+
+        try:
+            applied = self._applied_retention()
+            configured = {'weather': WEATHER_RETENTION_DAYS or None,
+                          'recommendations': RECOMMENDATION_RETENTION_DAYS or None}
+            held = set()
+            for table, days in configured.items():
+                current = applied.get(table)
+                stored = self._connection().execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone()
+                if days and stored and (current is None or days < current):
+                    held.add(table)
+            if held and self.rollup_daily_summaries(days=None):
+                held = set()
+            elif held:
+                logger.error(f"Not applying retention to {', '.join(sorted(held))} until stored detail is rolled up")
+            with self._connection() as connection:
+                connection.executemany("INSERT INTO retention (collection, days) VALUES (?, ?) "
+                                       "ON CONFLICT (collection) DO UPDATE SET days = excluded.days",
+                                       [(table, days) for table, days in configured.items() if table not in held])
+        except Exception as e:
+            logger.error(f"Error applying retention: {e}")
+        return success
+
+    def ensure_raw_weather_collection(self):
+        """Nothing to create: raw payloads stay in the weather documents with SQLite."""
+        return True
+
+    def rollup_daily_summaries(self, days=ROLLUP_LOOKBACK_DAYS):
+        """
+        Summarize weather and recommendations per city and UTC day into daily_summaries,
+        then delete detail older than the applied retention.
+
+        Each day's summary is recomputed from the stored detail and upserted,
+        so running this repeatedly is safe. A day whose detail retention has
+        started deleting is never recomputed.
+
+        Args:
+            days (int): Recompute this many days, including today; None for everything stored
+
+        Returns:
+            bool: True if both tables were rolled up
+        """
+        now = datetime.utcnow()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        success = True
+        try:
+            applied = self._applied_retention()
+        except Exception as e:
+            logger.error(f"Error reading retention: {e}")
+            return False
+        for table, rollup in (('weather', ROLLUP_WEATHER), ('recommendations', ROLLUP_RECOMMENDATIONS)):
+            retention_days = applied.get(table)
+            since = None
+            if days is not None:
+                since = today - timedelta(days=days - 1)
+                if retention_days:
+                    # The oldest day still stored is partly deleted already
+                    expiring = (now - timedelta(days=retention_days)).replace(hour=0, minute=0, second=0,
+                                                                             microsecond=0)
+                    since = max(since, expiring + timedelta(days=1))
+            try:
+                with self._connection() as connection:
+                    connection.execute(rollup, (sortable_timestamp(since) or '0',))
+                    if retention_days:
+                        cutoff = sortable_timestamp(now - timedelta(days=retention_days))
+                        deleted = connection.execute(f"DELETE FROM {table} WHERE timestamp > '' AND timestamp < ?",
+                                                     (cutoff,)).rowcount
+                        if deleted:
+                            logger.info(f"Deleted {deleted} {table} documents older than {retention_days} days")
+            except Exception as e:
+                logger.error(f"Error rolling up {table}: {e}")
+                success = False
+        return success
+
+    def get_daily_summaries(self, city=None, limit=30):
+        """
+        Get daily per-city summaries, newest day first. City names are matched case-insensitively.
+
+        Returns:
+            list: Dicts with 'city', 'day' ('YYYY-MM-DD'), and 'weather' and/or 'recommendations' totals
+        """
+        try:
+            sql = "SELECT city, day, weather, recommendations FROM daily_summaries"
+            if city:
+                rows = self._connection().execute(sql + " WHERE city = ? ORDER BY day DESC LIMIT ?", (city, limit))
+            else:
+                rows = self._connection().execute(sql + " ORDER BY day DESC LIMIT ?", (limit,))
+            summaries = []
+            for city_name, day, weather, recommendations in rows:
+                summary = {'city': city_name, 'day': day}
+                if weather:
+                    summary['weather'] = json.loads(weather)
+                if recommendations:
+                    summary['recommendations'] = json.loads(recommendations)
+                summaries.append(summary)
+            return summaries
+        except Exception as e:
+            logger.error(f"Error retrieving daily summaries: {e}")
+            return []
+
+    def verify_indexes(self):
+        """
+        Check with EXPLAIN QUERY PLAN that every hot query is answered from an index.
+
+        Returns:
+            dict: Query name -> name of the index its plan uses, or None for a full table scan
+        """
+        suitable = SELECT_SUITABLE.format(condition='')
+        after = encode_page_cursor('weather', {'timestamp': datetime(2000, 1, 1), '_id': ObjectId()})
+        queries = {
+            'get_suitable_outfits': (SELECT_SUITABLE.format(condition=CONDITION_FILTER), (20, 20, 50, 50, 'clear', 10)),
+            'get_suitable_outfits_any_condition': (suitable, (20, 20, 50, 50, 10)),
+            'get_weather_data': (SELECT_CITY_WEATHER, ('London', 10)),
+            'get_weather_data_all': (SELECT_WEATHER, (10,)),
+            'get_recommendations_history': (SELECT_HISTORY, (10,)),
+            'get_popular_cities': (SELECT_POPULAR_CITIES, (sortable_timestamp(datetime(2000, 1, 1)), 10)),
+            'get_collection_page_weather': self._collection_page_query('weather', after=after),
+            'get_collection_page_weather_city': self._collection_page_query('weather', after=after,
+                                                                            filters={'city': 'London'}),
+            'get_collection_page_outfit_category': self._collection_page_query('outfit', filters={'category': 'Top'}),
+            'get_collection_page_recommendations': self._collection_page_query(
+                'recommendations', after=encode_page_cursor('recommendations', {'timestamp': datetime(2000, 1, 1),
+                                                                                '_id': ObjectId()}))
+        }
+
+        results = {}
+        for name, (sql, parameters) in queries.items():
+            try:
+                plan = self._connection().execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+                names = find_index_names(plan)
+                results[name] = names[0] if names else None
+                if not names:
+                    logger.warning(f"Query {name} does not use an index")
+            except Exception as e:
+                logger.error(f"Error explaining query {name}: {e}")
+                results[name] = None
+        return results
+
+    def clear_collection(self, collection_name):
+        """Clear a specific collection."""
+        try:
+            if collection_name not in COLLECTION_TABLES:
+                logger.error(f"Unknown collection: {collection_name}")
+                return False
+            with self._connection() as connection:
+                deleted = connection.execute(f"DELETE FROM {COLLECTION_TABLES[collection_name]}").rowcount
+                if collection_name == 'outfit':
+                    connection.execute("DELETE FROM outfit_conditions")
+            if collection_name == 'outfit':
+                self.bump_catalog_version()
+            logger.info(f"Cleared {deleted} documents from {collection_name} collection")
+            return True
+        except Exception as e:
+            logger.error(f"Error clearing collection {collection_name}: {e}")
+            return False
+
+    def get_collection_stats(self):
+        """Get statistics about all collections."""
+        try:
+            connection = self._connection()
+            return {
+                'weather_count': connection.execute("SELECT COUNT(*) FROM weather").fetchone()[0],
+                'outfit_count': connection.execute("SELECT COUNT(*) FROM outfits").fetchone()[0],
+                'recommendations_count': connection.execute("SELECT COUNT(*) FROM recommendations").fetchone()[0]
+            }
+        except Exception as e:
+            logger.error(f"Error getting collection stats: {e}")
+            return {}
+
+    def close_connection(self):
+        """Close every thread's connection."""
+        try:
+            with self._connections_lock:
+                for connection in self._connections.values():
+                    connection.close()
+                self._connections = {}
+            self._local = threading.local()
+            logger.info("Database connection closed")
+        except Exception as e:
+            logger.error(f"Error closing database connection: {e}")
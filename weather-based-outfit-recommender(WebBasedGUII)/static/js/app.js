@@ -3,6 +3,8 @@ class WeatherOutfitApp {
     constructor() {
         this.currentData = null;
         this.selectedRecords = new Set();
+        this.nextCursor = null;
+        this.pageNumber = 0;
         this.heatmapChart = null;
         this.init();
     }
@@ -22,6 +24,7 @@ class WeatherOutfitApp {
             e.preventDefault();
             this.getRecommendation();
         });
+        document.getElementById('cityInput').addEventListener('input', (e) => this.suggestCities(e.target.value));
 
         // Recommendation tab buttons
         document.getElementById('viewHistoryBtn').addEventListener('click', () => this.showHistory());
@@ -30,6 +33,7 @@ class WeatherOutfitApp {
 
         // Collection tab buttons
         document.getElementById('loadDataBtn').addEventListener('click', () => this.loadCollectionData());
+        document.getElementById('nextPageBtn').addEventListener('click', () => this.loadCollectionData(true));
         document.getElementById('addRecordBtn').addEventListener('click', () => this.showAddRecordModal());
         document.getElementById('editRecordBtn').addEventListener('click', () => this.showEditRecordModal());
         document.getElementById('deleteRecordBtn').addEventListener('click', () => this.deleteSelectedRecords());
@@ -89,6 +93,30 @@ class WeatherOutfitApp {
     }
 
     // Recommendation Methods
+    async suggestCities(prefix) {
+        const datalist = document.getElementById('citySuggestions');
+        prefix = prefix.trim();
+        if (prefix.length < 2) {
+            datalist.innerHTML = '';
+            return;
+        }
+
+        try {
+            const response = await fetch(`/api/cities/suggest?prefix=${encodeURIComponent(prefix)}`);
+            const data = await response.json();
+            if (data.success && document.getElementById('cityInput').value.trim() === prefix) {
+                // Built as elements so city names from the server cannot inject markup
+                datalist.replaceChildren(...data.cities.map(city => {
+                    const option = document.createElement('option');
+                    option.value = `${city.name},${city.country}`;
+                    return option;
+                }));
+            }
+        } catch (error) {
+            console.error('City suggestion error:', error);
+        }
+    }
+
     async getRecommendation() {
         const city = document.getElementById('cityInput').value.trim();
         if (!city) {
@@ -149,11 +177,22 @@ class WeatherOutfitApp {
                     <p class="mb-0 text-muted">
                         ${weather.weather_description} • Humidity: ${weather.humidity}%
                     </p>
+                    ${weather.stale ? `
+                    <p class="mb-0 text-warning">
+                        <i class="fas fa-clock me-1"></i>Weather service unavailable. Showing last known weather${this.formatAge(weather.stale_age_seconds)}.
+                    </p>` : ''}
                 </div>
             </div>
         `;
     }
 
+    formatAge(seconds) {
+        if (seconds === null || seconds === undefined) return '';
+        if (seconds < 3600) return ` from ${Math.max(1, Math.round(seconds / 60))} min ago`;
+        if (seconds < 86400) return ` from ${Math.round(seconds / 3600)} h ago`;
+        return ` from ${Math.round(seconds / 86400)} days ago`;
+    }
+
     displayRecommendations(outfits, advice) {
         const resultsDiv = document.getElementById('recommendationResults');
         
@@ -348,34 +387,59 @@ class WeatherOutfitApp {
     }
 
     // Collection Methods
-    async loadCollectionData() {
+    collectionQuery(nextPage) {
+        // Filters are typed as "field=value, field_from=value"; fields as "a,b"
+        const params = new URLSearchParams();
+        document.getElementById('collectionFilter').value.split(',').forEach(part => {
+            const [field, ...value] = part.split('=');
+            if (field.trim() && value.length > 0) {
+                params.append(field.trim(), value.join('=').trim());
+            }
+        });
+        const fields = document.getElementById('collectionFields').value.trim();
+        if (fields) {
+            params.append('fields', fields);
+        }
+        if (nextPage && this.nextCursor) {
+            params.append('after', this.nextCursor);
+        }
+        return params.toString();
+    }
+
+    async loadCollectionData(nextPage = false) {
         const collection = document.getElementById('collectionSelect').value;
         const loadBtn = document.getElementById('loadDataBtn');
+        const nextBtn = document.getElementById('nextPageBtn');
         const statusDiv = document.getElementById('collectionStatus');
         const tableBody = document.querySelector('#collectionTable tbody');
         const tableHead = document.querySelector('#collectionTable thead');
         
         loadBtn.disabled = true;
+        nextBtn.disabled = true;
         statusDiv.textContent = 'Loading data...';
         this.selectedRecords.clear();
 
         try {
-            const response = await fetch(`/api/collections/${collection}`);
+            const response = await fetch(`/api/collections/${collection}?${this.collectionQuery(nextPage)}`);
             const data = await response.json();
             
             if (data.success && data.data.length > 0) {
                 this.currentData = data.data;
+                this.nextCursor = data.next;
+                this.pageNumber = nextPage ? this.pageNumber + 1 : 1;
                 this.renderTable(data.data);
-                statusDiv.textContent = `Loaded ${data.data.length} records from '${collection}' collection.`;
+                statusDiv.textContent = `Loaded ${data.data.length} records from '${collection}' collection (page ${this.pageNumber}${data.next ? '' : ', last'}).`;
             } else {
+                this.nextCursor = null;
                 tableHead.innerHTML = '';
                 tableBody.innerHTML = '<tr><td colspan="100%" class="text-center text-muted">No data found</td></tr>';
-                statusDiv.textContent = 'No data found.';
+                statusDiv.textContent = data.success ? 'No data found.' : `Error loading data: ${data.error}`;
             }
         } catch (error) {
             statusDiv.textContent = `Error loading data: ${error.message}`;
         } finally {
             loadBtn.disabled = false;
+            nextBtn.disabled = !this.nextCursor;
         }
     }
 
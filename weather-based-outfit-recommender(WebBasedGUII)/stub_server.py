@@ -0,0 +1,308 @@
+# stub_server.py
+"""
+Local stand-in for the OpenWeatherMap current-weather endpoint.
+
+Replays recorded responses with configurable latency, server errors and 429
+bursts, so caching, connection pooling and the circuit breaker can be load
+tested offline. Point the app at it through the environment:
+
+    python stub_server.py --recordings recordings.json --latency 0.05
+    OPENWEATHER_BASE_URL=http://127.0.0.1:8085/data/2.5/weather python app.py
+
+Recordings come from a JSON file (a list of API payloads), from the
+weather_data collection (--from-db), or are captured from the real API
+(--record FILE proxies cities that have no recording yet).
+"""
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from gazetteer import normalize_city_name
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NOT_FOUND = {'cod': '404', 'message': 'city not found'}
+TOO_MANY_REQUESTS = {'cod': 429, 'message': 'Your account is temporary blocked due to exceeding of requests limitation.'}
+SERVER_ERROR = {'cod': '500', 'message': 'Internal error'}
+
+def payload_from_document(document):
+    """
+    Rebuild an API payload from a stored weather document.
+
+    The document's raw_data is used when it was kept (STORE_RAW_WEATHER);
+    otherwise a payload with the fields the app reads is built from the parsed fields.
+    """
+    if document.get('raw_data'):
+        return document['raw_data']
+    return {
+        'weather': [{'id': document.get('weather_id'), 'main': document.get('weather_main'),
+                     'description': document.get('weather_description')}],
+        'main': {'temp': document.get('temperature'), 'feels_like': document.get('feels_like'),
+                 'humidity': document.get('humidity')},
+        'sys': {'country': document.get('country')},
+        'name': document.get('city'),
+        'cod': 200
+    }
+
+def load_recordings(path):
+    """Load recorded payloads from a JSON file holding a list of API responses."""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def load_recordings_from_db(db, limit=1000):
+    """Load the latest stored payload for each city in the weather_data collection."""
+    payloads = {}
+    for document in db.get_weather_data(limit=limit):  # Newest first
+        if document.get('city'):
+            payloads.setdefault(normalize_city_name(document['city']), payload_from_document(document))
+    return list(payloads.values())
+
+class StubWeatherServer:
+    def __init__(self, recordings=(), host='127.0.0.1', port=0, latency=0.0, jitter=0.0, slow_rate=0.0,
+                 slow_latency=0.0, error_rate=0.0, burst_every=0, burst_length=0, retry_after=1, any_city=False,
+                 record_to=None, upstream_url=None, api_key=None):
+        """
+        Initialize the stub server.
+
+        Args:
+            recordings (list): API payloads to replay, looked up by their 'name'
+            host (str): Interface to listen on
+            port (int): Port to listen on, 0 for any free port
+            latency (float): Seconds to wait before each response
+            jitter (float): Extra random delay of up to this many seconds
+            slow_rate (float): Fraction of requests answered after slow_latency instead, for tail latency
+            slow_latency (float): Seconds to wait before a slow response
+            error_rate (float): Fraction of requests answered with a 500
+            burst_every (int): Start a 429 burst after this many requests, 0 to disable
+            burst_length (int): Number of consecutive 429 responses in a burst
+            retry_after (int): Retry-After seconds sent with 429 responses
+            any_city (bool): Answer unknown cities with a recording renamed to them instead of a 404
+            record_to (str): Proxy unknown cities to the real API and save recordings to this file
+            upstream_url (str): Real API endpoint used when recording
+            api_key (str): API key used when recording
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.any_city = any_city
+        self.record_to = record_to
+        self.upstream_url = upstream_url
+        self.api_key = api_key
+
+        self._lock = threading.Lock()
+        self._recordings = {}
+        self._by_id = {}
+        for payload in recordings:
+            self.add_recording(payload)
+
+        self.requests = 0
+        self.status_counts = {}
+
+        handler = type('StubHandler', (StubRequestHandler,), {'stub': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Endpoint to use as OPENWEATHER_BASE_URL."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/data/2.5/weather"
+
+    def start(self):
+        """Serve requests in a daemon thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_recording(self, payload):
+        """Add or replace the recording for the payload's city."""
+        with self._lock:
+            self._recordings[normalize_city_name(payload.get('name', ''))] = payload
+            if payload.get('id') is not None:
+                self._by_id[str(payload['id'])] = payload
+
+    def get_recordings(self):
+        """Return all recorded payloads."""
+        with self._lock:
+            return list(self._recordings.values())
+
+    def save_recordings(self, path):
+        """Write all recorded payloads to a JSON file."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.get_recordings(), f, indent=2)
+
+    def respond(self, params):
+        """
+        Pick the response for a request.
+
+        Args:
+            params (dict): Query parameters (single values)
+
+        Returns:
+            tuple: (status code, payload, extra headers)
+        """
+        with self._lock:
+            self.requests += 1
+            count = self.requests
+
+        if self.slow_rate and random.random() < self.slow_rate:
+            time.sleep(self.slow_latency)
+        elif self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        # Requests 1..burst_every succeed, the next burst_length get a 429, and so on
+        if self.burst_every and self.burst_length:
+            if (count - 1) % (self.burst_every + self.burst_length) >= self.burst_every:
+                return 429, TOO_MANY_REQUESTS, {'Retry-After': str(self.retry_after)}
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, SERVER_ERROR, {}
+
+        payload = self.find_recording(params)
+        if payload is None and self.record_to and 'q' in params:
+            payload = self._record(params)
+        if payload is None:
+            return 404, NOT_FOUND, {}
+        return 200, payload, {}
+
+    def find_recording(self, params):
+        """Find the recording for a q (city name), id or lat/lon request."""
+        with self._lock:
+            if not self._recordings:
+                return None
+            if 'id' in params:
+                return self._by_id.get(params['id'])
+            if 'lat' in params and 'lon' in params:
+                lat, lon = float(params['lat']), float(params['lon'])
+                located = [p for p in self._recordings.values() if p.get('coord')]
+                if not located:
+                    return None
+                return min(located, key=lambda p: (p['coord']['lat'] - lat) ** 2 + (p['coord']['lon'] - lon) ** 2)
+
+            name = params.get('q', '').split(',')[0]
+            payload = self._recordings.get(normalize_city_name(name))
+            if payload is None and self.any_city and name.strip():
+                template = next(iter(self._recordings.values()))
+                payload = dict(template, name=name.strip().title())
+            return payload
+
+    def _record(self, params):
+        """Fetch a city from the real API, keep the payload and save the recordings."""
+        import requests
+
+        try:
+            response = requests.get(self.upstream_url, timeout=10,
+                                    params={'q': params['q'], 'appid': self.api_key, 'units': 'metric'})
+            if response.status_code != 200:
+                logger.warning(f"Not recording {params['q']}: upstream returned {response.status_code}")
+                return None
+            payload = response.json()
+            self.add_recording(payload)
+            self.save_recordings(self.record_to)
+            logger.info(f"Recorded weather for {payload.get('name')}")
+            return payload
+        except Exception as e:
+            logger.error(f"Error recording weather for {params['q']}: {e}")
+            return None
+
+    def count_status(self, status):
+        """Count a response sent with the given status code."""
+        with self._lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def get_stats(self):
+        """Get request and response-status counters."""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'recordings': len(self._recordings),
+                'status_counts': dict(self.status_counts)
+            }
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Answers GET requests from a StubWeatherServer (bound as the stub class attribute)."""
+    protocol_version = 'HTTP/1.1'  # Allow keep-alive connections
+    disable_nagle_algorithm = True  # Headers and body are written separately
+    stub = None
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        status, payload, headers = self.stub.respond(params)
+        self.stub.count_status(status)
+
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown load-test output
+
+# Run the stub server on its own
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded OpenWeatherMap responses.")
+    parser.add_argument('--recordings', help="JSON file with a list of recorded API payloads")
+    parser.add_argument('--from-db', action='store_true', help="Replay payloads stored in the weather_data collection")
+    parser.add_argument('--record', metavar='FILE', help="Proxy unknown cities to the real API and save them to FILE")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay of up to this many seconds")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="Fraction of requests answered slowly")
+    parser.add_argument('--slow-latency', type=float, default=1.0, help="Seconds before a slow response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument('--burst-every', type=int, default=0, help="Start a 429 burst after this many requests")
+    parser.add_argument('--burst-length', type=int, default=0, help="Consecutive 429 responses per burst")
+    parser.add_argument('--any-city', action='store_true', help="Answer unknown cities instead of returning 404")
+    args = parser.parse_args()
+
+    recordings = []
+    if args.recordings:
+        recordings.extend(load_recordings(args.recordings))
+    if args.record and not args.recordings:
+        try:
+            recordings.extend(load_recordings(args.record))
+        except FileNotFoundError:
+            pass  # Start a new recording file
+    if args.from_db:
+        from db_handler import create_database_handler
+
+        db = create_database_handler()
+        recordings.extend(load_recordings_from_db(db))
+        db.close_connection()
+
+    from config import OPENWEATHER_API_KEY, OPENWEATHER_UPSTREAM_URL
+
+    stub = StubWeatherServer(recordings, host=args.host, port=args.port, latency=args.latency,
+                             jitter=args.jitter, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                             error_rate=args.error_rate, burst_every=args.burst_every,
+                             burst_length=args.burst_length, any_city=args.any_city, record_to=args.record,
+                             upstream_url=OPENWEATHER_UPSTREAM_URL, api_key=OPENWEATHER_API_KEY)
+    print(f"Stub weather server replaying {len(stub.get_recordings())} recordings at {stub.base_url}")
+    print(f"Run the app with OPENWEATHER_BASE_URL={stub.base_url}. Press Ctrl+C to stop.")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nStopping stub server: {stub.get_stats()}")
+    finally:
+        stub.server.server_close()
@@ -0,0 +1,223 @@
+# write_behind.py
+"""
+Write-behind buffering for MongoDB inserts.
+
+Weather and recommendation documents are queued by the request thread and
+written by a background thread with one insert_many per collection, once
+enough documents are waiting or the oldest has waited long enough. The queue
+is bounded: when it is full, writers wait briefly and then insert the
+document themselves, so nothing is dropped. A batch that fails with a
+connection error or timeout goes back to the front of the queue and is
+retried with backoff, up to WRITE_BEHIND_MAX_RETRIES times.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, PyMongoError, WTimeoutError
+from config import (WRITE_BEHIND_MAX_QUEUE, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_INTERVAL,
+                    WRITE_BEHIND_ENQUEUE_TIMEOUT, WRITE_BEHIND_MAX_RETRIES, WRITE_BEHIND_RETRY_DELAY)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Errors after which the same batch may succeed later (server selection timeouts,
+# network errors and primary stepdowns are ConnectionFailures)
+TRANSIENT_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
+DUPLICATE_KEY_ERROR = 11000
+
+class WriteBehindBuffer:
+    def __init__(self, max_queue=WRITE_BEHIND_MAX_QUEUE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL, enqueue_timeout=WRITE_BEHIND_ENQUEUE_TIMEOUT,
+                 max_retries=WRITE_BEHIND_MAX_RETRIES, retry_delay=WRITE_BEHIND_RETRY_DELAY):
+        """
+        Initialize the buffer. The flushing thread starts with the first document.
+
+        Args:
+            max_queue (int): Documents that may wait before writers are held back
+            batch_size (int): Flush as soon as this many documents are waiting
+            flush_interval (float): Flush once the oldest document has waited this many seconds
+            enqueue_timeout (float): Seconds a writer waits for room before writing the document itself
+            max_retries (int): Times a batch is retried after a transient error before it is dropped
+            retry_delay (float): Seconds before the first retry, doubled on every further retry
+        """
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._queue = deque()  # (collection, document, enqueued at, failed attempts)
+        self._retry_at = 0.0  # No flush before this time.monotonic() value after a transient error
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()  # One batch at a time keeps collection order
+        self._closed = False
+        self._thread = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.overflows = 0
+        self.max_depth = 0
+        self.total_flush_time = 0.0
+        self.last_flush_ms = None
+
+    def put(self, collection, document):
+        """
+        Queue a document for insertion.
+
+        Args:
+            collection (Collection): Collection the document belongs to
+            document (dict): Document to insert; it must already have an _id
+
+        Returns:
+            bool: True if queued; False if the caller must insert it itself
+                (buffer closed, or still full after enqueue_timeout)
+        """
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self._condition:
+            while not self._closed and len(self._queue) >= self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.overflows += 1
+                    return False
+                self._condition.wait(remaining)
+            if self._closed:
+                return False
+
+            self._queue.append((collection, document, time.monotonic(), 0))
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._condition.notify_all()  # Start the flush timer, or flush a full batch now
+            return True
+
+    def _run(self):
+        """Flush batches until closed and drained, waiting out the backoff after transient errors."""
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed and not self._queue:
+                        return
+                    now = time.monotonic()
+                    if self._retry_at > now:
+                        wait = self._retry_at - now
+                    elif self._closed or len(self._queue) >= self.batch_size:
+                        break
+                    elif self._queue:
+                        wait = self._queue[0][2] + self.flush_interval - now
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._condition.wait(wait)
+            self.flush()
+
+    def flush(self):
+        """
+        Write every queued document now.
+
+        Documents whose write fails with a transient error are put back at the
+        front of the queue, in order, and retried after a backoff; after
+        max_retries failed attempts they are dropped and counted as failed.
+
+        Returns:
+            int: Number of documents written
+        """
+        with self._flush_lock:
+            with self._condition:
+                if self._queue and not self._closed and time.monotonic() < self._retry_at:
+                    return 0  # Backing off after a transient error; the flushing thread retries
+                batch = list(self._queue)
+                self._queue.clear()
+                self._condition.notify_all()  # Wake writers waiting for room
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            by_collection = {}
+            for entry in batch:
+                by_collection.setdefault(entry[0].name, (entry[0], []))[1].append(entry)
+
+            written = 0
+            retry = []
+            for name, (collection, entries) in by_collection.items():
+                documents = [entry[1] for entry in entries]
+                try:
+                    result = collection.insert_many(documents, ordered=False)
+                    written += len(result.inserted_ids)
+                except TRANSIENT_ERRORS as e:
+                    # The whole batch is retried; documents the server stored before the error
+                    # come back as duplicate _ids and are counted as written then
+                    kept = [(c, d, t, attempts + 1) for c, d, t, attempts in entries if attempts < self.max_retries]
+                    retry.extend(kept)
+                    with self._condition:
+                        self.failed += len(entries) - len(kept)
+                    if len(kept) < len(entries):
+                        logger.error(f"Giving up on {len(entries) - len(kept)} documents for {name} "
+                                     f"after {self.max_retries} retries: {e}")
+                    if kept:
+                        logger.warning(f"Error writing {len(kept)} documents to {name}, retrying: {e}")
+                except PyMongoError as e:
+                    # With ordered=False a bad document does not stop the rest of the batch
+                    inserted = 0
+                    if isinstance(e, BulkWriteError):
+                        inserted = e.details.get('nInserted', 0)
+                        if any(entry[3] for entry in entries):
+                            # Stored by an earlier attempt that failed after reaching the server
+                            inserted += sum(1 for error in e.details.get('writeErrors', [])
+                                            if error.get('code') == DUPLICATE_KEY_ERROR)
+                    written += inserted
+                    with self._condition:
+                        self.failed += len(documents) - inserted
+                    logger.error(f"Error writing {len(documents) - inserted} documents to {name}: {e}")
+
+            elapsed = time.perf_counter() - start
+            with self._condition:
+                if retry:
+                    retry.sort(key=lambda entry: entry[2])  # Back in enqueue order
+                    self._queue.extendleft(reversed(retry))
+                    attempts = max(entry[3] for entry in retry)
+                    self._retry_at = time.monotonic() + self.retry_delay * 2 ** (attempts - 1)
+                    self.retries += 1
+                self.written += written
+                self.flushes += 1
+                self.total_flush_time += elapsed
+                self.last_flush_ms = round(elapsed * 1000, 2)
+            logger.debug(f"Wrote {written} queued documents in {elapsed * 1000:.1f} ms")
+            return written
+
+    def close(self, timeout=10):
+        """Stop accepting documents and write everything still queued."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def get_stats(self):
+        """Get queue depth, throughput and flush latency counters."""
+        with self._condition:
+            return {
+                'queue_depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'capacity': self.max_queue,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'failed': self.failed,
+                'retries': self.retries,
+                'overflows': self.overflows,
+                'flushes': self.flushes,
+                'avg_batch': round(self.written / self.flushes, 1) if self.flushes else 0.0,
+                'avg_flush_ms': round(self.total_flush_time / self.flushes * 1000, 2) if self.flushes else 0.0,
+                'last_flush_ms': self.last_flush_ms
+            }